@@ -0,0 +1,212 @@
+"""
+对比固定检索策略（每个问题重排序前 10 个候选）与自适应检索策略的延迟和参考来源一致性
+
+同一组问题（知识库相关问题 + 闲聊/无关问题）分别用两种策略检索并重排序，统计：
+    - 检索 + 重排序的平均/P50/P95 延迟，重排序的输入对总数
+    - 自适应策略各动作（off_topic / decisive / flat / rerank）的次数
+    - 相关问题上与固定策略 top-k 参考来源的重合比例和第一名一致的比例
+    - 无关问题被直接判为 off_topic 的比例、相关问题被误判的个数
+另外打印两类问题最高相似度和第一、二名差值的分布，用于校准 ADAPTIVE_* 阈值。
+
+默认离线运行：向量用字符二元组哈希（与 e2e_benchmark 的本地替身相同），重排序在没有 BGE 模型时
+用按字符二元组重合度打分、并按输入对数计时的替身。--online 时调用真实的 DashScope 向量化接口，
+这时得到的相似度分布才能用来设置线上的阈值。
+用法: python benchmarks/adaptive_benchmark.py --chunks 1418 --relevance-floor 0.3 --margin 0.1
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.e2e_benchmark import CONVERSATIONS, bge_available, hashed_embedding
+from benchmarks.server_benchmark import QUESTIONS, StandInReranker
+from src.adaptive_retrieval import AdaptiveRetrievalPolicy
+from src.config import Config
+from src.dashscope_client import DashScopeClient
+from src.embedding_engine import EmbeddingBackend
+from src.query_processor import QueryEngine
+from src.vector_store import VectorStore
+
+ON_TOPIC = list(dict.fromkeys([conversation[0] for conversation in CONVERSATIONS] + QUESTIONS + [
+    "高血压患者饮食上要注意什么？",
+    "牛奶和奶制品每天应该摄入多少？",
+    "如何判断自己的体重是否健康？",
+    "鸡蛋每天吃几个合适？",
+]))
+
+OFF_TOPIC = [
+    "你好",
+    "今天天气怎么样？",
+    "给我讲个笑话吧",
+    "你是谁开发的？",
+    "帮我写一首关于秋天的诗",
+    "明天股市会涨吗？",
+    "推荐一部好看的电影",
+    "Python 怎么读取文件？",
+]
+
+
+class HashedEmbeddingBackend(EmbeddingBackend):
+    """离线向量化：字符二元组哈希，字面相近的文本相似度高"""
+
+    def __init__(self, dimensions: int, latency: float):
+        self.model = "hashed-bigram"
+        self.dimensions = dimensions
+        self.latency = latency
+
+    def embed(self, texts):
+        time.sleep(self.latency)
+        return np.stack([hashed_embedding(text, self.dimensions) for text in texts])
+
+
+class OverlapReranker(StandInReranker):
+    """重排序替身：计时同 StandInReranker，分数为问题与分块字符二元组的重合比例"""
+
+    def __init__(self, overhead: float, per_pair: float):
+        super().__init__(overhead, per_pair)
+        self.pairs = 0
+
+    @staticmethod
+    def _bigrams(text: str) -> set:
+        return {text[i:i + 2] for i in range(len(text) - 1)}
+
+    def score_many(self, requests):
+        self.pairs += sum(len(chunks) for _, chunks in requests)
+        super().score_many(requests)
+        results = []
+        for query, chunks in requests:
+            grams = self._bigrams(query)
+            results.append([len(grams & self._bigrams(chunk["text"])) / (len(grams) or 1) for chunk in chunks])
+        return results
+
+
+def build_store(args, client) -> VectorStore:
+    with open(ROOT / "knowledge_base" / "texts.json", 'r', encoding='utf-8') as f:
+        texts = json.load(f)[:args.chunks]
+    with open(ROOT / "knowledge_base" / "metadata.json", 'r', encoding='utf-8') as f:
+        metadata = json.load(f)[:args.chunks]
+    store = VectorStore(tempfile.mkdtemp(), client)
+    store.add_embeddings(texts, metadata)
+    store.save()
+    store.load()
+    return store
+
+
+def make_reranker(args):
+    if args.reranker == "bge" or (args.reranker == "auto" and bge_available()):
+        from src.reranker import Reranker
+        reranker = Reranker(Config.BGE_RERANKER_PATH, backend=Config.RERANKER_BACKEND,
+                            batch_size=Config.RERANKER_BATCH_SIZE, cache_size=0)
+        return reranker, "bge"
+    return OverlapReranker(args.rerank_overhead, args.rerank_per_pair), "stand-in"
+
+
+def run_policy(args, client, store, adaptive: bool) -> dict:
+    engine = QueryEngine(client, store)
+    engine._reranker, reranker_name = make_reranker(args)
+    if adaptive:
+        engine.adaptive = AdaptiveRetrievalPolicy(args.relevance_floor, args.margin, args.flat_spread,
+                                                  args.expand_factor)
+    results = {}
+    for question in ON_TOPIC + OFF_TOPIC:
+        before = dict(engine.adaptive.counts) if adaptive else {}
+        start = time.perf_counter()
+        chunks = engine._relevant_chunks(question, args.top_k, args.rerank_top_n, args.mode)
+        seconds = time.perf_counter() - start
+        action = "rerank"
+        if adaptive:
+            action = next(name for name, count in engine.adaptive.counts.items() if count != before[name])
+        results[question] = {"ids": [chunk["id"] for chunk in chunks], "seconds": seconds, "action": action}
+    pairs = getattr(engine._reranker, "pairs", None)
+    if pairs is None:
+        pairs = engine._reranker.cache_misses
+    return {"questions": results, "pairs": pairs, "reranker": reranker_name}
+
+
+def similarity_profile(client, store, questions) -> dict:
+    """每个问题向量检索前两名的相似度：最高相似度和第一、二名的差值"""
+    top1, margins = [], []
+    for question in questions:
+        hits = store.search(client.get_embeddings([question])[0], top_k=2)
+        top1.append(hits[0]["similarity"])
+        margins.append(hits[0]["similarity"] - hits[1]["similarity"])
+    return {"top1": np.array(top1), "margin": np.array(margins)}
+
+
+def describe(values: np.ndarray) -> str:
+    return (f"最小 {values.min():.3f}  P25 {np.percentile(values, 25):.3f}  中位 {np.median(values):.3f}  "
+            f"P75 {np.percentile(values, 75):.3f}  最大 {values.max():.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=0, help="知识库使用的文本块数（默认全部）")
+    parser.add_argument("--online", action="store_true", help="使用 DashScope 向量化接口（需要 API Key）")
+    parser.add_argument("--mode", choices=("dense", "hybrid"), default=Config.RETRIEVAL_MODE
+                        if Config.RETRIEVAL_MODE in ("dense", "hybrid") else "hybrid")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--rerank-top-n", type=int, default=10)
+    parser.add_argument("--relevance-floor", type=float, default=Config.ADAPTIVE_RELEVANCE_FLOOR)
+    parser.add_argument("--margin", type=float, default=Config.ADAPTIVE_SKIP_MARGIN)
+    parser.add_argument("--flat-spread", type=float, default=Config.ADAPTIVE_FLAT_SPREAD)
+    parser.add_argument("--expand-factor", type=int, default=Config.ADAPTIVE_EXPAND_FACTOR)
+    parser.add_argument("--reranker", choices=("auto", "bge", "stand-in"), default="auto")
+    parser.add_argument("--rerank-overhead", type=float, default=0.03, help="重排序替身每次前向的固定耗时（秒）")
+    parser.add_argument("--rerank-per-pair", type=float, default=0.01, help="重排序替身每个输入对的耗时（秒）")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="离线向量化的单次请求耗时（秒）")
+    args = parser.parse_args()
+
+    Config.EMBEDDING_CACHE_DIR = ""
+    Config.ANSWER_CACHE_ENABLED = False
+    Config.ADAPTIVE_RETRIEVAL_ENABLED = False
+    backend = None if args.online else HashedEmbeddingBackend(Config.EMBEDDING_DIMENSIONS, args.embedding_latency)
+    client = DashScopeClient(Config.DASHSCOPE_API_KEY, backend)
+    if not args.chunks:
+        args.chunks = None
+    store = build_store(args, client)
+    print(f"知识库 {len(store.chunks)} 个分块，相关问题 {len(ON_TOPIC)} 个，无关问题 {len(OFF_TOPIC)} 个")
+
+    print("\n相似度分布（用于校准阈值）")
+    for name, questions in (("相关问题", ON_TOPIC), ("无关问题", OFF_TOPIC)):
+        profile = similarity_profile(client, store, questions)
+        print(f"  {name} 最高相似度: {describe(profile['top1'])}")
+        print(f"  {name} 第一二名差: {describe(profile['margin'])}")
+
+    fixed = run_policy(args, client, store, adaptive=False)
+    adaptive = run_policy(args, client, store, adaptive=True)
+    print(f"\n重排序: {fixed['reranker']}，阈值: relevance_floor={args.relevance_floor} margin={args.margin} "
+          f"flat_spread={args.flat_spread} expand_factor={args.expand_factor}")
+    print(f"{'策略':<10}{'平均':>10}{'P50':>10}{'P95':>10}{'重排序输入对':>14}")
+    for name, result in (("固定", fixed), ("自适应", adaptive)):
+        seconds = [entry["seconds"] for entry in result["questions"].values()]
+        print(f"{name:<10}{np.mean(seconds) * 1000:>8.1f}ms{np.percentile(seconds, 50) * 1000:>8.1f}ms"
+              f"{np.percentile(seconds, 95) * 1000:>8.1f}ms{result['pairs']:>14}")
+
+    actions = {action: 0 for action in AdaptiveRetrievalPolicy.ACTIONS}
+    for entry in adaptive["questions"].values():
+        actions[entry["action"]] += 1
+    print("自适应动作: " + ", ".join(f"{action}={count}" for action, count in actions.items()))
+
+    overlaps, top1_matches, misjudged = [], 0, 0
+    for question in ON_TOPIC:
+        expected, actual = fixed["questions"][question]["ids"], adaptive["questions"][question]["ids"]
+        if adaptive["questions"][question]["action"] == AdaptiveRetrievalPolicy.OFF_TOPIC:
+            misjudged += 1
+        overlaps.append(len(set(expected) & set(actual)) / len(expected) if expected else 1.0)
+        top1_matches += bool(expected and actual and expected[0] == actual[0])
+    off_topic = sum(adaptive["questions"][question]["action"] == AdaptiveRetrievalPolicy.OFF_TOPIC
+                    for question in OFF_TOPIC)
+    print(f"相关问题: 参考来源重合 {np.mean(overlaps):.1%}，第一名一致 {top1_matches / len(ON_TOPIC):.1%}，"
+          f"误判为无关 {misjudged} 个")
+    print(f"无关问题: 直接判为无关 {off_topic}/{len(OFF_TOPIC)}")
+
+
+if __name__ == "__main__":
+    main()
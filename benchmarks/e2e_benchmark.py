@@ -0,0 +1,469 @@
+"""
+离线端到端压测：真实的 HealthAssistantApp 流程 + 本地 DashScope 替身服务
+
+本地起一个 HTTP 服务，按 DashScope 的接口格式响应向量化、生成和流式生成请求（可配置往返耗时、
+首字延迟和生成速度），dashscope SDK 指向它后，构建和查询走的都是真实代码：
+    构建: 逐页取文本（OCR）→ 清洗分块 → 去重 → 向量化 → 入库 → 保存
+    查询: 问题改写 → 检索（向量 + BM25）→ 重排序 → 流式生成
+替身服务的向量由字符二元组哈希得到，字面相近的文本向量也相近，检索结果有意义且每次运行完全一致。
+
+页面文本默认取自仓库自带的 knowledge_base/texts.json（按页码拼接），这时没有OCR开销，OCR阶段只统计读取耗时；
+指定 --images 时对图片目录做真实OCR（需要安装 tesseract）。本地没有 BGE 重排序模型或 torch 时，
+改用固定耗时的重排序替身，结果中会注明。
+
+各阶段耗时来自追踪模块（src/tracing.py），连同吞吐、延迟分位数和替身服务的设置一起写入 JSON；
+--compare 指定上一次的结果文件时逐项对比，变慢超过 --tolerance 的指标标记为回退。
+用法: python benchmarks/e2e_benchmark.py --pages 40 --compare benchmarks/results/e2e_上次.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+from aiohttp import web
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.server_benchmark import StandInReranker
+from src.config import Config
+from src.conversation_memory import ConversationMemory
+from src.pdf_processor import page_number_from_filename
+from src.tracing import tracer
+
+# 每组为一个会话，后续问题依赖前文，用来触发问题改写
+CONVERSATIONS = [
+    ["成年人每天应该吃多少克蔬菜？", "水果呢？", "那老年人要注意什么？"],
+    ["孕妇需要额外补充哪些营养素？", "叶酸要从什么时候开始补充？"],
+    ["每天饮水量推荐多少毫升？", "喝茶可以代替喝水吗？"],
+    ["儿童零食应该怎样选择？", "含糖饮料呢？"],
+    ["减少食盐摄入有哪些方法？", "每天不超过多少克？"],
+    ["全谷物和杂豆每天吃多少合适？"],
+    ["素食人群如何保证蛋白质摄入？", "需要补充维生素B12吗？"],
+    ["老年人如何预防肌肉衰减？"],
+]
+
+# 结果中对比的指标: (路径, 数值越大越好)
+COMPARED_METRICS = [
+    ("ingestion.seconds", False),
+    ("ingestion.chunks_per_second", True),
+    ("query.seconds", False),
+    ("query.questions_per_second", True),
+    ("query.latency.p50", False),
+    ("query.latency.p95", False),
+    ("query.ttft.p50", False),
+    ("query.ttft.p95", False),
+]
+
+# 耗时变化小于该值（秒）时不算回退，避免亚毫秒级阶段的抖动被标记
+NOISE_FLOOR = 0.001
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+
+def hashed_embedding(text: str, dimensions: int) -> np.ndarray:
+    """字符二元组哈希到各维度上计数后归一化，共享字面片段越多的文本余弦相似度越高"""
+    chars = [c for c in text if not c.isspace()]
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for a, b in zip(chars, chars[1:] + [""]):
+        vector[zlib.crc32((a + b).encode('utf-8')) % dimensions] += 1.0
+    norm = np.linalg.norm(vector)
+    if not norm:
+        vector[0], norm = 1.0, 1.0
+    return vector / norm
+
+
+class LocalDashScope:
+    """
+    按 DashScope HTTP 接口格式响应的本地替身服务，在后台线程的事件循环中运行
+
+    向量化: 每次请求耗时 embedding_latency + per_text_latency × 条数
+    生成:   首字前等待 first_token_latency，之后每个 token 间隔 1 / tokens_per_second；
+            流式请求逐 token 推送 SSE 事件，非流式请求等全部生成完再返回
+    问题改写的提示词原样返回其中的当前问题（相当于改写结果与原问题相同），多查询改写的提示词返回几个固定句式的说法。
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.counters = {"embedding_requests": 0, "embedded_texts": 0, "generation_requests": 0,
+                         "stream_requests": 0, "output_tokens": 0}
+        self.url = None
+        self._loop = None
+        self._runner = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._serve, name="local-dashscope", daemon=True)
+
+    def start(self) -> str:
+        self._thread.start()
+        self._ready.wait()
+        return self.url
+
+    def stop(self):
+        async def shutdown():
+            await self._runner.cleanup()
+            self._loop.stop()
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop)
+        self._thread.join(timeout=5)
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        app.router.add_post("/api/v1/services/embeddings/text-embedding/text-embedding", self.embedding)
+        app.router.add_post("/api/v1/services/aigc/text-generation/generation", self.generation)
+        self._runner = web.AppRunner(app)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        self._loop.run_until_complete(site.start())
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/api/v1"
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def embedding(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        texts = body["input"]["texts"]
+        dimensions = body.get("parameters", {}).get("dimension") or Config.EMBEDDING_DIMENSIONS
+        self.counters["embedding_requests"] += 1
+        self.counters["embedded_texts"] += len(texts)
+        await asyncio.sleep(self.args.embedding_latency + self.args.per_text_latency * len(texts))
+        return web.json_response({
+            "output": {"embeddings": [{"text_index": i, "embedding": hashed_embedding(text, dimensions).tolist()}
+                                      for i, text in enumerate(texts)]},
+            "usage": {"total_tokens": sum(len(text) for text in texts)},
+            "request_id": "local",
+        })
+
+    def _answer_tokens(self, prompt: str) -> list:
+        """改写提示词返回当前问题，其他提示词从上下文中截取固定长度的回答（每个字符算一个 token）"""
+        if "### 当前问题 ###" in prompt:
+            return list(prompt.rsplit("### 当前问题 ###", 1)[1].split("###", 1)[0].strip())
+        if "原始问题：" in prompt:
+            question = prompt.rsplit("原始问题：", 1)[1].strip().rstrip("？?")
+            return list(f"{question}的建议是什么？\n关于{question}，膳食指南怎么说？\n{question}有哪些注意事项？")
+        context = prompt.split("请回答：", 1)[0].removeprefix("基于以下知识：")
+        text = "".join(context.split()) or "根据膳食指南，建议保持均衡饮食。"
+        text = (text * (self.args.answer_tokens // len(text) + 1))[:self.args.answer_tokens]
+        return list(text)
+
+    @staticmethod
+    def _result(content: str, input_tokens: int, output_tokens: int, finished: bool) -> dict:
+        return {
+            "output": {"choices": [{"finish_reason": "stop" if finished else "null",
+                                    "message": {"role": "assistant", "content": content}}]},
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                      "total_tokens": input_tokens + output_tokens},
+            "request_id": "local",
+        }
+
+    async def generation(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        messages = body["input"].get("messages")
+        prompt = messages[-1]["content"] if messages else body["input"].get("prompt", "")
+        tokens = self._answer_tokens(prompt)
+        self.counters["output_tokens"] += len(tokens)
+        delay = 1 / self.args.tokens_per_second
+
+        if request.headers.get("X-DashScope-SSE") != "enable":
+            self.counters["generation_requests"] += 1
+            await asyncio.sleep(self.args.first_token_latency + delay * len(tokens))
+            result = self._result("".join(tokens), len(prompt), len(tokens), True)
+            result["output"]["text"] = "".join(tokens)
+            return web.json_response(result)
+
+        self.counters["stream_requests"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream;charset=UTF-8"})
+        await response.prepare(request)
+        await asyncio.sleep(self.args.first_token_latency)
+        for i, token in enumerate(tokens, start=1):
+            if i > 1:
+                await asyncio.sleep(delay)
+            data = json.dumps(self._result(token, len(prompt), i, i == len(tokens)), ensure_ascii=False)
+            await response.write(f"id:{i}\nevent:result\n:HTTP_STATUS/200\ndata:{data}\n\n".encode('utf-8'))
+        await response.write_eof()
+        return response
+
+
+class TextPages:
+    """
+    代替 PDFProcessor 提供页面文本：目录中每页一个 xxx_页码.txt 文件
+
+    构建流程只用到 list_images 和 iter_images_text 两个方法，读取已提取好的文本，不做OCR。
+    """
+
+    def list_images(self, img_dir):
+        return sorted((page_number_from_filename(name), name)
+                      for name in os.listdir(img_dir) if name.endswith(".txt"))
+
+    def iter_images_text(self, img_dir, filenames=None):
+        wanted = None if filenames is None else set(filenames)
+        for page_number, name in self.list_images(img_dir):
+            if wanted is None or name in wanted:
+                yield page_number, name, Path(img_dir, name).read_text(encoding='utf-8')
+
+
+def write_shipped_pages(pages_dir: Path, limit: int) -> int:
+    """把仓库自带知识库的分块按页码拼回页面文本，每页写成一个文件，返回页数"""
+    with open(ROOT / "knowledge_base" / "texts.json", 'r', encoding='utf-8') as f:
+        texts = json.load(f)
+    with open(ROOT / "knowledge_base" / "metadata.json", 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    pages = {}
+    for text, meta in zip(texts, metadata):
+        pages.setdefault(meta["page"], []).append(text)
+    numbers = sorted(pages)[:limit] if limit else sorted(pages)
+    pages_dir.mkdir(parents=True, exist_ok=True)
+    for number in numbers:
+        (pages_dir / f"page_{number}.txt").write_text("\n".join(pages[number]), encoding='utf-8')
+    return len(numbers)
+
+
+def bge_available() -> bool:
+    try:
+        import torch  # noqa: F401
+        import transformers  # noqa: F401
+    except ImportError:
+        return False
+    return os.path.isdir(Config.BGE_RERANKER_PATH)
+
+
+def configure(args, work_dir: Path, source_dir: str):
+    """把数据目录都指到临时目录，关闭会跳过流水线阶段的缓存"""
+    Config.DASHSCOPE_API_KEY = "local"
+    Config.EMBEDDING_BACKEND = "dashscope"
+    Config.KNOWLEDGE_BASE_DIR = str(work_dir / "knowledge_base") + "/"
+    Config.IMAGES_PATH = source_dir
+    Config.KB_INGEST_MODE = "images"
+    Config.PDF_PATH = str(work_dir / "missing.pdf")  # 不建表格索引
+    Config.TABLE_INDEX_PATH = str(work_dir / "nutrition_tables.json")
+    Config.OCR_CACHE_DIR = str(work_dir / "ocr_cache") + "/"
+    Config.EMBEDDING_CACHE_DIR = ""
+    Config.RETRIEVAL_MODE = args.retrieval_mode
+    Config.ADAPTIVE_RETRIEVAL_ENABLED = args.adaptive
+    Config.ANSWER_CACHE_ENABLED = args.answer_cache
+    Config.ANSWER_CACHE_DIR = ""
+    Config.STARTUP_LAZY = True
+    Config.STARTUP_WARMUP = False
+    Config.KB_SYNC_ON_STARTUP = False
+    Config.MEMORY_LLM_SUMMARY = False
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    return {"mean": float(np.mean(values)), "p50": float(np.percentile(values, 50)),
+            "p95": float(np.percentile(values, 95)), "max": float(np.max(values))}
+
+
+def stage_summary(snapshot: dict) -> dict:
+    """追踪快照中每个阶段只保留次数、总耗时、平均耗时、平均批大小和计数器"""
+    return {
+        stage: {
+            "count": stats["latency"]["count"],
+            "seconds": stats["latency"]["sum"],
+            "mean": stats["latency"]["mean"],
+            "batch_mean": stats["batch"]["mean"],
+            "counters": stats["counters"],
+        }
+        for stage, stats in snapshot["stages"].items()
+    }
+
+
+async def run_conversation(app, questions: list, latencies: list, ttfts: list):
+    """与 app.run 相同的一轮轮对话：改写 + 检索 + 重排序，然后读完回答流"""
+    loop = asyncio.get_running_loop()
+    history = ConversationMemory()
+    for question in questions:
+        start = time.perf_counter()
+        new_query, stream, _ = await app.query_engine.aquery_stream(
+            question, history, app.query_rewriter, top_k=3, rerank_top_n=10)
+        response = await loop.run_in_executor(app.query_engine.executor, stream.read)
+        latencies.append(time.perf_counter() - start)
+        ttfts.append(stream.ttft)
+        history.add_turn(new_query, response)
+
+
+async def run_queries(app, rounds: int, concurrency: int) -> dict:
+    conversations = CONVERSATIONS * rounds
+    latencies, ttfts = [], []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(questions):
+        async with semaphore:
+            await run_conversation(app, questions, latencies, ttfts)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[limited(questions) for questions in conversations])
+    seconds = time.perf_counter() - start
+    return {
+        "conversations": len(conversations),
+        "questions": len(latencies),
+        "seconds": seconds,
+        "questions_per_second": len(latencies) / seconds,
+        "latency": percentiles(latencies),
+        "ttft": percentiles(ttfts),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def metric(result: dict, path: str):
+    for key in path.split("."):
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def compare(previous: dict, current: dict, tolerance: float) -> int:
+    """逐项对比两次结果，打印变化并返回回退的指标数"""
+    rows = [(path, higher_is_better) for path, higher_is_better in COMPARED_METRICS]
+    for phase in ("ingestion", "query"):
+        stages = sorted(set(previous.get(phase, {}).get("stages", {})) & set(current[phase]["stages"]))
+        rows += [(f"{phase}.stages.{stage}.mean", False) for stage in stages]
+
+    print(f"\n对比 {previous.get('timestamp', '')}（{previous.get('commit') or '未知提交'}）")
+    print(f"{'指标':<44}{'上次':>12}{'本次':>12}{'变化':>9}")
+    regressions = 0
+    for path, higher_is_better in rows:
+        before, after = metric(previous, path), metric(current, path)
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > tolerance and (higher_is_better or after - before >= NOISE_FLOOR):
+            flag = "  回退"
+            regressions += 1
+        print(f"{path:<44}{before:>12.4f}{after:>12.4f}{change * 100:>8.1f}%{flag}")
+    if previous.get("settings") != current["settings"]:
+        print("注意：两次运行的参数不同，结果不能直接比较")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=0, help="只构建前 N 页（默认全部）")
+    parser.add_argument("--images", default="", help="对该图片目录做真实OCR，而不是使用自带知识库的文本")
+    parser.add_argument("--rounds", type=int, default=1, help="固定问题集重复的轮数")
+    parser.add_argument("--concurrency", type=int, default=1, help="同时进行的会话数")
+    parser.add_argument("--answer-cache", action="store_true", help="开启语义答案缓存（默认关闭以测完整流程）")
+    parser.add_argument("--retrieval-mode", choices=("dense", "lexical", "hybrid", "multi"), default="hybrid")
+    parser.add_argument("--adaptive", action="store_true", help="开启自适应检索（阈值取自 Config）")
+    parser.add_argument("--reranker", choices=("auto", "bge", "stand-in"), default="auto")
+    parser.add_argument("--rerank-overhead", type=float, default=0.03, help="重排序替身每次前向的固定耗时（秒）")
+    parser.add_argument("--rerank-per-pair", type=float, default=0.01, help="重排序替身每个输入对的耗时（秒）")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="向量化单次请求往返耗时（秒）")
+    parser.add_argument("--per-text-latency", type=float, default=0.002, help="向量化每条文本的处理耗时（秒）")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="生成的首字延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--answer-tokens", type=int, default=100)
+    parser.add_argument("--output", default="", help="结果文件，默认 benchmarks/results/e2e_<时间>.json")
+    parser.add_argument("--compare", default="", help="与之前的结果文件对比")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="变慢超过该比例记为回退")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="e2e_benchmark_"))
+    if args.images:
+        source_dir, page_source = args.images, "ocr"
+        page_count = sum(1 for name in os.listdir(args.images) if page_number_from_filename(name) >= 0)
+    else:
+        source_dir, page_source = str(work_dir / "pages"), "shipped_text"
+        page_count = write_shipped_pages(Path(source_dir), args.pages)
+    configure(args, work_dir, source_dir)
+
+    server = LocalDashScope(args)
+    import dashscope
+    dashscope.base_http_api_url = server.start()
+    tracer.enabled = True
+
+    from src.app import HealthAssistantApp
+
+    class BenchmarkApp(HealthAssistantApp):
+        def initialize_knowledge_base(self):
+            if page_source == "shipped_text":
+                self.kb_builder._pdf_processor = TextPages()
+            super().initialize_knowledge_base()
+
+    print(f"构建知识库：{page_count} 页（{'OCR图片' if page_source == 'ocr' else '自带知识库文本，不含OCR'}）")
+    tracer.reset()
+    start = time.perf_counter()
+    app = BenchmarkApp()
+    ingestion_seconds = time.perf_counter() - start
+    ingestion_stages = tracer.snapshot()
+    print(tracer.report())
+    chunk_count = len(app.vector_store.chunks)
+
+    reranker = args.reranker
+    if reranker == "auto":
+        reranker = "bge" if bge_available() else "stand-in"
+    if reranker == "stand-in":
+        app.query_engine._reranker = StandInReranker(args.rerank_overhead, args.rerank_per_pair)
+        print("重排序使用替身（未找到 BGE 模型或 torch）" if args.reranker == "auto" else "重排序使用替身")
+    else:
+        app.query_engine.warm_up()
+    app.text_processor.tokenize_for_search("膳食指南")  # 加载分词词典，不计入查询耗时
+
+    print(f"\n查询：{len(CONVERSATIONS) * args.rounds} 个会话，并发 {args.concurrency}")
+    tracer.reset()
+    query = asyncio.run(run_queries(app, args.rounds, args.concurrency))
+    query_stages = tracer.snapshot()
+    print(tracer.report())
+    app.query_engine.executor.shutdown()
+    server.stop()
+
+    result = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": git_commit(),
+        "settings": {key: value for key, value in vars(args).items()
+                     if key not in ("output", "compare", "tolerance")},
+        "page_source": page_source,
+        "reranker": reranker,
+        "ingestion": {
+            "pages": page_count,
+            "chunks": chunk_count,
+            "seconds": ingestion_seconds,
+            "pages_per_second": page_count / ingestion_seconds,
+            "chunks_per_second": chunk_count / ingestion_seconds,
+            "stages": stage_summary(ingestion_stages),
+        },
+        "query": dict(query, stages=stage_summary(query_stages)),
+        "local_dashscope": server.counters,
+    }
+
+    print(f"\n构建 {page_count} 页 / {chunk_count} 个分块，用时 {ingestion_seconds:.2f}s"
+          f"（{result['ingestion']['chunks_per_second']:.1f} 分块/s）")
+    print(f"查询 {query['questions']} 个问题，用时 {query['seconds']:.2f}s"
+          f"（{query['questions_per_second']:.2f} 问/s），延迟 p50 {query['latency']['p50'] * 1000:.0f}ms"
+          f" p95 {query['latency']['p95'] * 1000:.0f}ms，首字 p50 {query['ttft']['p50'] * 1000:.0f}ms")
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"e2e_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(json.load(f), result, args.tolerance)
+        if regressions:
+            print(f"{regressions} 项指标回退超过 {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
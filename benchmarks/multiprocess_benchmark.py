@@ -0,0 +1,147 @@
+"""
+压测多进程服务模式在 1/2/4/8 个工作进程下的吞吐、延迟和内存
+
+DashScope 接口由 e2e_benchmark 的本地替身服务（单独的进程）响应；重排序服务进程在没有 BGE 模型时
+使用 server_benchmark 的计时替身（每次前向固定开销 + 每个输入对的耗时）。知识库用仓库自带的文本块
+在临时目录中构建一次，各轮测试的工作进程都内存映射这同一份索引。
+
+内存统计所有子进程（工作进程 + 重排序服务）：RSS 把共享的内存映射页在每个进程里各算一次，
+PSS 把共享页按进程数均摊（只在 Linux 上有），PSS 总和才是实际占用的物理内存。
+默认的替身耗时较短，让检索、BM25、上下文组装等 CPU 工作占主要部分，吞吐才能体现多核的作用。
+用法: python benchmarks/multiprocess_benchmark.py --workers 1 2 4 8 --clients 32 --turns 4
+"""
+import argparse
+import asyncio
+import functools
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.e2e_benchmark import LocalDashScope, bge_available
+from benchmarks.server_benchmark import StandInReranker, client_session
+from src.config import Config
+from src.worker_pool import WorkerPool
+
+
+def serve_dashscope(args, url_queue):
+    """在单独的进程中运行本地 DashScope 替身，不与压测客户端争用 GIL"""
+    server = LocalDashScope(args)
+    url_queue.put(server.start())
+    server._thread.join()
+
+
+def process_memory(pid: int) -> dict:
+    """进程的 RSS 和 PSS（KB），读不到时为 0"""
+    memory = {"rss": 0, "pss": 0}
+    path = f"/proc/{pid}/smaps_rollup"
+    if not os.path.exists(path):
+        return memory
+    with open(path, 'r') as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss"):
+                memory[key.lower()] = int(value.split()[0])
+    return memory
+
+
+def build_knowledge_base(args, kb_dir: str):
+    """用本地替身向量化自带的文本块，保存为一个知识库版本"""
+    from src.dashscope_client import DashScopeClient
+    from src.vector_store import VectorStore
+
+    with open(ROOT / "knowledge_base" / "texts.json", 'r', encoding='utf-8') as f:
+        texts = json.load(f)[:args.chunks or None]
+    with open(ROOT / "knowledge_base" / "metadata.json", 'r', encoding='utf-8') as f:
+        metadata = json.load(f)[:len(texts)]
+    store = VectorStore(kb_dir, DashScopeClient(Config.DASHSCOPE_API_KEY))
+    store.add_embeddings(texts, metadata)
+    store.save()
+    return len(texts)
+
+
+async def run_clients(port: int, clients: int, turns: int) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        client_session(f"http://127.0.0.1:{port}", turns, i, latencies) for i in range(clients)
+    ])
+    seconds = time.perf_counter() - start
+    return {"requests": len(latencies), "seconds": seconds, "latencies": latencies}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--chunks", type=int, default=0, help="知识库使用的文本块数（默认全部）")
+    parser.add_argument("--embedding-latency", type=float, default=0.01)
+    parser.add_argument("--per-text-latency", type=float, default=0.0)
+    parser.add_argument("--first-token-latency", type=float, default=0.05)
+    parser.add_argument("--tokens-per-second", type=float, default=2000)
+    parser.add_argument("--answer-tokens", type=int, default=50)
+    parser.add_argument("--rerank-overhead", type=float, default=0.005, help="重排序替身每次前向的固定耗时（秒）")
+    parser.add_argument("--rerank-per-pair", type=float, default=0.001, help="重排序替身每个输入对的耗时（秒）")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    url_queue = context.Queue()
+    dashscope_process = context.Process(target=serve_dashscope, args=(args, url_queue), daemon=True)
+    dashscope_process.start()
+    url = url_queue.get(timeout=60)
+    # 子进程（spawn）中的 dashscope SDK 从环境变量读取接口地址
+    os.environ["DASHSCOPE_HTTP_BASE_URL"] = url
+    import dashscope
+    dashscope.base_http_api_url = url
+
+    work_dir = Path(tempfile.mkdtemp(prefix="multiprocess_benchmark_"))
+    overrides = {
+        "DASHSCOPE_API_KEY": "local",
+        "EMBEDDING_BACKEND": "dashscope",
+        "EMBEDDING_CACHE_DIR": "",
+        "KNOWLEDGE_BASE_DIR": str(work_dir / "knowledge_base") + "/",
+        "TABLE_INDEX_PATH": str(work_dir / "nutrition_tables.json"),
+        "ANSWER_CACHE_ENABLED": False,
+        "ANSWER_CACHE_DIR": "",
+    }
+    for name, value in overrides.items():
+        setattr(Config, name, value)
+    chunk_count = build_knowledge_base(args, Config.KNOWLEDGE_BASE_DIR)
+
+    reranker_factory = None
+    if not bge_available():
+        reranker_factory = functools.partial(StandInReranker, args.rerank_overhead, args.rerank_per_pair)
+        print("重排序服务使用替身（未找到 BGE 模型或 torch）")
+    print(f"知识库 {chunk_count} 个分块，{args.clients} 个客户端 × {args.turns} 轮，CPU 核数 {os.cpu_count()}")
+
+    print(f"{'进程数':>6}{'请求':>8}{'耗时':>9}{'吞吐':>12}{'P50':>10}{'P99':>10}{'RSS 总和':>12}{'PSS 总和':>12}")
+    for workers in args.workers:
+        pool = WorkerPool(workers, "127.0.0.1", 0, overrides=overrides, reranker_factory=reranker_factory)
+        port = pool.start()
+        try:
+            result = asyncio.run(run_clients(port, args.clients, args.turns))
+            memory = [process_memory(pid) for pid in pool.pids]
+        finally:
+            pool.stop()
+        latencies = result["latencies"]
+        rss = sum(item["rss"] for item in memory) / 1024
+        pss = sum(item["pss"] for item in memory) / 1024
+        print(f"{workers:>6}{result['requests']:>8}{result['seconds']:>8.2f}s"
+              f"{result['requests'] / result['seconds']:>8.1f}请求/s"
+              f"{np.percentile(latencies, 50) * 1000:>8.0f}ms{np.percentile(latencies, 99) * 1000:>8.0f}ms"
+              f"{rss:>10.0f}MB{pss:>10.0f}MB")
+
+    dashscope_process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+对比重排序各后端（fp32 / int8 / onnx）的延迟与排序质量
+
+每个问题从知识库文本中取 10 个候选分块，记录每个问题的重排序耗时，
+并以 fp32 的分数为基准计算 Spearman 相关系数和 top-3 一致率；最后测量缓存命中时的耗时。
+用法: python benchmarks/reranker_benchmark.py --backends fp32 int8 onnx --threads 4
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.config import Config
+from src.reranker import Reranker
+
+QUESTIONS = [
+    "成年人每天应该吃多少克蔬菜？",
+    "孕妇需要额外补充哪些营养素？",
+    "老年人如何预防肌肉衰减？",
+    "每天饮水量推荐多少毫升？",
+    "儿童零食应该怎样选择？",
+    "减少食盐摄入有哪些方法？",
+    "全谷物和杂豆每天吃多少合适？",
+    "素食人群如何保证蛋白质摄入？",
+]
+
+
+def load_candidates(count: int, seed: int):
+    with open(ROOT / "knowledge_base" / "texts.json", 'r', encoding='utf-8') as f:
+        texts = json.load(f)
+    rng = np.random.default_rng(seed)
+    return [
+        [{"id": int(i), "text": texts[i]} for i in rng.choice(len(texts), size=count, replace=False)]
+        for _ in QUESTIONS
+    ]
+
+
+def spearman(a, b) -> float:
+    rank_a = np.argsort(np.argsort(a))
+    rank_b = np.argsort(np.argsort(b))
+    return float(np.corrcoef(rank_a, rank_b)[0, 1])
+
+
+def run(reranker: Reranker, candidates):
+    scores, latencies = [], []
+    for question, chunks in zip(QUESTIONS, candidates):
+        start = time.perf_counter()
+        scores.append(np.array(reranker.score(question, chunks)))
+        latencies.append(time.perf_counter() - start)
+    return scores, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=Config.BGE_RERANKER_PATH)
+    parser.add_argument("--backends", nargs="+", default=["fp32", "int8", "onnx"])
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=Config.RERANKER_BATCH_SIZE)
+    parser.add_argument("--candidates", type=int, default=10, help="每个问题的候选分块数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    candidates = load_candidates(args.candidates, args.seed)
+    baseline = None
+    for backend in args.backends:
+        start = time.perf_counter()
+        reranker = Reranker(args.model, backend=backend, num_threads=args.threads, batch_size=args.batch_size)
+        load_seconds = time.perf_counter() - start
+
+        run(reranker, candidates[:1])  # 预热
+        reranker._cache.clear()
+        scores, latencies = run(reranker, candidates)
+        _, cached = run(reranker, candidates)
+
+        line = (f"{backend:<5} 加载 {load_seconds:6.2f}s  "
+                f"每问 p50 {np.percentile(latencies, 50) * 1000:7.1f}ms  "
+                f"p95 {np.percentile(latencies, 95) * 1000:7.1f}ms  "
+                f"缓存命中 {np.mean(cached) * 1000:6.3f}ms")
+        if baseline is None:
+            baseline = scores
+        else:
+            rho = np.mean([spearman(a, b) for a, b in zip(baseline, scores)])
+            top3 = np.mean([
+                len(set(np.argsort(-a)[:3]) & set(np.argsort(-b)[:3])) / 3
+                for a, b in zip(baseline, scores)
+            ])
+            line += f"  Spearman {rho:.4f}  top-3 一致 {top3:.2%}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
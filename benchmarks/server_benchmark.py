@@ -0,0 +1,163 @@
+"""
+压测 HTTP 服务模式的吞吐和延迟
+
+DashScope 的向量化、问题改写和生成都用本地替身模拟往返耗时；重排序用一个按批计时的替身模型：
+每次前向固定开销 + 每个输入对的耗时，且同一时刻只能执行一次前向（与单个 CPU 模型一致）。
+N 个模拟客户端各自使用一个会话连续提问，分别在开启/关闭跨请求重排序批处理时统计 p50/p99 延迟和吞吐。
+用法: python benchmarks/server_benchmark.py --clients 16 --turns 5
+"""
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import aiohttp
+import numpy as np
+from aiohttp import web
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.config import Config
+from src.dashscope_client import DashScopeClient, StreamingResponse
+from src.embedding_engine import FakeEmbeddingBackend
+from src.query_processor import QueryEngine
+from src.query_rewriter_processor import QueryRewriter
+from src.server import HealthAssistantServer
+from src.vector_store import VectorStore
+
+QUESTIONS = [
+    "成年人每天应该吃多少克蔬菜？",
+    "孕妇需要额外补充哪些营养素？",
+    "老年人如何预防肌肉衰减？",
+    "每天饮水量推荐多少毫升？",
+    "儿童零食应该怎样选择？",
+    "减少食盐摄入有哪些方法？",
+    "全谷物和杂豆每天吃多少合适？",
+    "素食人群如何保证蛋白质摄入？",
+]
+
+
+class StandInReranker:
+    """重排序替身：一次前向耗时 overhead + per_pair × 输入对数，前向之间互斥"""
+
+    def __init__(self, overhead: float, per_pair: float):
+        self.overhead = overhead
+        self.per_pair = per_pair
+        self.forward_passes = 0
+        self._lock = threading.Lock()
+
+    def score_many(self, requests):
+        pairs = sum(len(chunks) for _, chunks in requests)
+        with self._lock:
+            self.forward_passes += 1
+            time.sleep(self.overhead + self.per_pair * pairs)
+        return [[zlib.crc32(f"{query}\0{chunk['text']}".encode('utf-8')) / 2 ** 32 for chunk in chunks]
+                for query, chunks in requests]
+
+    def score(self, query, chunks):
+        return self.score_many([(query, chunks)])[0]
+
+
+class StandInClient(DashScopeClient):
+    """DashScope 替身：生成和改写只模拟耗时，不发网络请求"""
+
+    def __init__(self, args):
+        super().__init__("stand-in", FakeEmbeddingBackend(Config.EMBEDDING_DIMENSIONS, latency=args.embedding_latency))
+        self.args = args
+
+    def get_completion(self, prompt):
+        time.sleep(self.args.rewrite_latency)
+        # 原样返回当前问题，相当于改写结果与原问题相同
+        return prompt.rsplit("### 当前问题 ###", 1)[1].split("###", 1)[0].strip()
+
+    def generate_response(self, prompt, context=""):
+        return self.stream_response(prompt, context).read()
+
+    def stream_response(self, prompt, context="", started=None):
+        def deltas():
+            time.sleep(self.args.first_token_latency)
+            for i in range(self.args.answer_tokens):
+                time.sleep(1 / self.args.tokens_per_second)
+                yield "字"
+        return StreamingResponse(deltas(), started=started)
+
+
+def build_store(args, client) -> VectorStore:
+    with open(ROOT / "knowledge_base" / "texts.json", 'r', encoding='utf-8') as f:
+        texts = json.load(f)[:args.chunks]
+    store = VectorStore(tempfile.mkdtemp(), client)
+    store.add_embeddings(texts, [{"page": i} for i in range(len(texts))])
+    store.save()
+    store.load()
+    return store
+
+
+async def client_session(url: str, turns: int, offset: int, latencies: list):
+    session_id = None
+    async with aiohttp.ClientSession() as http:
+        for turn in range(turns):
+            question = QUESTIONS[(offset + turn) % len(QUESTIONS)]
+            start = time.perf_counter()
+            async with http.post(url + "/query", json={"question": question, "session_id": session_id}) as response:
+                result = await response.json()
+            latencies.append(time.perf_counter() - start)
+            session_id = result["session_id"]
+
+
+async def run(args, store, client, batching: bool):
+    Config.ANSWER_CACHE_ENABLED = False
+    engine = QueryEngine(client, store)
+    reranker = engine._reranker = StandInReranker(args.rerank_overhead, args.rerank_per_pair)
+    server = HealthAssistantServer(engine, QueryRewriter(client), max_concurrency=args.concurrency,
+                                   rerank_batching=batching)
+    runner = web.AppRunner(server.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        client_session(f"http://127.0.0.1:{port}", args.turns, i, latencies) for i in range(args.clients)
+    ])
+    elapsed = time.perf_counter() - start
+    await runner.cleanup()
+    engine.executor.shutdown()
+
+    name = "批处理" if batching else "逐请求"
+    print(f"{name}  {len(latencies)} 个请求  耗时 {elapsed:6.2f}s  吞吐 {len(latencies) / elapsed:6.2f} 请求/s  "
+          f"p50 {np.percentile(latencies, 50) * 1000:7.1f}ms  p99 {np.percentile(latencies, 99) * 1000:7.1f}ms  "
+          f"重排序前向 {reranker.forward_passes} 次")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=Config.SERVER_MAX_CONCURRENCY)
+    parser.add_argument("--chunks", type=int, default=2000, help="知识库使用的文本块数")
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--rewrite-latency", type=float, default=0.3)
+    parser.add_argument("--first-token-latency", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--answer-tokens", type=int, default=100)
+    parser.add_argument("--rerank-overhead", type=float, default=0.03, help="重排序每次前向的固定耗时（秒）")
+    parser.add_argument("--rerank-per-pair", type=float, default=0.01, help="重排序每个输入对的耗时（秒）")
+    args = parser.parse_args()
+
+    Config.EMBEDDING_CACHE_DIR = ""
+    client = StandInClient(args)
+    store = build_store(args, client)
+    for batching in (False, True):
+        asyncio.run(run(args, store, client, batching))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+对比向量索引各种存放精度的召回率、检索延迟和内存占用
+
+以 float32 精确检索（flat）的结果为基准，计算 recall@k（与基准 top-k 的重合比例），
+记录单次检索的平均/P95 延迟，以及每个向量常驻内存的字节数和索引总字节数。
+默认使用合成的低秩聚类向量（模拟文本向量的分布）；--from-kb 时使用知识库中已保存的向量。
+用法: python benchmarks/vector_benchmark.py --count 20000 --top-k 10
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.config import Config
+from src.vector_index import VectorIndex
+
+# (名称, VectorIndex 参数)
+SETTINGS = [
+    ("float16", dict(dtype="float16")),
+    ("int8", dict(dtype="int8")),
+    ("int8+rescore", dict(dtype="int8", rescore=4)),
+    ("pq64", dict(dtype="pq", pq_m=64)),
+    ("pq64+rescore", dict(dtype="pq", pq_m=64, rescore=8)),
+    ("pca256+rescore", dict(index_dimensions=256, rescore=4)),
+    ("pca256+int8+rescore", dict(dtype="int8", index_dimensions=256, rescore=4)),
+    ("ivf+int8+rescore", dict(kind="ivf", dtype="int8", rescore=4)),
+]
+
+
+def synthetic_vectors(count: int, dimensions: int, queries: int, seed: int):
+    """低秩聚类向量：若干主题中心加上主题内的低维变化和少量各向同性噪声"""
+    rng = np.random.default_rng(seed)
+    rank, topics = 64, 200
+    basis = rng.standard_normal((rank, dimensions)).astype(np.float32)
+    centers = rng.standard_normal((topics, rank)).astype(np.float32)
+
+    def sample(n):
+        latent = centers[rng.integers(topics, size=n)] + 0.6 * rng.standard_normal((n, rank)).astype(np.float32)
+        return latent @ basis + 0.5 * rng.standard_normal((n, dimensions)).astype(np.float32)
+
+    return sample(count), sample(queries)
+
+
+def kb_vectors(queries: int, seed: int):
+    """知识库中已保存的向量；查询取若干向量加少量扰动"""
+    directory = Path(Config.KNOWLEDGE_BASE_DIR) / "index"
+    index = VectorIndex.load(directory / (directory / "CURRENT").read_text(encoding='utf-8').strip())
+    vectors = np.asarray(index._full if index._full is not None else index._rows(slice(None)), dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    picks = vectors[rng.choice(len(vectors), size=queries)]
+    return vectors, picks + 0.02 * rng.standard_normal(picks.shape).astype(np.float32)
+
+
+def build(vectors: np.ndarray, batch: int, **kwargs) -> VectorIndex:
+    index = VectorIndex(vectors.shape[1], **kwargs)
+    for start in range(0, len(vectors), batch):
+        index.add(range(start, min(start + batch, len(vectors))), vectors[start:start + batch])
+    # 与线上一致：保存后以内存映射方式加载
+    directory = tempfile.mkdtemp(prefix="vector_benchmark_")
+    index.save(directory)
+    return VectorIndex.load(directory)
+
+
+def run(name: str, index: VectorIndex, queries: np.ndarray, top_k: int, truth, build_seconds: float):
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        rows, _ = index.search(query, top_k)
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len(set(index.ids[rows].tolist()) & expected) / len(expected))
+    latencies = np.array(latencies) * 1000
+    print(f"{name:<22} recall@{top_k} {np.mean(recalls):6.3f}  平均 {latencies.mean():6.2f}ms  "
+          f"P95 {np.percentile(latencies, 95):6.2f}ms  {index.bytes_per_vector:>5} B/向量  "
+          f"常驻 {index.nbytes / 1024 / 1024:7.1f} MB  构建 {build_seconds:6.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=20000, help="合成向量条数")
+    parser.add_argument("--dimensions", type=int, default=Config.EMBEDDING_DIMENSIONS)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=2000, help="每次 add 的向量数（模拟分批构建）")
+    parser.add_argument("--from-kb", action="store_true", help="使用知识库中已保存的向量")
+    parser.add_argument("--settings", nargs="*", help="只测这些配置（名称见 SETTINGS）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.from_kb:
+        vectors, queries = kb_vectors(args.queries, args.seed)
+    else:
+        vectors, queries = synthetic_vectors(args.count, args.dimensions, args.queries, args.seed)
+    print(f"{len(vectors)} 个向量，{vectors.shape[1]} 维，{len(queries)} 个查询")
+
+    start = time.perf_counter()
+    baseline = build(vectors, args.batch)
+    build_seconds = time.perf_counter() - start
+    truth = [set(baseline.ids[baseline.search(query, args.top_k)[0]].tolist()) for query in queries]
+    run("float32（基准）", baseline, queries, args.top_k, truth, build_seconds)
+
+    for name, kwargs in SETTINGS:
+        if args.settings and name not in args.settings:
+            continue
+        start = time.perf_counter()
+        index = build(vectors, args.batch, **kwargs)
+        run(name, index, queries, args.top_k, truth, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import threading
+from typing import List
+
+
+class AdaptiveRetrievalPolicy:
+    """
+    按向量相似度的分布为每个问题决定检索深度和是否重排序
+
+    检索时先取 rerank_top_n × expand_factor 个候选，再看其中向量相似度（余弦）的分布：
+        off_topic: 最高相似度低于 relevance_floor，知识库里没有相关内容（闲聊、无关问题），
+                   不重排序也不带参考资料
+        decisive:  第一名比第二名高出 margin 以上，向量检索已经很有把握，跳过重排序直接按相似度取 top_k
+        flat:      前 rerank_top_n 名的相似度相差不到 flat_spread，排序基本靠不住，把全部候选交给重排序
+        rerank:    其他情况，与固定策略相同，重排序前 rerank_top_n 个候选
+    只有 BM25 结果（没有向量相似度）时一律按 rerank 处理。阈值取决于向量模型，换模型后需要用
+    benchmarks/adaptive_benchmark.py 重新校准。
+    """
+
+    OFF_TOPIC = "off_topic"
+    DECISIVE = "decisive"
+    FLAT = "flat"
+    RERANK = "rerank"
+    ACTIONS = (OFF_TOPIC, DECISIVE, FLAT, RERANK)
+
+    def __init__(self, relevance_floor: float = 0.3, margin: float = 0.1, flat_spread: float = 0.03,
+                 expand_factor: int = 2):
+        self.relevance_floor = relevance_floor
+        self.margin = margin
+        self.flat_spread = flat_spread
+        self.expand_factor = max(1, expand_factor)
+        self.counts = {action: 0 for action in self.ACTIONS}
+        self._lock = threading.Lock()
+
+    def depth(self, rerank_top_n: int) -> int:
+        """检索的候选数：足够在相似度平坦时扩大重排序的范围"""
+        return rerank_top_n * self.expand_factor
+
+    def decide(self, candidates: List[dict], rerank_top_n: int) -> str:
+        similarities = sorted((chunk["similarity"] for chunk in candidates if "similarity" in chunk), reverse=True)
+        if not similarities:
+            action = self.RERANK
+        elif similarities[0] < self.relevance_floor:
+            action = self.OFF_TOPIC
+        elif len(similarities) == 1 or similarities[0] - similarities[1] >= self.margin:
+            action = self.DECISIVE
+        elif (len(candidates) > rerank_top_n and len(similarities) >= rerank_top_n
+              and similarities[0] - similarities[rerank_top_n - 1] < self.flat_spread):
+            action = self.FLAT
+        else:
+            action = self.RERANK
+        with self._lock:
+            self.counts[action] += 1
+        return action
+
+    @staticmethod
+    def by_similarity(candidates: List[dict], top_k: int) -> List[dict]:
+        """不重排序时按向量相似度取前 top_k 个"""
+        ranked = sorted((chunk for chunk in candidates if "similarity" in chunk),
+                        key=lambda chunk: chunk["similarity"], reverse=True)
+        return ranked[:top_k]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
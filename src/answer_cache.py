@@ -0,0 +1,190 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+
+class AnswerCache:
+    """
+    语义答案缓存
+
+    以问题向量为键：新问题与某个历史问题的余弦相似度不低于阈值、且两者基于同一知识库版本时，
+    直接返回当时的回答和参考来源。条目按最近使用淘汰（LRU），超过有效期（TTL）的视为失效。
+    知识库版本变化（重建/增量更新）后，旧版本的条目全部作废。
+
+    指定 cache_dir 时落盘为 answers.json + embeddings.npy，重启后继续使用。
+    """
+
+    # 写入后攒一段时间再落盘，退出时再保存一次
+    FLUSH_INTERVAL = 30.0
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1000, ttl: float = 86400,
+                 cache_dir: str = None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> {question, answer, sources, kb_version, created}
+        self._vectors = {}  # key -> 归一化的问题向量
+        self._next_key = 0
+        self._kb_version = None
+        self._matrix = None  # (键列表, 向量矩阵)，条目变化时置空
+        self._dirty = False
+        self._last_flush = time.monotonic()
+
+        if self.cache_dir is not None:
+            self._load()
+            atexit.register(self.flush)
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, key: int):
+        del self._entries[key]
+        del self._vectors[key]
+        self._matrix = None
+        self._dirty = True
+
+    def _expire(self):
+        """删除过期条目"""
+        if not self.ttl:
+            return
+        deadline = time.time() - self.ttl
+        for key in [key for key, entry in self._entries.items() if entry["created"] < deadline]:
+            self._remove(key)
+
+    def _switch_version(self, kb_version: str):
+        """知识库版本变化时作废旧版本的全部条目"""
+        if kb_version == self._kb_version:
+            return
+        for key in [key for key, entry in self._entries.items() if entry["kb_version"] != kb_version]:
+            self._remove(key)
+        self._kb_version = kb_version
+
+    def lookup(self, embedding, kb_version: str) -> Optional[dict]:
+        """查找语义相近的历史问题，命中时返回条目（含 answer、sources、similarity），否则返回 None"""
+        query = self._normalize(embedding)
+        with self._lock:
+            self._switch_version(kb_version)
+            self._expire()
+            if not self._entries:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                keys = list(self._entries)
+                self._matrix = (keys, np.stack([self._vectors[key] for key in keys]))
+            keys, matrix = self._matrix
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            key = keys[best]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(self._entries[key], similarity=float(similarities[best]))
+
+    def put(self, question: str, embedding, answer: str, sources: List[dict], kb_version: str):
+        with self._lock:
+            self._switch_version(kb_version)
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = {
+                "question": question,
+                "answer": answer,
+                "sources": sources,
+                "kb_version": kb_version,
+                "created": time.time(),
+            }
+            self._vectors[key] = self._normalize(embedding)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            self._matrix = None
+            self._dirty = True
+            if self.cache_dir is not None and time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL:
+                self._save()
+
+    def clear(self):
+        """清空缓存（知识库重建后调用）"""
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+            if self.cache_dir is not None:
+                self._save()
+
+    @staticmethod
+    def discard(cache_dir: str):
+        """删除落盘的缓存文件，包括多进程服务各工作进程子目录中的（还没有创建缓存对象时知识库被重建）"""
+        cache_dir = Path(cache_dir)
+        if not cache_dir.is_dir():
+            return
+        for name in ("answers.json", "embeddings.npy"):
+            for path in [cache_dir / name] + list(cache_dir.glob(f"worker_*/{name}")):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
+
+    def _load(self):
+        answers_path = self.cache_dir / "answers.json"
+        vectors_path = self.cache_dir / "embeddings.npy"
+        if not answers_path.exists() or not vectors_path.exists():
+            return
+        with open(answers_path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        vectors = np.load(vectors_path)
+        if len(vectors) != len(entries):
+            return
+        for entry, vector in zip(entries, vectors):
+            self._entries[self._next_key] = entry
+            self._vectors[self._next_key] = vector
+            self._next_key += 1
+        self._expire()
+        self._dirty = False
+
+    def _save(self):
+        """原子地写入缓存目录（调用方持有锁）"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        keys = list(self._entries)
+        dimensions = len(self._vectors[keys[0]]) if keys else 0
+        vectors = np.stack([self._vectors[key] for key in keys]) if keys else np.empty((0, dimensions), np.float32)
+
+        tmp_vectors = self.cache_dir / "embeddings.npy.tmp"
+        with open(tmp_vectors, 'wb') as f:
+            np.save(f, vectors)
+        tmp_answers = self.cache_dir / "answers.json.tmp"
+        with open(tmp_answers, 'w', encoding='utf-8') as f:
+            json.dump([self._entries[key] for key in keys], f, ensure_ascii=False, default=float)
+        os.replace(tmp_vectors, self.cache_dir / "embeddings.npy")
+        os.replace(tmp_answers, self.cache_dir / "answers.json")
+        self._dirty = False
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        if self.cache_dir is None:
+            return
+        with self._lock:
+            if self._dirty:
+                self._save()
@@ -1,66 +1,113 @@
-import streamlit as st
-from src.config import Config
-from src.pdf_processor import PDFProcessor
-from src.text_processor import TextProcessor
-from src.dashscope_client import DashScopeClient
-from src.vector_store import VectorStore
-from src.query_processor import QueryEngine
-from src.query_rewriter_processor import QueryRewriter
-from PyPDF2 import PdfReader
+from src.startup_profile import profile
+
+with profile.measure("config", "import"):
+    from src.config import Config
+    from src.tracing import tracer
+with profile.measure("dashscope_client", "import"):
+    from src.dashscope_client import DashScopeClient
+with profile.measure("vector_store", "import"):
+    from src.vector_store import VectorStore
+with profile.measure("query_engine", "import"):
+    from src.answer_cache import AnswerCache
+    from src.query_processor import QueryEngine
+    from src.query_rewriter_processor import QueryRewriter
+    from src.conversation_memory import ConversationMemory
+with profile.measure("kb_builder", "import"):
+    from src.kb_builder import KnowledgeBaseBuilder
+import asyncio
 import os
+import threading
 
 
 class HealthAssistantApp:
     def __init__(self):
         self.config = Config()
-        self.pdf_processor = PDFProcessor()
-        self.text_processor = TextProcessor()
-        self.dashscope_client = DashScopeClient(self.config.DASHSCOPE_API_KEY)
-        self.vector_store = VectorStore(self.config.KNOWLEDGE_BASE_DIR)
+        with profile.measure("dashscope_client"):
+            self.dashscope_client = DashScopeClient(self.config.DASHSCOPE_API_KEY)
+        with profile.measure("vector_store"):
+            self.vector_store = VectorStore(self.config.KNOWLEDGE_BASE_DIR, self.dashscope_client,
+                                            self._tokenize_for_search)
+        # 延迟模式下 PDF/OCR 处理器和分词器由构建器在第一次用到时创建
+        self.kb_builder = KnowledgeBaseBuilder(None, None, self.vector_store)
+        if not self.config.STARTUP_LAZY:
+            # 立即加载模式：启动时就创建全部组件
+            self.kb_builder.pdf_processor
+            self.kb_builder.text_processor
         self.query_engine = None
         self.query_rewriter = None
+        self._warm_up_thread = None
+        # 每轮对话的生成统计：首字延迟、token 数、生成速度
+        self.turn_stats = []
 
         # 加载或初始化知识库
         self.initialize_knowledge_base()
 
+        if not self.config.STARTUP_LAZY:
+            self.query_engine.warm_up()
+        elif self.config.STARTUP_WARMUP:
+            self.start_warm_up()
+
+    @property
+    def pdf_processor(self):
+        return self.kb_builder.pdf_processor
+
+    @property
+    def text_processor(self):
+        return self.kb_builder.text_processor
+
+    def _tokenize_for_search(self, text: str):
+        return self.text_processor.tokenize_for_search(text)
+
+    def start_warm_up(self):
+        """在后台线程加载分词词典和重排序模型，不阻塞输入提示"""
+        def warm_up():
+            try:
+                with profile.measure("jieba", "warmup"):
+                    self._tokenize_for_search("膳食指南")
+                self.query_engine.warm_up()
+            except Exception as e:
+                # 预热失败不影响启动，首次查询时会再次加载并报出错误
+                print(f"后台预热失败: {e}")
+
+        self._warm_up_thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+        self._warm_up_thread.start()
+
     def initialize_knowledge_base(self):
         """初始化或加载知识库"""
-        self.vector_store.load()
+        with profile.measure("vector_store", "load"):
+            self.vector_store.load()
+        # 从旧版本升级：已有的分块文本直接导入，不必重新OCR
+        self.kb_builder.import_legacy()
 
-        # 如果知识库为空，处理PDF并创建知识库
-        if not self.vector_store.faiss_store:
+        # 如果知识库为空或上次构建被中断，处理PDF并（增量）构建知识库
+        if self.kb_builder.needs_build():
             print("正在初始化知识库，这可能需要一些时间...")
             self.process_pdf_and_build_kb()
+        elif self.config.KB_SYNC_ON_STARTUP:
+            self.process_pdf_and_build_kb()
 
-        self.query_engine = QueryEngine(self.dashscope_client, self.vector_store)
-        self.query_rewriter = QueryRewriter(self.dashscope_client)
+        with profile.measure("query_engine"):
+            self.query_engine = QueryEngine(self.dashscope_client, self.vector_store)
+            self.query_rewriter = QueryRewriter(self.dashscope_client)
 
     def process_pdf_and_build_kb(self):
-        """处理PDF并构建知识库"""
-        # # 读取PDF文件
-        # pdf_reader = PdfReader(self.config.PDF_PATH)
-        # # pages_text, char_page_mapping = self.pdf_processor.extract_text_with_page_numbers(pdf_reader)
-        # 处理images目录中的独立图片文件
-        print("  - 正在处理独立图片文件...")
-        img_dir = self.config.IMAGES_PATH
-        pages_text = self.pdf_processor.images_to_text(img_dir)
-
-        # 清理和分块文本
-        all_chunks = []
-        for page_num, text in enumerate(pages_text):
-            cleaned_text = self.text_processor.clean_text(text)
-            chunks = self.text_processor.chunk_text(
-                cleaned_text,
-                self.config.CHUNK_SIZE,
-                self.config.CHUNK_OVERLAP
-            )
-            for chunk in chunks:
-                all_chunks.append(chunk)
-
-        # 添加到向量存储
-        metadata = [{"source": "中国居民膳食指南（2022）", "page": i // 10 + 1} for i in range(len(all_chunks))]
-        self.vector_store.add_embeddings(all_chunks, metadata)
-        self.vector_store.save()
+        """处理images目录中的独立图片文件（或直接流式OCR PDF）并增量构建知识库"""
+        if self.config.KB_INGEST_MODE == "pdf":
+            print("  - 正在流式处理PDF文件...")
+            stats = self.kb_builder.build(self.config.PDF_PATH)
+        else:
+            print("  - 正在处理独立图片文件...")
+            stats = self.kb_builder.build(self.config.IMAGES_PATH)
+        self.kb_builder.build_table_index(self.config.PDF_PATH)
+        # 知识库内容变了，之前缓存的回答不再可信
+        if self.query_engine is not None:
+            self.query_engine.reload_table_index()
+            if self.query_engine.answer_cache is not None:
+                self.query_engine.answer_cache.clear()
+        elif self.config.ANSWER_CACHE_DIR:
+            # 启动时构建：查询引擎还没创建，直接删除上次运行落盘的回答
+            AnswerCache.discard(self.config.ANSWER_CACHE_DIR)
+        return stats
 
     def run(self):
         """运行应用"""
@@ -68,26 +115,42 @@ class HealthAssistantApp:
 
         print("我可以回答关于中国膳食指南和营养健康的问题")
 
-        history = []
+        if self.config.STARTUP_PROFILE:
+            print(profile.report())
+
+        # 有 token 预算的对话记忆：最近几轮原样保留，更早的压缩成摘要
+        history = ConversationMemory(
+            summarizer=self.dashscope_client.get_completion if self.config.MEMORY_LLM_SUMMARY else None)
 
         while True:
             # 提示用户输入
             user_input = input("请输入你的问题（输入 quit/exit 退出）: ").strip()
             # 检查是否要退出
             if user_input.lower() in ['quit', 'exit']:
+                if self.config.STARTUP_PROFILE:
+                    # 包含后台预热和首次使用时延迟加载的组件
+                    print(profile.report())
+                if tracer.enabled:
+                    print(tracer.report())
+                    if self.config.TRACING_EXPORT_PATH:
+                        tracer.save(self.config.TRACING_EXPORT_PATH)
                 print("再见！")
                 break  # 退出 while 循环
-            new_query = user_input
-            if history:
-                new_query = self.query_rewriter.rewrite_context_dependent_query(user_input, history)
+            # 有对话历史时先改写问题，改写的同时用原问题预检索
+            new_query, stream, sources = asyncio.run(self.query_engine.aquery_stream(
+                user_input, history, self.query_rewriter, top_k=3, rerank_top_n=10))
 
             # （模拟）回答逻辑 —— 这里可以替换成你自己的逻辑，比如调用大模型 API
             print("用户:", new_query)
-            response, sources = self.query_engine.query(new_query, top_k=3, rerank_top_n=10)
-            history.append("用户:" + user_input)
-            history.append("健康助手管家:" + response)
-            # 输出回答
-            print("健康助手管家:", response)
+            # 边生成边输出回答
+            print("健康助手管家:", end=" ", flush=True)
+            for delta in stream:
+                print(delta, end="", flush=True)
+            print()
+            response = stream.text
+            history.add_turn(new_query, response)
+            self.turn_stats.append(stream.stats())
+            print(f"（首字 {stream.ttft:.2f}s，{stream.output_tokens} tokens，{stream.tokens_per_second:.1f} tokens/s）")
             print("-" * 40)  # 分隔线，美观一点
 
         # question = input("请输入你的问题: ")
@@ -96,8 +159,8 @@ class HealthAssistantApp:
         #     print("正在思考...")
         #     # 正常查询整合重排序
         #     response, sources = self.query_engine.query(question, top_k=3, rerank_top_n=10)
-        #     # 使用MultiQueryRetriever多语义查询
-        #     # response, sources = self.query_engine.process_query_with_multi_retriever(question, self.query_engine.create_multi_query_retriever(4))
+        #     # 多查询检索：改写出多个问题并发检索，融合后重排序
+        #     # response, sources = self.query_engine.query(question, top_k=3, rerank_top_n=10, mode="multi")
         #
         #     print("回答:")
         #     print(response)
@@ -0,0 +1,178 @@
+import json
+import math
+from collections import Counter
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+
+class BM25Index:
+    """
+    基于分词结果的倒排索引，BM25 打分
+
+    保存目录中的文件:
+        bm25_meta.json      参数、文档数、总长度及词表（词 -> [偏移, 长度]）
+        bm25_docs.bin       (n,) int64 文档（分块）ID，升序
+        bm25_lengths.bin    (n,) int32 文档长度（词数）
+        bm25_postings.bin   int64 倒排表中的文档ID，按词连续存放
+        bm25_tfs.bin        int32 对应的词频
+    数组以内存映射方式加载。新增和删除先记在内存里，检索时与已保存的倒排表合并，
+    保存时整体重写，之后改为映射新写入的文件并清空这些修改。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._vocabulary = {}  # 词 -> (偏移, 长度)
+        self._doc_ids = np.empty(0, dtype=np.int64)
+        self._lengths = np.empty(0, dtype=np.int32)
+        self._postings = np.empty(0, dtype=np.int64)
+        self._tfs = np.empty(0, dtype=np.int32)
+        self._total_length = 0
+
+        self._pending = {}  # 新增文档: id -> Counter
+        self._removed = {}  # 已删除的已保存文档: id -> 长度
+
+    def __len__(self) -> int:
+        return len(self._doc_ids) - len(self._removed) + len(self._pending)
+
+    def _saved_length(self, doc_id: int):
+        row = int(np.searchsorted(self._doc_ids, doc_id))
+        if row < len(self._doc_ids) and self._doc_ids[row] == doc_id:
+            return int(self._lengths[row])
+        return None
+
+    def add(self, ids: List[int], token_lists: List[List[str]]):
+        for doc_id, tokens in zip(ids, token_lists):
+            self._pending[int(doc_id)] = Counter(tokens)
+
+    def remove(self, ids: List[int]):
+        for doc_id in ids:
+            doc_id = int(doc_id)
+            if self._pending.pop(doc_id, None) is None:
+                length = self._saved_length(doc_id)
+                if length is not None:
+                    self._removed[doc_id] = length
+
+    def _term_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """合并已保存和新增的倒排表，返回 (文档ID, 词频)"""
+        doc_ids = np.empty(0, dtype=np.int64)
+        tfs = np.empty(0, dtype=np.float32)
+        if term in self._vocabulary:
+            offset, length = self._vocabulary[term]
+            doc_ids = np.asarray(self._postings[offset:offset + length])
+            tfs = np.asarray(self._tfs[offset:offset + length], dtype=np.float32)
+            if self._removed:
+                keep = ~np.isin(doc_ids, np.fromiter(self._removed, dtype=np.int64))
+                doc_ids, tfs = doc_ids[keep], tfs[keep]
+        pending = [(doc_id, counts[term]) for doc_id, counts in self._pending.items() if term in counts]
+        if pending:
+            doc_ids = np.concatenate([doc_ids, np.array([doc_id for doc_id, _ in pending], dtype=np.int64)])
+            tfs = np.concatenate([tfs, np.array([tf for _, tf in pending], dtype=np.float32)])
+        return doc_ids, tfs
+
+    def _doc_lengths(self, doc_ids: np.ndarray) -> np.ndarray:
+        lengths = np.zeros(len(doc_ids), dtype=np.float32)
+        if len(self._doc_ids):
+            rows = np.minimum(np.searchsorted(self._doc_ids, doc_ids), len(self._doc_ids) - 1)
+            lengths[:] = self._lengths[rows]
+        for i, doc_id in enumerate(doc_ids.tolist()):
+            if doc_id in self._pending:
+                lengths[i] = sum(self._pending[doc_id].values())
+        return lengths
+
+    def search(self, tokens: List[str], top_k: int = 10) -> List[Tuple[int, float]]:
+        """BM25 检索，返回按分数降序的 (文档ID, 分数)"""
+        n = len(self)
+        if n == 0:
+            return []
+        total_length = (self._total_length - sum(self._removed.values())
+                        + sum(sum(counts.values()) for counts in self._pending.values()))
+        avgdl = total_length / n if total_length else 1.0
+
+        all_ids, all_scores = [], []
+        for term, query_tf in Counter(tokens).items():
+            doc_ids, tfs = self._term_postings(term)
+            if not len(doc_ids):
+                continue
+            idf = math.log(1 + (n - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            lengths = self._doc_lengths(doc_ids)
+            all_ids.append(doc_ids)
+            all_scores.append(query_tf * idf * tfs * (self.k1 + 1)
+                              / (tfs + self.k1 * (1 - self.b + self.b * lengths / avgdl)))
+        if not all_ids:
+            return []
+
+        # 按文档累加各词的分数
+        doc_ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        top_k = min(top_k, len(doc_ids))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return list(zip(doc_ids[top].tolist(), scores[top].tolist()))
+
+    def save(self, directory: str):
+        """写入目录"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        # 合并已保存和新增的文档及倒排表
+        documents = {}
+        inverted = {}
+        for term, (offset, length) in self._vocabulary.items():
+            for doc_id, tf in zip(self._postings[offset:offset + length].tolist(),
+                                  self._tfs[offset:offset + length].tolist()):
+                if doc_id not in self._removed:
+                    inverted.setdefault(term, []).append((doc_id, tf))
+        for doc_id, length in zip(self._doc_ids.tolist(), self._lengths.tolist()):
+            if doc_id not in self._removed:
+                documents[doc_id] = length
+        for doc_id, counts in self._pending.items():
+            documents[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                inverted.setdefault(term, []).append((doc_id, tf))
+
+        vocabulary = {}
+        postings, tfs = [], []
+        for term, entries in inverted.items():
+            entries.sort()
+            vocabulary[term] = [len(postings), len(entries)]
+            postings.extend(doc_id for doc_id, _ in entries)
+            tfs.extend(tf for _, tf in entries)
+
+        doc_ids = sorted(documents)
+        np.array(doc_ids, dtype=np.int64).tofile(directory / "bm25_docs.bin")
+        np.array([documents[doc_id] for doc_id in doc_ids], dtype=np.int32).tofile(directory / "bm25_lengths.bin")
+        np.array(postings, dtype=np.int64).tofile(directory / "bm25_postings.bin")
+        np.array(tfs, dtype=np.int32).tofile(directory / "bm25_tfs.bin")
+        meta = {
+            "k1": self.k1,
+            "b": self.b,
+            "count": len(doc_ids),
+            "postings": len(postings),
+            "total_length": int(sum(documents.values())),
+            "vocabulary": vocabulary,
+        }
+        with open(directory / "bm25_meta.json", 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        # 已写入的文档改为从新文件映射，下次保存不再重复持有和处理它们
+        self.__dict__.update(self.load(directory).__dict__)
+
+    @classmethod
+    def load(cls, directory: str) -> "BM25Index":
+        """以内存映射方式加载"""
+        directory = Path(directory)
+        with open(directory / "bm25_meta.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = cls(k1=meta["k1"], b=meta["b"])
+        n, postings = meta["count"], meta["postings"]
+        if n:
+            index._doc_ids = np.memmap(directory / "bm25_docs.bin", dtype=np.int64, mode='r', shape=(n,))
+            index._lengths = np.memmap(directory / "bm25_lengths.bin", dtype=np.int32, mode='r', shape=(n,))
+        if postings:
+            index._postings = np.memmap(directory / "bm25_postings.bin", dtype=np.int64, mode='r', shape=(postings,))
+            index._tfs = np.memmap(directory / "bm25_tfs.bin", dtype=np.int32, mode='r', shape=(postings,))
+        index._vocabulary = {term: tuple(entry) for term, entry in meta["vocabulary"].items()}
+        index._total_length = meta["total_length"]
+        return index
@@ -0,0 +1,92 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import List, Optional
+
+
+class BuildManifest:
+    """
+    知识库构建清单
+
+    记录每个源页面的内容哈希、产生的分块ID和向量化状态，以及历次构建的耗时。
+    增量构建据此只处理新增/修改/删除的页面，中断的构建也能从最近的检查点继续。
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.pages = {}  # 页面键 -> {"hash", "page", "chunk_ids", "aliases", "embedded"}
+        self.next_chunk_id = 0
+        self.building = False
+        self.builds = []
+
+    def load(self):
+        """加载已有清单"""
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.pages = data["pages"]
+            self.next_chunk_id = data["next_chunk_id"]
+            self.building = data.get("building", False)
+            self.builds = data.get("builds", [])
+        return self
+
+    def save(self):
+        """原子地写入清单，作为构建检查点"""
+        data = {
+            "pages": self.pages,
+            "next_chunk_id": self.next_chunk_id,
+            "building": self.building,
+            "builds": self.builds,
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def allocate_chunk_ids(self, count: int) -> List[int]:
+        """分配 count 个新的分块ID（ID 单调递增，从不复用）"""
+        ids = list(range(self.next_chunk_id, self.next_chunk_id + count))
+        self.next_chunk_id += count
+        return ids
+
+    def is_current(self, page_key: str, content_hash: str) -> bool:
+        """页面是否已按当前内容完成向量化"""
+        record = self.pages.get(page_key)
+        return record is not None and record["hash"] == content_hash and record["embedded"]
+
+    def set_page(self, page_key: str, content_hash: str, page_number: int, chunk_ids: List[int],
+                 embedded: bool = False, aliases: List[int] = None):
+        """aliases 为本页被去重的分块所指向的规范分块ID（规范分块可能属于其他页面）"""
+        self.pages[page_key] = {
+            "hash": content_hash,
+            "page": page_number,
+            "chunk_ids": chunk_ids,
+            "aliases": aliases or [],
+            "embedded": embedded,
+        }
+
+    def remove_page(self, page_key: str) -> List[int]:
+        """从清单移除页面，返回它的分块ID"""
+        record = self.pages.pop(page_key, None)
+        return record["chunk_ids"] if record else []
+
+    def record_build(self, mode: str, pages_processed: int, pages_removed: int, chunks_added: int,
+                     seconds: float, **extra):
+        self.builds.append({
+            "mode": mode,
+            "pages_processed": pages_processed,
+            "pages_removed": pages_removed,
+            "chunks_added": chunks_added,
+            "seconds": round(seconds, 3),
+            "finished_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            **extra,
+        })
+
+    def last_build(self, mode: str) -> Optional[dict]:
+        """最近一次指定模式（full / incremental）的构建记录"""
+        for build in reversed(self.builds):
+            if build["mode"] == mode:
+                return build
+        return None
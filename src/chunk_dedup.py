@@ -0,0 +1,76 @@
+import zlib
+from typing import Dict, Optional
+
+import numpy as np
+
+
+class MinHashDeduplicator:
+    """
+    基于 MinHash + LSH 的近似重复分块检测
+
+    文本去掉空白后取字符 n-gram 作为特征集合，num_perm 个哈希函数的最小值构成签名；
+    签名按 bands 段分桶，至少一段完全相同的分块成为候选，再用精确的 Jaccard 相似度确认。
+    """
+
+    PRIME = (1 << 31) - 1
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = 64, bands: int = 16, ngram: int = 3,
+                 seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.ngram = ngram
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, self.PRIME, size=(num_perm, 1), dtype=np.int64)
+        self._b = rng.integers(0, self.PRIME, size=(num_perm, 1), dtype=np.int64)
+        self._buckets: Dict[tuple, list] = {}
+        self._shingles: Dict[int, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self._shingles)
+
+    def shingles(self, text: str) -> np.ndarray:
+        """字符 n-gram 的 CRC32 哈希（去重、排序）"""
+        text = "".join(text.split())
+        if len(text) < self.ngram:
+            grams = [text]
+        else:
+            grams = [text[i:i + self.ngram] for i in range(len(text) - self.ngram + 1)]
+        hashes = np.fromiter((zlib.crc32(gram.encode('utf-8')) for gram in grams), dtype=np.int64, count=len(grams))
+        return np.unique(hashes % self.PRIME)
+
+    def signature(self, shingles: np.ndarray) -> np.ndarray:
+        return ((self._a * shingles[None, :] + self._b) % self.PRIME).min(axis=1)
+
+    def _bands(self, signature: np.ndarray):
+        rows = self.num_perm // self.bands
+        for band in range(self.bands):
+            yield band, signature[band * rows:(band + 1) * rows].tobytes()
+
+    def find(self, text: str, shingles: np.ndarray = None) -> Optional[int]:
+        """返回与 text 近似重复的已登记分块ID，没有时返回 None"""
+        if shingles is None:
+            shingles = self.shingles(text)
+        candidates = []
+        for key in self._bands(self.signature(shingles)):
+            for chunk_id in self._buckets.get(key, ()):
+                if chunk_id not in candidates:
+                    candidates.append(chunk_id)
+        best, best_similarity = None, self.threshold
+        for chunk_id in candidates:
+            other = self._shingles[chunk_id]
+            common = len(np.intersect1d(shingles, other, assume_unique=True))
+            similarity = common / (len(shingles) + len(other) - common)
+            if similarity >= best_similarity:
+                best, best_similarity = chunk_id, similarity
+        return best
+
+    def add(self, chunk_id: int, text: str, shingles: np.ndarray = None):
+        """登记一个规范分块"""
+        if shingles is None:
+            shingles = self.shingles(text)
+        self._shingles[chunk_id] = shingles
+        for key in self._bands(self.signature(shingles)):
+            self._buckets.setdefault(key, []).append(chunk_id)
@@ -0,0 +1,190 @@
+import json
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+class ChunkStore:
+    """
+    列式分块存储
+
+    保存目录中的文件:
+        chunks_meta.json  条数及各元数据列的类型
+        text.bin          所有分块文本的 UTF-8 拼接
+        offsets.bin       (n+1,) int64 每个分块在 text.bin 中的字节偏移
+        ids.bin           (n,) int64 分块ID，升序
+        strings.json      字符串驻留表，来源等重复字符串只存一次
+        col_<名称>.bin    (n,) int64 元数据列：int 列直接存值，str/json 列存驻留表下标
+
+    加载时只做内存映射，不解析任何文本；按ID取分块时二分查找ID列再切出对应字节，
+    常驻内存只随实际被取出的分块增长。新增、删除和元数据修改先记在内存里，保存时整体重写，
+    之后改为映射新写入的文件并清空这些修改。
+    """
+
+    MISSING = np.iinfo(np.int64).min
+
+    def __init__(self):
+        self._count = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._text = np.empty(0, dtype=np.uint8)
+        self._columns = {}  # 列名 -> (类型, 数组)
+        self._strings = []
+        self._strings_path = None
+
+        self._pending = {}  # 尚未保存的新增分块: id -> (文本, 元数据)
+        self._removed = set()  # 已删除的已保存分块ID
+        self._overrides = {}  # 已保存分块的元数据修改: id -> 元数据
+
+    def __len__(self) -> int:
+        return self._count - len(self._removed) + len(self._pending)
+
+    def __contains__(self, chunk_id: int) -> bool:
+        chunk_id = int(chunk_id)
+        if chunk_id in self._pending:
+            return True
+        return chunk_id not in self._removed and self._row(chunk_id) is not None
+
+    def _row(self, chunk_id: int):
+        row = int(np.searchsorted(self._ids, chunk_id))
+        if row < self._count and self._ids[row] == chunk_id:
+            return row
+        return None
+
+    def _get_strings(self) -> List[str]:
+        if self._strings_path is not None:
+            with open(self._strings_path, 'r', encoding='utf-8') as f:
+                self._strings = json.load(f)
+            self._strings_path = None
+        return self._strings
+
+    def _row_metadata(self, row: int) -> dict:
+        metadata = {}
+        for name, (kind, column) in self._columns.items():
+            value = int(column[row])
+            if value == self.MISSING:
+                continue
+            if kind == "int":
+                metadata[name] = value
+            elif kind == "str":
+                metadata[name] = self._get_strings()[value]
+            else:
+                metadata[name] = json.loads(self._get_strings()[value])
+        return metadata
+
+    def get(self, chunk_id: int) -> Tuple[str, dict]:
+        """按ID取分块，返回 (文本, 元数据)"""
+        chunk_id = int(chunk_id)
+        if chunk_id in self._pending:
+            text, metadata = self._pending[chunk_id]
+            return text, dict(metadata)
+        row = None if chunk_id in self._removed else self._row(chunk_id)
+        if row is None:
+            raise KeyError(chunk_id)
+        text = bytes(self._text[self._offsets[row]:self._offsets[row + 1]]).decode('utf-8')
+        if chunk_id in self._overrides:
+            return text, dict(self._overrides[chunk_id])
+        return text, self._row_metadata(row)
+
+    def get_text(self, chunk_id: int) -> str:
+        return self.get(chunk_id)[0]
+
+    def ids(self) -> List[int]:
+        """全部分块ID（升序）"""
+        saved = [int(i) for i in self._ids if int(i) not in self._removed]
+        return sorted(saved + list(self._pending))
+
+    def add(self, ids: List[int], texts: List[str], metadata: List[dict]):
+        for chunk_id, text, meta in zip(ids, texts, metadata):
+            self._pending[int(chunk_id)] = (text, dict(meta))
+
+    def remove(self, ids: List[int]):
+        for chunk_id in ids:
+            chunk_id = int(chunk_id)
+            if self._pending.pop(chunk_id, None) is None and self._row(chunk_id) is not None:
+                self._removed.add(chunk_id)
+                self._overrides.pop(chunk_id, None)
+
+    def update_metadata(self, chunk_id: int, metadata: dict):
+        """替换分块的元数据"""
+        chunk_id = int(chunk_id)
+        if chunk_id in self._pending:
+            self._pending[chunk_id] = (self._pending[chunk_id][0], dict(metadata))
+        elif chunk_id in self:
+            self._overrides[chunk_id] = dict(metadata)
+        else:
+            raise KeyError(chunk_id)
+
+    def save(self, directory: str):
+        """写入目录（目录应为新建的空目录）"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        entries = [(chunk_id,) + self.get(chunk_id) for chunk_id in self.ids()]
+
+        encoded = [text.encode('utf-8') for _, text, _ in entries]
+        offsets = np.zeros(len(entries) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        with open(directory / "text.bin", 'wb') as f:
+            f.write(b''.join(encoded))
+        offsets.tofile(directory / "offsets.bin")
+        np.array([chunk_id for chunk_id, _, _ in entries], dtype=np.int64).tofile(directory / "ids.bin")
+
+        # 按取值类型决定列类型：全为整数的存值，全为字符串的驻留，其他的转成 JSON 后驻留
+        column_kinds: Dict[str, str] = {}
+        for _, _, metadata in entries:
+            for name, value in metadata.items():
+                if isinstance(value, int) and not isinstance(value, bool):
+                    kind = "int"
+                elif isinstance(value, str):
+                    kind = "str"
+                else:
+                    kind = "json"
+                if column_kinds.setdefault(name, kind) != kind:
+                    column_kinds[name] = "json"
+
+        strings, string_index = [], {}
+        for name, kind in column_kinds.items():
+            column = np.full(len(entries), self.MISSING, dtype=np.int64)
+            for row, (_, _, metadata) in enumerate(entries):
+                if name not in metadata:
+                    continue
+                value = metadata[name]
+                if kind == "int":
+                    column[row] = value
+                    continue
+                key = value if kind == "str" else json.dumps(value, ensure_ascii=False)
+                if key not in string_index:
+                    string_index[key] = len(strings)
+                    strings.append(key)
+                column[row] = string_index[key]
+            column.tofile(directory / f"col_{name}.bin")
+
+        with open(directory / "strings.json", 'w', encoding='utf-8') as f:
+            json.dump(strings, f, ensure_ascii=False)
+        with open(directory / "chunks_meta.json", 'w', encoding='utf-8') as f:
+            json.dump({"count": len(entries), "columns": column_kinds}, f, ensure_ascii=False)
+        # 已写入的分块改为从新文件映射，下次保存不再重复持有和处理它们
+        self.__dict__.update(self.load(directory).__dict__)
+
+    @classmethod
+    def load(cls, directory: str) -> "ChunkStore":
+        """以只读内存映射方式加载"""
+        directory = Path(directory)
+        with open(directory / "chunks_meta.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        store = cls()
+        n = store._count = meta["count"]
+        if n == 0:
+            return store
+
+        store._ids = np.memmap(directory / "ids.bin", dtype=np.int64, mode='r', shape=(n,))
+        store._offsets = np.memmap(directory / "offsets.bin", dtype=np.int64, mode='r', shape=(n + 1,))
+        if store._offsets[-1] > 0:
+            store._text = np.memmap(directory / "text.bin", dtype=np.uint8, mode='r')
+        store._columns = {
+            name: (kind, np.memmap(directory / f"col_{name}.bin", dtype=np.int64, mode='r', shape=(n,)))
+            for name, kind in meta["columns"].items()
+        }
+        store._strings_path = directory / "strings.json"
+        return store
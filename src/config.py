@@ -9,6 +9,49 @@ class Config:
     DEEPSEEK_MODEL = "deepseek-v3"
     TEXT_EMBEDDING = "text-embedding-v4"
 
+    # 向量化参数
+    EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'dashscope')  # dashscope / fake（离线压测）
+    EMBEDDING_DIMENSIONS = 1024
+    EMBEDDING_BATCH_SIZE = 10  # text-embedding-v4 单次请求最多10条
+    EMBEDDING_MAX_WORKERS = 4
+    EMBEDDING_QPS = 20
+    EMBEDDING_MAX_RETRIES = 3
+    EMBEDDING_CACHE_DIR = "D://code//ai-health-assistant//knowledge_base//embedding_cache//"  # 置空则不使用缓存
+    EMBEDDING_CACHE_MAX_ENTRIES = 50000
+    EMBEDDING_CACHE_READ_ONLY = False  # 只读打开向量缓存，新向量不写回（多进程服务的工作进程自动开启）
+
+    # 向量索引参数
+    VECTOR_INDEX_TYPE = "flat"  # flat（精确） / ivf / hnsw
+    VECTOR_INDEX_DTYPE = "float32"  # float32 / float16 / int8（标量量化） / pq（乘积量化）
+    VECTOR_INDEX_DIMENSIONS = 0  # 大于 0 且小于向量维度时先用 PCA 降到该维度再存放
+    VECTOR_PQ_M = 64  # 乘积量化的段数（每个向量的字节数），需整除存放维度
+    VECTOR_RESCORE = 4  # 压缩存放时取 top_k 的这么多倍候选，用原始向量精确重打分；0 表示不重打分
+    IVF_NLIST = 0  # 0 表示按 sqrt(N) 自动选择簇数
+    IVF_NPROBE = 8
+    HNSW_M = 16
+    HNSW_EF_CONSTRUCTION = 64
+    HNSW_EF_SEARCH = 64
+
+    # 检索参数
+    RETRIEVAL_MODE = "hybrid"  # dense / lexical / hybrid / multi（多查询改写后混合检索）
+    HYBRID_CANDIDATES = 20  # 混合检索时每一路取的候选数
+    RRF_K = 60
+    QUERY_EXECUTOR_WORKERS = 32  # 异步查询入口执行阻塞任务的线程数，应不少于服务并发数的两倍
+    SPECULATIVE_MATCH_THRESHOLD = 0.9  # 改写结果与原问题的相似度不低于该值时沿用预检索结果
+
+    # 自适应检索参数（阈值取决于向量模型，用 benchmarks/adaptive_benchmark.py 校准）
+    ADAPTIVE_RETRIEVAL_ENABLED = False  # 按向量相似度分布决定候选数和是否重排序
+    ADAPTIVE_RELEVANCE_FLOOR = 0.3  # 最高相似度低于该值时视为无关问题，不检索参考资料
+    ADAPTIVE_SKIP_MARGIN = 0.1  # 第一名比第二名高出该值以上时跳过重排序
+    ADAPTIVE_FLAT_SPREAD = 0.03  # 前 rerank_top_n 名的相似度相差不到该值时扩大重排序范围
+    ADAPTIVE_EXPAND_FACTOR = 2  # 检索 rerank_top_n 的这么多倍候选，平坦时全部重排序
+
+    # 多查询检索参数
+    MULTI_QUERY_COUNT = 3  # 大模型生成的问题改写数（不含原问题）
+    MULTI_QUERY_CANDIDATES = 10  # 每个查询每一路取的候选数
+    MULTI_QUERY_CACHE_SIZE = 1000  # 按问题缓存的改写结果条数
+    MULTI_QUERY_WORKERS = 8  # 并发执行各查询检索的线程数
+
     # 文件路径
     PDF_PATH = "D:/code/ai-health-assistant/data/中国居民膳食指南.pdf"
     IMAGES_PATH = "D:/code/ai-health-assistant/data/images/"
@@ -16,11 +59,84 @@ class Config:
     KNOWLEDGE_BASE_DIR = "D://code//ai-health-assistant//knowledge_base//"
     NUTRITION_DICT_PATH = "D:/code/ai-health-assistant/data/nutrition_dict.txt"
 
+    # OCR参数
+    OCR_LANG = 'chi_sim+eng'
+    OCR_CONFIG = ''
+    OCR_WORKERS = None  # 默认使用全部CPU核心
+    OCR_CACHE_DIR = PROCESSED_DIR + "ocr_cache//"  # 置空则不使用缓存
+    OCR_BINARY_THRESHOLD = 140  # PDF页面二值化阈值
+    PDF_DPI = 300
+    PDF_RASTER_WINDOW = 0  # 每次栅格化的页数，0 表示 OCR 进程数的两倍
+    POPPLER_PATH = r'D:\aiPackage\poppler-25.07.0\Library\bin'
+
     # 大模型路径
     BGE_RERANKER_PATH = "D:/LLM/bge-reranker/BAAI/bge-reranker-large"
 
+    # 重排序参数
+    RERANKER_BACKEND = "fp32"  # fp32 / int8（动态量化） / onnx（ONNX Runtime）
+    RERANKER_THREADS = None  # 默认由 PyTorch / ONNX Runtime 决定
+    RERANKER_BATCH_SIZE = 4  # 按长度分桶后每批的输入对数
+    RERANKER_MAX_LENGTH = 512
+    RERANKER_CACHE_SIZE = 4096  # (问题, 分块ID) -> 分数 的 LRU 缓存条数
+
+    # 上下文组装参数
+    CONTEXT_MAX_TOKENS = 1500  # 发给大模型的参考资料 token 预算
+    CONTEXT_DUPLICATE_THRESHOLD = 0.85  # 与更高分段落的三元组 Jaccard 相似度不低于该值时视为重复
+
+    # 表格速查参数
+    TABLE_LOOKUP_ENABLED = True  # 营养素/食物数值查询直接从表格索引回答
+    TABLE_INDEX_PATH = KNOWLEDGE_BASE_DIR + "nutrition_tables.json"
+    TABLE_LOOKUP_MAX_ENTRIES = 6  # 匹配条目超过此数说明问题不够具体，交给 RAG
+
+    # 答案缓存参数
+    ANSWER_CACHE_ENABLED = True  # 以问题向量为键，lexical 检索模式下不使用
+    ANSWER_CACHE_THRESHOLD = 0.95  # 与历史问题的余弦相似度不低于该值时直接复用回答
+    ANSWER_CACHE_MAX_ENTRIES = 1000
+    ANSWER_CACHE_TTL = 24 * 3600  # 秒，0 表示不过期
+    ANSWER_CACHE_DIR = KNOWLEDGE_BASE_DIR + "answer_cache//"  # 置空则只缓存在内存中
+
+    # 对话记忆参数
+    MEMORY_MAX_TOKENS = 800  # 改写提示中对话历史的 token 预算
+    MEMORY_RECENT_TURNS = 2  # 原样保留的最近对话轮数
+    MEMORY_SUMMARY_MAX_TOKENS = 300  # 较早对话摘要的 token 预算
+    MEMORY_TOPIC_KEYWORDS = 5  # 较早的回答只保留这么多个关键词
+    MEMORY_LLM_SUMMARY = False  # 用大模型增量合并摘要（每轮多一次调用），否则本地截断
+
+    # 服务参数
+    SERVER_HOST = "127.0.0.1"
+    SERVER_PORT = 8000
+    SERVER_MAX_CONCURRENCY = 16  # 同时处理的请求数
+    SERVER_MAX_PENDING = 256  # 排队等待的请求超过该值时直接返回 503
+    SERVER_SESSION_TTL = 3600  # 会话空闲超过该秒数后清除
+    SERVER_WORKERS = 1  # 工作进程数；大于 1 时共用内存映射的索引，重排序交给单独的重排序服务进程
+    RERANK_BATCH_MAX_PAIRS = 64  # 一批重排序最多合并的输入对数
+    RERANK_BATCH_MAX_WAIT = 0.01  # 秒，收到第一个请求后最多等待多久再出发
+    RERANK_SERVICE_TIMEOUT = 30  # 秒，多进程模式下等待重排序服务返回分数的上限，超时的请求返回 503
+
+    # 追踪参数
+    TRACING_ENABLED = False  # 按阶段记录耗时、token、批大小和缓存命中
+    TRACING_EXPORT_PATH = ""  # 退出时把追踪汇总写入该 JSON 文件，置空则不写
+
+    # 启动参数
+    STARTUP_LAZY = True  # OCR 相关模块只在构建知识库时导入，分词词典和重排序模型在首次使用时加载
+    STARTUP_WARMUP = True  # 显示输入提示的同时在后台线程预热分词词典和重排序模型
+    STARTUP_PROFILE = False  # 打印各组件的导入和初始化耗时
+
     # 文本处理参数
     CHUNK_SIZE = 500
     CHUNK_OVERLAP = 50
+    TEXT_PROCESS_WORKERS = 0  # 清洗和分块的进程数，0 或 1 表示在构建线程内逐页处理
+
+    # 分块去重参数
+    DEDUP_ENABLED = True  # 入库前合并近似重复的分块（页眉页脚、重复的图表标题等）
+    DEDUP_THRESHOLD = 0.85  # 字符三元组 Jaccard 相似度不低于该值视为重复
+    DEDUP_NUM_PERM = 64
+    DEDUP_BANDS = 16
+
+    # 知识库构建参数
+    KB_SOURCE_NAME = "中国居民膳食指南（2022）"
+    KB_CHECKPOINT_PAGES = 20  # 每处理这么多页保存一次检查点
+    KB_SYNC_ON_STARTUP = False  # 启动时检查图片目录，增量处理新增/修改的页面
+    KB_INGEST_MODE = "images"  # images: 处理 IMAGES_PATH 中的图片；pdf: 直接流式OCR PDF_PATH
 
 config = Config()
\ No newline at end of file
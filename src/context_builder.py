@@ -0,0 +1,134 @@
+from typing import List, Tuple
+
+from src.config import Config
+from src.text_processor import estimate_tokens
+
+
+class ContextBuilder:
+    """
+    把检索到的分块组装成发给大模型的上下文
+
+    1. 同一来源、同一页且ID相邻的分块拼回连续的段落，去掉分块时的重叠部分；
+    2. 与更高分段落内容基本重复（字符三元组 Jaccard 相似度不低于阈值，或被完整包含）的段落丢弃；
+    3. 按分数从高到低装入 token 预算，放不下的最后一段在句号处截断；
+    4. 每段前加 [来源 第N页] 标签。
+    """
+
+    SCORE_KEYS = ("score", "fusion_score", "similarity", "bm25")
+
+    def __init__(self, max_tokens: int = None, max_overlap: int = None, duplicate_threshold: float = None,
+                 min_tail_tokens: int = 50):
+        self.max_tokens = max_tokens or Config.CONTEXT_MAX_TOKENS
+        # 分块重叠是固定字符数，留些余量以防清洗后长度有出入
+        self.max_overlap = max_overlap or Config.CHUNK_OVERLAP * 2
+        self.duplicate_threshold = duplicate_threshold or Config.CONTEXT_DUPLICATE_THRESHOLD
+        self.min_tail_tokens = min_tail_tokens
+
+    def _score(self, chunk: dict) -> float:
+        for key in self.SCORE_KEYS:
+            if key in chunk:
+                return float(chunk[key])
+        return 0.0
+
+    def _merge_text(self, left: str, right: str) -> str:
+        """拼接相邻分块：right 的开头与 left 的结尾重叠时只保留一份"""
+        for size in range(min(self.max_overlap, len(left), len(right)), 0, -1):
+            if left.endswith(right[:size]):
+                return left + right[size:]
+        return left + right
+
+    def _spans(self, chunks: List[dict]) -> List[dict]:
+        """把同一来源、同一页的相邻分块合并成段落"""
+        groups = {}
+        for chunk in chunks:
+            metadata = chunk.get("metadata", {})
+            groups.setdefault((metadata.get("source"), metadata.get("page")), []).append(chunk)
+
+        spans = []
+        for (source, page), group in groups.items():
+            group.sort(key=lambda chunk: chunk.get("id", 0))
+            span = None
+            for chunk in group:
+                if span is not None and "id" in chunk and chunk["id"] == span["last_id"] + 1:
+                    span["text"] = self._merge_text(span["text"], chunk["text"])
+                    span["last_id"] = chunk["id"]
+                    span["score"] = max(span["score"], self._score(chunk))
+                    span["chunks"].append(chunk)
+                    continue
+                span = {
+                    "source": source,
+                    "page": page,
+                    "text": chunk["text"],
+                    "last_id": chunk.get("id", -2),
+                    "score": self._score(chunk),
+                    "chunks": [chunk],
+                }
+                spans.append(span)
+        spans.sort(key=lambda span: span["score"], reverse=True)
+        return spans
+
+    @staticmethod
+    def _shingles(text: str) -> set:
+        text = "".join(text.split())
+        return {text[i:i + 3] for i in range(max(len(text) - 2, 1))}
+
+    def _deduplicate(self, spans: List[dict]) -> List[dict]:
+        """按分数从高到低保留，与已保留段落基本重复的丢弃"""
+        kept = []
+        for span in spans:
+            shingles = self._shingles(span["text"])
+            duplicate = False
+            for other in kept:
+                if span["text"] in other["text"]:
+                    duplicate = True
+                    break
+                union = len(shingles | other["shingles"])
+                if union and len(shingles & other["shingles"]) / union >= self.duplicate_threshold:
+                    duplicate = True
+                    break
+            if not duplicate:
+                span["shingles"] = shingles
+                kept.append(span)
+        return kept
+
+    @staticmethod
+    def _tag(span: dict) -> str:
+        source = span["source"] or "知识库"
+        # 去重后的规范分块带有所有出现过的页码
+        pages = span["chunks"][0].get("metadata", {}).get("pages") or (
+            [span["page"]] if span["page"] is not None else [])
+        if not pages:
+            return f"[{source}]"
+        return f"[{source} 第{'、'.join(str(page) for page in sorted(set(pages)))}页]"
+
+    @staticmethod
+    def _truncate(text: str, max_tokens: int) -> str:
+        """截到不超过预算的最后一个句号处"""
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if estimate_tokens(text[:mid]) <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        cut = text.rfind('。', 0, low)
+        return text[:cut + 1] if cut > 0 else text[:low]
+
+    def build(self, chunks: List[dict]) -> Tuple[str, List[dict]]:
+        """返回 (上下文文本, 实际使用的分块)"""
+        budget = self.max_tokens
+        parts, used = [], []
+        for span in self._deduplicate(self._spans(chunks)):
+            tag = self._tag(span)
+            cost = estimate_tokens(tag) + estimate_tokens(span["text"])
+            if cost <= budget:
+                parts.append(f"{tag}\n{span['text']}")
+                budget -= cost
+                used.extend(span["chunks"])
+                continue
+            remaining = budget - estimate_tokens(tag)
+            if remaining >= self.min_tail_tokens:
+                parts.append(f"{tag}\n{self._truncate(span['text'], remaining)}")
+                used.extend(span["chunks"])
+            break
+        return "\n\n".join(parts), used
@@ -0,0 +1,115 @@
+import re
+from typing import Callable, List
+
+from src.config import Config
+from src.text_processor import estimate_tokens
+
+# 指代、省略和承接上文的说法，出现时问题多半依赖上下文
+_CONTEXT_MARKERS = re.compile(
+    r'[它他她]|这[个些种样里]?|那[个些种样里么]?|(?<!尤)其|(?<!应)该|上述|刚才|前面|上面|之前|还有|另外|同样|也是|呢[？?]?$'
+)
+_QUESTION_WORDS = re.compile(r'什么|多少|怎么|怎样|如何|哪些|哪种|为什么|是否|能否|可以|吗')
+_SUBJECT_CHARS = re.compile(r'[一-龥A-Za-z0-9]')
+
+
+def is_self_contained(question: str, min_chars: int = 8) -> bool:
+    """
+    本地判断问题是否明显不依赖上下文（可以跳过改写）
+
+    没有指代/省略的说法、足够长、且带有明确的疑问词时认为是独立问题；拿不准的一律返回 False，交给大模型改写。
+    """
+    question = question.strip()
+    if len(_SUBJECT_CHARS.findall(question)) < min_chars:
+        return False
+    if _CONTEXT_MARKERS.search(question):
+        return False
+    return bool(_QUESTION_WORDS.search(question))
+
+
+class ConversationMemory:
+    """
+    有 token 预算的对话记忆，供问题改写使用
+
+    最近 recent_turns 轮原样保留（问题和回答）；更早的轮次只保留问题和回答的关键词，
+    逐轮并入滚动摘要。摘要超出预算时，默认丢掉最早的内容；提供 summarizer（如
+    DashScopeClient.get_completion）时改为让大模型把旧摘要和新一轮合并成更短的摘要。
+    render() 输出不超过 max_tokens 的文本。
+    """
+
+    def __init__(self, max_tokens: int = None, recent_turns: int = None, summary_tokens: int = None,
+                 topic_keywords: int = None, summarizer: Callable[[str], str] = None):
+        self.max_tokens = max_tokens or Config.MEMORY_MAX_TOKENS
+        self.recent_turns = recent_turns or Config.MEMORY_RECENT_TURNS
+        self.summary_tokens = summary_tokens or Config.MEMORY_SUMMARY_MAX_TOKENS
+        self.topic_keywords = topic_keywords or Config.MEMORY_TOPIC_KEYWORDS
+        self.summarizer = summarizer
+        self.turns = []  # 最近的 (问题, 回答)
+        self.summary: List[str] = []  # 滚动摘要，每行对应一轮或一次合并的结果
+        self.turn_count = 0
+
+    def __len__(self) -> int:
+        return self.turn_count
+
+    def topics(self, answer: str) -> List[str]:
+        """回答的关键词（去掉纯数字）"""
+        import jieba.analyse
+        tags = jieba.analyse.extract_tags(answer, topK=self.topic_keywords * 2)
+        return [tag for tag in tags if not tag.isdigit()][:self.topic_keywords]
+
+    def add_turn(self, question: str, answer: str):
+        """记录一轮对话；question 宜用改写后的独立问题"""
+        self.turn_count += 1
+        self.turns.append((question, answer))
+        while len(self.turns) > self.recent_turns:
+            self._fold(*self.turns.pop(0))
+
+    def _fold(self, question: str, answer: str):
+        """把移出最近窗口的一轮并入摘要"""
+        line = f"用户问：{question}；回答涉及：{'、'.join(self.topics(answer))}"
+        if self.summarizer is not None and self.summary:
+            prompt = (f"请把以下对话摘要和新一轮对话合并成一段不超过 {self.summary_tokens} 字的摘要，"
+                      f"只保留用户关心的主题和关键信息，直接输出摘要。\n\n"
+                      f"### 已有摘要 ###\n{chr(10).join(self.summary)}\n\n### 新一轮 ###\n{line}")
+            self.summary = [self.summarizer(prompt).strip()]
+        else:
+            self.summary.append(line)
+        while len(self.summary) > 1 and sum(estimate_tokens(text) for text in self.summary) > self.summary_tokens:
+            self.summary.pop(0)
+
+    def render(self) -> str:
+        """按 token 预算输出对话历史：摘要在前，最近几轮在后，超出预算时先截短较早轮次的回答"""
+        summary = "\n".join(self.summary)
+        parts = [f"[较早对话摘要]\n{summary}"] if summary else []
+        budget = self.max_tokens - estimate_tokens("".join(parts) + "[最近对话]")
+        # 问题总是保留；回答从最新一轮往前分配剩余预算，超出部分截短
+        budget -= sum(estimate_tokens(f"用户：{question}\n助手：") for question, _ in self.turns)
+        turns = []
+        for question, answer in reversed(self.turns):
+            kept = self._truncate(answer, max(budget, 0))
+            budget -= estimate_tokens(kept)
+            turns.insert(0, f"用户：{question}\n助手：{kept}")
+
+        if turns:
+            parts.append("[最近对话]\n" + "\n".join(turns))
+        return "\n".join(parts)
+
+    @staticmethod
+    def _truncate(text: str, max_tokens: int) -> str:
+        if estimate_tokens(text) <= max_tokens:
+            return text
+        if max_tokens <= 0:
+            return "……"
+        # 二分查找不超过预算的最长前缀
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if estimate_tokens(text[:mid]) <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        return text[:low] + "……"
+
+    def clear(self):
+        self.turns = []
+        self.summary = []
+        self.turn_count = 0
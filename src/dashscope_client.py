@@ -1,56 +1,223 @@
 import dashscope
-from dashscope import TextEmbedding, Generation
-from typing import List
+import time
+from dashscope import Generation
+from typing import Callable, Iterator, List
 import numpy as np
 from src.config import Config
+from src.embedding_cache import EmbeddingCache
+from src.embedding_engine import EmbeddingBackend, EmbeddingEngine, create_embedding_backend
+from src.tracing import tracer
+
+
+class StreamingResponse:
+    """
+    流式生成的回答：迭代得到增量文本，迭代结束后 text 为完整回答
+
+    同时记录首字延迟 ttft（从 started 起算，秒）、输出 token 数和生成速度；
+    迭代结束时调用 on_complete(self)。
+    """
+
+    def __init__(self, deltas: Iterator[str], started: float = None,
+                 on_complete: Callable[["StreamingResponse"], None] = None):
+        self._deltas = deltas
+        self._parts = []
+        self.on_complete = on_complete
+        self.started = started if started is not None else time.perf_counter()
+        self.ttft = None
+        self.elapsed = None
+        self.input_tokens = None
+        self.output_tokens = None  # 服务端返回的用量，没有时按增量片段数估计
+        self.failed = False
+
+    @classmethod
+    def from_text(cls, text: str, started: float = None) -> "StreamingResponse":
+        """把已有的完整回答（如缓存命中）包装成只有一个片段的流"""
+        return cls(iter([text]), started=started)
+
+    def __iter__(self) -> Iterator[str]:
+        for delta in self._deltas:
+            if self.ttft is None:
+                self.ttft = time.perf_counter() - self.started
+            self._parts.append(delta)
+            yield delta
+        self.elapsed = time.perf_counter() - self.started
+        if self.ttft is None:
+            self.ttft = self.elapsed
+        if self.output_tokens is None:
+            self.output_tokens = len(self._parts)
+        if self.on_complete is not None:
+            self.on_complete(self)
+
+    def close(self):
+        """放弃还没读取的回答（例如客户端已断开），关闭上游的生成流；不会调用 on_complete"""
+        close = getattr(self._deltas, "close", None)
+        if close is not None:
+            close()
+
+    def read(self) -> str:
+        """读完剩余的流并返回完整回答"""
+        for _ in self:
+            pass
+        return self.text
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    @property
+    def tokens_per_second(self) -> float:
+        """首字之后的生成速度（只有一个片段时无从计算，返回 0）"""
+        if len(self._parts) < 2 or not self.elapsed or self.elapsed <= self.ttft:
+            return 0.0
+        return self.output_tokens / (self.elapsed - self.ttft)
+
+    def stats(self) -> dict:
+        return {
+            "ttft": self.ttft,
+            "elapsed": self.elapsed,
+            "output_tokens": self.output_tokens,
+            "tokens_per_second": self.tokens_per_second,
+        }
 
 
 class DashScopeClient:
-    def __init__(self, api_key: str):
+    # 生成失败时回答的开头，调用方据此区分正常回答（例如不缓存失败的回答）
+    GENERATION_ERROR_PREFIX = "抱歉，生成回答时出错"
+
+    def __init__(self, api_key: str, embedding_backend: EmbeddingBackend = None):
         dashscope.api_key = api_key
         self.config = Config()
+        self.embedding_engine = EmbeddingEngine(
+            embedding_backend or create_embedding_backend(self.config),
+            batch_size=self.config.EMBEDDING_BATCH_SIZE,
+            max_workers=self.config.EMBEDDING_MAX_WORKERS,
+            qps=self.config.EMBEDDING_QPS,
+            max_retries=self.config.EMBEDDING_MAX_RETRIES,
+        )
+        # 构建和查询共用的向量缓存，重建知识库或重启后只为新文本付费
+        self.embedding_cache = None
+        if self.config.EMBEDDING_CACHE_DIR:
+            self.embedding_cache = EmbeddingCache(
+                self.config.EMBEDDING_CACHE_DIR,
+                self.embedding_engine.dimensions,
+                self.config.EMBEDDING_CACHE_MAX_ENTRIES,
+                read_only=self.config.EMBEDDING_CACHE_READ_ONLY,
+            )
 
     def get_embeddings(self, texts: List[str]) -> np.ndarray:
-        """获取文本向量"""
-        responses = []
-        for text in texts:
-            resp = TextEmbedding.call(
-                model=self.config.TEXT_EMBEDDING,
-                input=text,
-                dimensions=1024
-            )
-            # print(f"    - resp: {resp}")
-            if resp.status_code == 200:
-                responses.append(np.array(resp.output['embeddings'][0]['embedding']))
-            else:
-                raise Exception(f"Embedding error: {resp.code} - {resp.message}")
-        return np.array(responses)
+        """获取文本向量（先查缓存，未命中的批量并发请求，按输入顺序返回 float32 矩阵）"""
+        with tracer.span("embedding") as span:
+            span.batch(len(texts))
+            if self.embedding_cache is None:
+                span.add(requested_texts=len(texts))
+                return self.embedding_engine.embed(texts)
+
+            model = self.embedding_engine.backend.model
+            vectors, missing = self.embedding_cache.get_many(model, texts)
+            span.add(cache_hits=len(texts) - len(missing), cache_misses=len(missing))
+            if missing:
+                # 同一批次里重复的文本只请求一次
+                unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+                span.add(requested_texts=len(unique_texts))
+                new_vectors = self.embedding_engine.embed(unique_texts)
+                self.embedding_cache.put_many(model, unique_texts, new_vectors)
+                rows = {text: row for text, row in zip(unique_texts, new_vectors)}
+                for i in missing:
+                    vectors[i] = rows[texts[i]]
+            return vectors
+
+    def embedding_cache_stats(self) -> dict:
+        """向量缓存命中/未命中计数"""
+        if self.embedding_cache is None:
+            return {}
+        return self.embedding_cache.stats()
+
+    @staticmethod
+    def _build_prompt(prompt: str, context: str = "") -> str:
+        return f"基于以下知识：{context}\n\n请回答：{prompt}" if context else prompt
 
     def generate_response(self, prompt: str, context: str = "") -> str:
         """使用DeepSeek-V3生成回答"""
-        full_prompt = f"基于以下知识：{context}\n\n请回答：{prompt}" if context else prompt
+        full_prompt = self._build_prompt(prompt, context)
 
-        response = Generation.call(
-            model=self.config.DEEPSEEK_MODEL,
-            prompt=full_prompt,
-            max_tokens=1500,
-            temperature=0.1  # 低温度确保回答更准确
-        )
+        with tracer.span("generation") as span:
+            response = Generation.call(
+                model=self.config.DEEPSEEK_MODEL,
+                prompt=full_prompt,
+                max_tokens=1500,
+                temperature=0.1  # 低温度确保回答更准确
+            )
+            self._trace_usage(span, response)
 
         if response.status_code == 200:
             return response.output.choices[0].message.content
         else:
-            return f"抱歉，生成回答时出错: {response.code} - {response.message}"
+            return f"{self.GENERATION_ERROR_PREFIX}: {response.code} - {response.message}"
+
+    @staticmethod
+    def _trace_usage(span, response):
+        """把接口返回的 token 用量记到追踪阶段上，非 200 的响应记为错误"""
+        if response.status_code != 200:
+            span.add(errors=1)
+        usage = getattr(response, "usage", None)
+        if usage:
+            span.add(input_tokens=usage.input_tokens or 0, output_tokens=usage.output_tokens or 0)
+
+    def stream_response(self, prompt: str, context: str = "", started: float = None) -> StreamingResponse:
+        """流式生成回答，迭代返回值即可逐段得到增量文本"""
+        full_prompt = self._build_prompt(prompt, context)
+
+        def deltas():
+            with tracer.span("generation_stream") as span:
+                start = time.perf_counter()
+                responses = Generation.call(
+                    model=self.config.DEEPSEEK_MODEL,
+                    messages=[{"role": "user", "content": full_prompt}],
+                    result_format='message',
+                    stream=True,
+                    incremental_output=True,  # 每次只返回新增的片段
+                    max_tokens=1500,
+                    temperature=0.1
+                )
+                first = True
+                try:
+                    for response in responses:
+                        if response.status_code != 200:
+                            stream.failed = True
+                            span.add(errors=1)
+                            yield f"{self.GENERATION_ERROR_PREFIX}: {response.code} - {response.message}"
+                            return
+                        if response.usage:
+                            stream.input_tokens = response.usage.input_tokens
+                            stream.output_tokens = response.usage.output_tokens
+                        content = response.output.choices[0].message.content
+                        if content:
+                            if first:
+                                # 生成阶段自身的首字延迟（不含检索和重排序）
+                                tracer.record("generation_first_token", time.perf_counter() - start)
+                                first = False
+                            yield content
+                finally:
+                    # 中途被关闭（StreamingResponse.close）时释放上游的 HTTP 连接
+                    close = getattr(responses, "close", None)
+                    if close is not None:
+                        close()
+                span.add(input_tokens=stream.input_tokens or 0, output_tokens=stream.output_tokens or 0)
+
+        stream = StreamingResponse(deltas(), started=started)
+        return stream
 
     def get_completion(self, prompt):
         messages = [
             {"role": "user", "content": prompt}
         ]
 
-        response = dashscope.Generation.call(
-            model=self.config.DEEPSEEK_MODEL,
-            messages=messages,
-            result_format='message',
-            temperature=0,
-        )
+        with tracer.span("completion") as span:
+            response = dashscope.Generation.call(
+                model=self.config.DEEPSEEK_MODEL,
+                messages=messages,
+                result_format='message',
+                temperature=0,
+            )
+            self._trace_usage(span, response)
         return response.output.choices[0].message.content
\ No newline at end of file
@@ -0,0 +1,209 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    磁盘上的内容寻址向量缓存
+
+    键为 (模型, 维度, 规范化文本的哈希)。向量存放在内存映射的 float32 文件中，
+    index.json 记录键到槽位的映射和最近使用时间，条目数超过上限时淘汰最久未使用的条目。
+
+    槽位分配和 index.json 只由一个进程维护。read_only=True 时（多进程服务的工作进程）
+    只读映射打开时已有的条目，新算出的向量不写回，避免多个进程各自分配槽位、互相覆盖索引。
+    """
+
+    INITIAL_CAPACITY = 1024
+    # 写入的条目攒到一定数量或时间后再落盘索引，避免每次查询都重写 index.json
+    FLUSH_EVERY = 256
+    FLUSH_INTERVAL = 5.0
+
+    def __init__(self, cache_dir: str, dimensions: int, max_entries: int = 50000, read_only: bool = False):
+        self.cache_dir = Path(cache_dir)
+        self.dimensions = dimensions
+        self.max_entries = max_entries
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> [slot, last_used]
+        self._free_slots = []
+        self._tick = 0
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+        self._vectors_path = self.cache_dir / "vectors.f32"
+        self._index_path = self.cache_dir / "index.json"
+        if read_only:
+            self._load_read_only()
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """规范化文本：全半角统一、合并空白"""
+        text = unicodedata.normalize('NFKC', text)
+        return re.sub(r'\s+', ' ', text).strip()
+
+    def make_key(self, model: str, text: str) -> str:
+        raw = f"{model}\0{self.dimensions}\0{self.normalize(text)}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _load(self):
+        capacity = self.INITIAL_CAPACITY
+        if self._index_path.exists() and self._vectors_path.exists():
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get("dimensions") == self.dimensions:
+                self._entries = index["entries"]
+                self._tick = index["tick"]
+                capacity = index["capacity"]
+        if not self._entries and self._vectors_path.exists():
+            # 维度变化或索引丢失，旧向量无法再使用
+            self._vectors_path.unlink()
+        self._capacity = 0
+        self._vectors = None
+        self._resize(capacity)
+        used = {slot for slot, _ in self._entries.values()}
+        self._free_slots = [slot for slot in range(self._capacity - 1, -1, -1) if slot not in used]
+
+    def _load_read_only(self):
+        self._capacity = 0
+        self._vectors = None
+        if not (self._index_path.exists() and self._vectors_path.exists()):
+            return
+        with open(self._index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        rows = min(index["capacity"], self._vectors_path.stat().st_size // (self.dimensions * 4))
+        if index.get("dimensions") != self.dimensions or rows == 0:
+            return
+        self._entries = {key: entry for key, entry in index["entries"].items() if entry[0] < rows}
+        self._tick = index["tick"]
+        self._capacity = rows
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dimensions))
+
+    def _resize(self, capacity: int):
+        """把向量文件扩容到 capacity 个槽位并重新映射"""
+        if self._vectors is not None:
+            # 扩容前释放旧映射（Windows 上映射中的文件不能改变大小）；没有别处引用它，去掉引用即解除映射
+            self._vectors.flush()
+            self._vectors = None
+        size = capacity * self.dimensions * 4
+        with open(self._vectors_path, 'ab') as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r+',
+                                  shape=(capacity, self.dimensions))
+        self._free_slots = list(range(capacity - 1, self._capacity - 1, -1)) + self._free_slots
+        self._capacity = capacity
+
+    def _allocate_slot(self) -> int:
+        if not self._free_slots:
+            if self._capacity < self.max_entries:
+                self._resize(min(self._capacity * 2, self.max_entries))
+            else:
+                self._evict(max(1, self.max_entries // 10))
+        return self._free_slots.pop()
+
+    def _evict(self, count: int):
+        """
+        淘汰最久未使用的 count 个条目
+
+        腾出的槽位马上会写入别的向量，先把不含这些键的索引落盘；否则在下次落盘前崩溃，
+        磁盘上的索引会把被淘汰的键指向新写入的向量，重新打开时也发现不了。
+        """
+        oldest = sorted(self._entries.items(), key=lambda item: item[1][1])[:count]
+        for key, (slot, _) in oldest:
+            del self._entries[key]
+            self._free_slots.append(slot)
+        self.evictions += len(oldest)
+        self._flush_locked()
+
+    def get_many(self, model: str, texts: List[str]) -> Tuple[np.ndarray, List[int]]:
+        """
+        批量查询缓存
+
+        返回:
+            vectors: 形状为 (len(texts), dimensions) 的矩阵，未命中的行内容未定义
+            missing: 未命中文本的下标
+        """
+        vectors = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        missing = []
+        with self._lock:
+            for i, text in enumerate(texts):
+                entry = self._entries.get(self.make_key(model, text))
+                if entry is None:
+                    missing.append(i)
+                    continue
+                self._tick += 1
+                entry[1] = self._tick
+                vectors[i] = self._vectors[entry[0]]
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return vectors, missing
+
+    def put_many(self, model: str, texts: List[str], vectors: np.ndarray):
+        """批量写入缓存（只读时不写入）"""
+        if self.read_only:
+            return
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = self.make_key(model, text)
+                self._tick += 1
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = self._entries[key] = [self._allocate_slot(), self._tick]
+                else:
+                    entry[1] = self._tick
+                self._vectors[entry[0]] = vector
+            self._pending += len(texts)
+            if self._pending >= self.FLUSH_EVERY or time.monotonic() - self._last_flush > self.FLUSH_INTERVAL:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        # 先落盘向量再落盘索引，保证索引引用的槽位已写入
+        self._vectors.flush()
+        index = {
+            "dimensions": self.dimensions,
+            "capacity": self._capacity,
+            "tick": self._tick,
+            "entries": self._entries,
+        }
+        tmp_path = self._index_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._index_path)
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        """把缓存索引写入磁盘"""
+        if self.read_only:
+            return
+        with self._lock:
+            self._flush_locked()
+
+    def stats(self) -> dict:
+        """缓存命中统计"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,214 @@
+import hashlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class EmbeddingError(Exception):
+    """向量化请求失败"""
+
+    # 限流和服务端错误可以重试，参数错误等重试也没用
+    TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(self, status_code: int, code: str = "", message: str = ""):
+        super().__init__(f"Embedding error: {status_code} {code} - {message}")
+        self.status_code = status_code
+        self.code = code
+        self.message = message
+
+    @property
+    def transient(self) -> bool:
+        return self.status_code in self.TRANSIENT_STATUS_CODES
+
+
+class TokenBucket:
+    """令牌桶限流器，限制每秒发出的请求数"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        """取出令牌，不足时阻塞等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class EmbeddingBackend:
+    """向量化后端接口：一次请求把一批文本转成向量"""
+
+    model: str = ""
+    dimensions: int = 0
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class DashScopeEmbeddingBackend(EmbeddingBackend):
+    """调用 DashScope TextEmbedding 接口"""
+
+    def __init__(self, model: str, dimensions: int = 1024):
+        self.model = model
+        self.dimensions = dimensions
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        from dashscope import TextEmbedding
+
+        resp = TextEmbedding.call(model=self.model, input=texts, dimension=self.dimensions)
+        if resp.status_code != 200:
+            raise EmbeddingError(resp.status_code, resp.code, resp.message)
+
+        vectors = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        # 接口按 text_index 标识每条结果对应的输入
+        for item in resp.output['embeddings']:
+            vectors[item['text_index']] = item['embedding']
+        return vectors
+
+
+class FakeEmbeddingBackend(EmbeddingBackend):
+    """
+    本地伪造的向量化后端，用于离线压测构建吞吐
+
+    向量由文本哈希确定性生成并归一化，同一文本总是得到同一向量。
+    latency 模拟每次请求的往返耗时，per_text_latency 模拟按条计费的处理耗时，
+    failure_rate 模拟限流等可重试错误。
+    """
+
+    def __init__(self, dimensions: int = 1024, latency: float = 0.05, per_text_latency: float = 0.0,
+                 failure_rate: float = 0.0, model: str = "fake-embedding"):
+        self.model = model
+        self.dimensions = dimensions
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency + self.per_text_latency * len(texts))
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise EmbeddingError(429, "Throttling", "fake backend throttled")
+
+        vectors = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha1(text.encode('utf-8')).digest()[:8], 'little')
+            vec = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+            vectors[i] = vec / np.linalg.norm(vec)
+        return vectors
+
+
+def create_embedding_backend(config) -> EmbeddingBackend:
+    """根据配置创建向量化后端"""
+    if config.EMBEDDING_BACKEND == "fake":
+        return FakeEmbeddingBackend(dimensions=config.EMBEDDING_DIMENSIONS)
+    return DashScopeEmbeddingBackend(config.TEXT_EMBEDDING, config.EMBEDDING_DIMENSIONS)
+
+
+class EmbeddingEngine:
+    """
+    批量并发向量化引擎
+
+    把文本按接口上限打包成批次，通过有界线程池并发发送，令牌桶限制 QPS，
+    可重试错误按指数退避重试，最终按输入顺序返回一个连续的 float32 矩阵。
+    """
+
+    def __init__(self, backend: EmbeddingBackend, batch_size: int = 10, max_workers: int = 4,
+                 qps: Optional[float] = None, max_retries: int = 3, backoff: float = 0.5,
+                 max_batch_chars: Optional[int] = None):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.limiter = TokenBucket(qps) if qps else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_batch_chars = max_batch_chars
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def dimensions(self) -> int:
+        return self.backend.dimensions
+
+    def _make_batches(self, texts: List[str]) -> List[Tuple[int, int]]:
+        """按条数（以及可选的字符数）上限切分批次，返回 [start, end) 区间"""
+        batches = []
+        start = 0
+        chars = 0
+        for i, text in enumerate(texts):
+            full = i - start >= self.batch_size
+            if self.max_batch_chars and i > start and chars + len(text) > self.max_batch_chars:
+                full = True
+            if full:
+                batches.append((start, i))
+                start, chars = i, 0
+            chars += len(text)
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """发送一个批次，可重试错误按指数退避重试"""
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                self.limiter.acquire()
+            try:
+                return self.backend.embed(texts)
+            except EmbeddingError as e:
+                if not e.transient or attempt >= self.max_retries:
+                    raise
+            except (ConnectionError, TimeoutError, OSError):
+                if attempt >= self.max_retries:
+                    raise
+            # 退避时间加随机抖动，避免并发批次同时重试
+            time.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+            attempt += 1
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix="embedding")
+            return self._executor
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """获取文本向量，返回形状为 (len(texts), dimensions) 的 float32 矩阵"""
+        result = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        batches = self._make_batches(texts)
+
+        # 查询路径通常只有一个批次，直接在当前线程发送
+        if len(batches) <= 1 or self.max_workers <= 1:
+            for start, end in batches:
+                result[start:end] = self._embed_batch(texts[start:end])
+            return result
+
+        executor = self._get_executor()
+        futures = [(start, end, executor.submit(self._embed_batch, texts[start:end]))
+                   for start, end in batches]
+        for start, end, future in futures:
+            result[start:end] = future.result()
+        return result
+
+    def close(self):
+        """关闭线程池"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
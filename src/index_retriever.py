@@ -0,0 +1,19 @@
+from typing import Any, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+
+class IndexRetriever(BaseRetriever):
+    """基于原生向量索引的 LangChain 检索器，供 MultiQueryRetriever 使用"""
+
+    vector_store: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        embedding = self.vector_store._get_embedding_client().get_embeddings([query])[0]
+        return [
+            Document(page_content=result["text"], metadata=result["metadata"])
+            for result in self.vector_store.search(embedding, self.k)
+        ]
@@ -0,0 +1,298 @@
+import math
+import os
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Tuple
+
+from src.build_manifest import BuildManifest
+from src.chunk_dedup import MinHashDeduplicator
+from src.config import Config
+from src.nutrition_table import NutritionTableIndex
+from src.ocr_cache import OCRCache
+from src.startup_profile import profile
+from src.text_processor import Chunk, TextProcessor
+from src.tracing import tracer
+from src.vector_store import VectorStore
+
+if TYPE_CHECKING:
+    from src.pdf_processor import PDFProcessor
+
+
+class KnowledgeBaseBuilder:
+    """
+    增量、可断点续跑的知识库构建流程：OCR → 清洗 → 分块 → 向量化 → 入库
+
+    构建清单记录每个源页面的哈希和分块ID。每次构建只处理新增或内容变化的页面，
+    并从索引中删除已移除/已变化页面的旧分块；每处理完一批页面就保存索引和清单作为检查点。
+
+    开启去重时，与已入库分块近似重复的分块不再向量化，只把页码追加到规范分块的 pages 元数据，
+    清单中记为该页的 aliases；规范分块所在页面被移除时，引用它的页面一并重新处理。
+    """
+
+    def __init__(self, pdf_processor: "PDFProcessor", text_processor: TextProcessor, vector_store: VectorStore):
+        self.config = Config
+        # 为 None 时在第一次构建时才创建：知识库已存在时不必导入 OCR 相关模块
+        self._pdf_processor = pdf_processor
+        self._text_processor = text_processor
+        self.vector_store = vector_store
+        self.manifest = BuildManifest(Path(self.config.KNOWLEDGE_BASE_DIR) / "manifest.json").load()
+        self.deduplicator = None
+        self._dedup_stats = {}
+
+    @property
+    def pdf_processor(self) -> "PDFProcessor":
+        if self._pdf_processor is None:
+            with profile.measure("pdf_processor", "import"):
+                from src.pdf_processor import PDFProcessor
+            with profile.measure("pdf_processor"):
+                self._pdf_processor = PDFProcessor()
+        return self._pdf_processor
+
+    @property
+    def text_processor(self) -> TextProcessor:
+        if self._text_processor is None:
+            with profile.measure("text_processor"):
+                self._text_processor = TextProcessor()
+        return self._text_processor
+
+    LEGACY_PAGE_KEY = "legacy"
+
+    def import_legacy(self) -> int:
+        """
+        把旧版本留下的 texts.json / metadata.json 一次性导入当前的索引格式，返回导入的分块数
+
+        只在索引为空且构建清单中没有任何页面时执行：不需要OCR，只按当前向量模型重新计算向量。
+        导入的分块在清单中记为一个 legacy 页面，之后的同步构建会像处理已删除的页面一样整体替换掉它们。
+        """
+        if not self.vector_store.is_empty() or self.manifest.pages:
+            return 0
+        legacy = self.vector_store.load_legacy()
+        if legacy is None:
+            return 0
+        texts, metadata = legacy
+        print(f"  - 导入旧版本知识库的 {len(texts)} 个分块（重新计算向量，不需要OCR）...")
+        ids = self.manifest.allocate_chunk_ids(len(texts))
+        self.manifest.set_page(self.LEGACY_PAGE_KEY, "", 0, ids, embedded=False)
+        # 导入中断时按构建中断处理：下次启动会移除 legacy 页面并重新构建
+        self.manifest.building = True
+        self.manifest.save()
+
+        metadata = [dict(meta, chunk_id=chunk_id) for chunk_id, meta in zip(ids, metadata)]
+        self.vector_store.add_embeddings(texts, metadata, ids)
+        self.vector_store.save()
+
+        self.manifest.pages[self.LEGACY_PAGE_KEY]["embedded"] = True
+        self.manifest.building = False
+        self.manifest.save()
+        return len(texts)
+
+    def needs_build(self) -> bool:
+        """知识库为空，或上次构建被中断"""
+        return self.vector_store.is_empty() or self.manifest.building
+
+    def scan_images(self, img_dir: str) -> dict:
+        """扫描图片目录，返回 文件名 -> (页码, 内容哈希)"""
+        return {
+            name: (page_number, OCRCache.file_hash(os.path.join(img_dir, name)))
+            for page_number, name in self.pdf_processor.list_images(img_dir)
+        }
+
+    def scan_pdf(self, pdf_path: str) -> dict:
+        """扫描PDF文件，返回 页面键 -> (页码, 内容哈希)；页面共用整个文件的哈希，文件变化时全部页面重新处理"""
+        content_hash = OCRCache.file_hash(pdf_path)
+        return {
+            self.pdf_processor.pdf_page_key(pdf_path, page_number): (page_number, content_hash)
+            for page_number in range(1, self.pdf_processor.pdf_page_count(pdf_path) + 1)
+        }
+
+    @staticmethod
+    def _is_pdf(source: str) -> bool:
+        return source.lower().endswith(".pdf") and os.path.isfile(source)
+
+    def _iter_text(self, source: str, current: dict, todo: List[str]):
+        """逐页返回待处理页面的OCR文本：PDF按窗口流式栅格化，图片目录逐张识别"""
+        if self._is_pdf(source):
+            return self.pdf_processor.iter_pdf_text(source, [current[page_key][0] for page_key in todo])
+        return self.pdf_processor.iter_images_text(source, todo)
+
+    def build(self, source: str = None) -> dict:
+        """增量构建知识库，返回本次构建的统计信息；source 为图片目录或PDF文件"""
+        start = time.perf_counter()
+        source = source or self.config.IMAGES_PATH
+        current = self.scan_pdf(source) if self._is_pdf(source) else self.scan_images(source)
+        had_pages = any(record["embedded"] for record in self.manifest.pages.values())
+
+        # 移除已删除、内容已变化或上次未完成向量化的页面的旧分块
+        stale_keys = [
+            page_key for page_key in self.manifest.pages
+            if not (page_key in current and self.manifest.is_current(page_key, current[page_key][1]))
+        ]
+        stale_keys = self._with_dependent_pages(stale_keys)
+        stale_ids = [chunk_id for page_key in stale_keys for chunk_id in self.manifest.pages[page_key]["chunk_ids"]]
+        pages_removed = 0
+        for page_key in stale_keys:
+            if page_key not in current:
+                pages_removed += 1
+            record = self.manifest.pages[page_key]
+            self._detach_aliases(record.get("aliases", []), record["page"], set(stale_ids))
+            self.manifest.remove_page(page_key)
+        if stale_ids:
+            self.vector_store.delete(stale_ids)
+        if stale_keys:
+            # 先保存移除结果再写清单：否则没有新页面要处理时删除只留在内存里，
+            # 重启后索引中仍有这些分块，清单里却已没有指向它们的页面，之后再也删不掉
+            self.vector_store.save()
+
+        todo = [name for name in current if name not in self.manifest.pages]
+        mode = "incremental" if had_pages else "full"
+        print(f"  - 构建模式: {mode}，待处理 {len(todo)} 页，移除 {pages_removed} 页")
+
+        self.manifest.building = True
+        self.manifest.save()
+
+        self._dedup_stats = {"chunks_deduplicated": 0, "embedding_calls_saved": 0, "bytes_saved": 0}
+        if self.config.DEDUP_ENABLED and todo:
+            self._load_deduplicator()
+
+        chunks_added = 0
+        batch = []
+        # 逐页OCR的生成器直接接到流式分块上，分块带着在原始页面文本中的字符偏移
+        pages = tracer.iterate("ocr", self._iter_text(source, current, todo))
+        for page_number, page_key, chunks in self.text_processor.iter_page_chunks(
+                pages, self.config.CHUNK_SIZE, self.config.CHUNK_OVERLAP, workers=self.config.TEXT_PROCESS_WORKERS):
+            batch.append((page_key, current[page_key][1], page_number, chunks))
+            if len(batch) >= self.config.KB_CHECKPOINT_PAGES:
+                chunks_added += self._commit(batch)
+                batch = []
+        chunks_added += self._commit(batch)
+
+        seconds = time.perf_counter() - start
+        self.manifest.building = False
+        self.manifest.record_build(mode, len(todo), pages_removed, chunks_added, seconds, **self._dedup_stats)
+        self.manifest.save()
+
+        print(f"  - 构建完成（{mode}）：处理 {len(todo)} 页，移除 {pages_removed} 页，"
+              f"新增 {chunks_added} 个分块，用时 {seconds:.1f}s")
+        if self._dedup_stats["chunks_deduplicated"]:
+            print(f"  - 去重：合并 {self._dedup_stats['chunks_deduplicated']} 个重复分块，"
+                  f"少调用向量化接口 {self._dedup_stats['embedding_calls_saved']} 次，"
+                  f"索引减少约 {self._dedup_stats['bytes_saved'] / 1024:.1f} KB")
+        last_full = self.manifest.last_build("full")
+        if mode == "incremental" and last_full:
+            print(f"  - 对比最近一次全量构建：处理 {last_full['pages_processed']} 页，用时 {last_full['seconds']:.1f}s")
+        return self.manifest.builds[-1]
+
+    def build_table_index(self, pdf_path: str = None, index_path: str = None) -> NutritionTableIndex:
+        """从PDF表格建立营养素/食物数值索引；PDF内容没变时直接加载已有索引"""
+        pdf_path = pdf_path or self.config.PDF_PATH
+        index_path = index_path or self.config.TABLE_INDEX_PATH
+        index = NutritionTableIndex.load(index_path)
+        if not os.path.isfile(pdf_path):
+            print(f"  - 未找到PDF文件，跳过表格索引: {pdf_path}")
+            return index
+        content_hash = OCRCache.file_hash(pdf_path)
+        if index.source_hash == content_hash:
+            return index
+
+        start = time.perf_counter()
+        tables = self.pdf_processor.extract_tables_with_page_numbers(pdf_path)
+        index = NutritionTableIndex.from_tables(tables, content_hash)
+        index.save(index_path)
+        print(f"  - 表格索引：{len(tables)} 个表格，{len(index)} 个条目，用时 {time.perf_counter() - start:.1f}s")
+        return index
+
+    def _with_dependent_pages(self, stale_keys: List[str]) -> List[str]:
+        """加上 aliases 指向待移除分块的页面（它们的重复分块要改由其他页面承载，需重新处理）"""
+        stale = set(stale_keys)
+        removed_ids = {chunk_id for page_key in stale for chunk_id in self.manifest.pages[page_key]["chunk_ids"]}
+        changed = True
+        while changed:
+            changed = False
+            for page_key, record in self.manifest.pages.items():
+                if page_key not in stale and removed_ids.intersection(record.get("aliases", [])):
+                    stale.add(page_key)
+                    removed_ids.update(record["chunk_ids"])
+                    changed = True
+        return [page_key for page_key in self.manifest.pages if page_key in stale]
+
+    def _detach_aliases(self, aliases: List[int], page_number: int, removed_ids: set):
+        """从仍然保留的规范分块的 pages 元数据中去掉被移除页面的页码"""
+        for canonical in aliases:
+            if canonical in removed_ids or canonical not in self.vector_store.chunks:
+                continue
+            _, metadata = self.vector_store.get_chunk(canonical)
+            pages = list(metadata.get("pages", []))
+            if page_number in pages:
+                pages.remove(page_number)
+                metadata["pages"] = pages
+                self.vector_store.update_metadata(canonical, metadata)
+
+    def _load_deduplicator(self):
+        """用已入库的分块初始化去重索引"""
+        self.deduplicator = MinHashDeduplicator(
+            threshold=self.config.DEDUP_THRESHOLD,
+            num_perm=self.config.DEDUP_NUM_PERM,
+            bands=self.config.DEDUP_BANDS,
+        )
+        for chunk_id in self.vector_store.chunks.ids():
+            self.deduplicator.add(chunk_id, self.vector_store.chunks.get_text(chunk_id))
+
+    def _add_alias(self, canonical: int, page_number: int, pending: dict):
+        """把页码追加到规范分块的 pages 元数据（规范分块可能还在本批次中未入库）"""
+        if canonical in pending:
+            pending[canonical]["pages"].append(page_number)
+            return
+        _, metadata = self.vector_store.get_chunk(canonical)
+        metadata["pages"] = list(metadata.get("pages", [metadata.get("page")])) + [page_number]
+        self.vector_store.update_metadata(canonical, metadata)
+
+    def _commit(self, batch: List[Tuple[str, str, int, List[Chunk]]]) -> int:
+        """向量化一批页面并保存检查点，返回新增分块数"""
+        if not batch:
+            return 0
+        texts, ids = [], []
+        pending = {}  # 本批次新增分块的元数据: id -> metadata
+        duplicates = 0
+        for page_key, content_hash, page_number, chunks in batch:
+            unique, aliases = [], []
+            for chunk in chunks:
+                text = chunk[0]
+                canonical = self.deduplicator.find(text) if self.deduplicator is not None else None
+                if canonical is None:
+                    unique.append(chunk)
+                    continue
+                aliases.append(canonical)
+                self._add_alias(canonical, page_number, pending)
+                duplicates += 1
+                self._dedup_stats["bytes_saved"] += self._index_bytes(text)
+
+            chunk_ids = self.manifest.allocate_chunk_ids(len(unique))
+            self.manifest.set_page(page_key, content_hash, page_number, chunk_ids, embedded=False, aliases=aliases)
+            for chunk_id, (text, char_start, char_end) in zip(chunk_ids, unique):
+                pending[chunk_id] = {"source": self.config.KB_SOURCE_NAME, "page": page_number,
+                                     "pages": [page_number], "chunk_id": chunk_id,
+                                     "char_start": char_start, "char_end": char_end}
+                if self.deduplicator is not None:
+                    self.deduplicator.add(chunk_id, text)
+                texts.append(text)
+            ids.extend(chunk_ids)
+        if duplicates:
+            batch_size = self.config.EMBEDDING_BATCH_SIZE
+            self._dedup_stats["chunks_deduplicated"] += duplicates
+            self._dedup_stats["embedding_calls_saved"] += (
+                math.ceil((len(texts) + duplicates) / batch_size) - math.ceil(len(texts) / batch_size))
+        # 先记下分块ID，即使向量化中途失败，下次也能据此清理残留分块
+        self.manifest.save()
+
+        if texts:
+            self.vector_store.add_embeddings(texts, [pending[chunk_id] for chunk_id in ids], ids)
+        self.vector_store.save()
+
+        for page_key, _, _, _ in batch:
+            self.manifest.pages[page_key]["embedded"] = True
+        self.manifest.save()
+        return len(texts)
+
+    def _index_bytes(self, text: str) -> int:
+        """一个分块在索引中常驻内存的字节数（向量 + 文本 + ID 列）"""
+        return self.vector_store.index.bytes_per_vector + len(text.encode('utf-8')) + 8
@@ -0,0 +1,84 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, List
+
+from src.tracing import tracer
+
+# 行首的编号或列表符号：1. / 1、/ (1) / - / •
+_NUMBERING = re.compile(r'^\s*(?:\d+\s*[.、．:：)）]|[（(]\d+[)）]|[-*•])\s*')
+_NON_WORD = re.compile(r'[^\u4e00-\u9fa5\w]')
+
+
+def normalize_question(question: str) -> str:
+    """去掉空白和标点并转小写，作为缓存键"""
+    return _NON_WORD.sub('', question).lower()
+
+
+class MultiQueryGenerator:
+    """
+    多查询改写：让大模型把问题换几种说法，用于从多个角度检索
+
+    一个问题只调用一次大模型，结果按规范化后的问题缓存（LRU），同一问题换个标点或空格再问也直接命中。
+    大模型调用失败时返回空列表（只用原问题检索），失败结果不缓存。
+    """
+
+    PROMPT = """你是一个AI语言模型助手。你的任务是为给定的用户问题生成{count}个不同版本的问题，用于从向量数据库中检索相关文档。
+通过从多个角度改写问题，帮助用户克服基于距离的相似度搜索的局限。
+只输出改写后的问题，每行一个，不要编号和解释。
+原始问题：{question}"""
+
+    def __init__(self, complete: Callable[[str], str], count: int = 3, cache_size: int = 1000):
+        self.complete = complete
+        self.count = count
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()  # 规范化问题 -> 改写列表
+        self._lock = threading.Lock()
+
+    def variants(self, question: str) -> List[str]:
+        """返回问题的其他说法（不含原问题），最多 count 个"""
+        key = normalize_question(question)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                tracer.record("multi_query_variants", cache_hits=1)
+                return list(self._cache[key])
+            self.misses += 1
+
+        with tracer.span("multi_query_variants") as span:
+            span.add(cache_misses=1)
+            try:
+                text = self.complete(self.PROMPT.format(count=self.count, question=question))
+            except Exception as e:
+                print(f"多查询改写失败，只使用原问题检索: {e}")
+                span.add(errors=1)
+                return []
+        variants = self.parse(text, question, self.count)
+
+        with self._lock:
+            self._cache[key] = variants
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return list(variants)
+
+    @staticmethod
+    def parse(text: str, question: str, count: int) -> List[str]:
+        """逐行解析大模型输出：去掉编号，丢弃空行、与原问题或彼此重复的行"""
+        seen = {normalize_question(question)}
+        variants = []
+        for line in (text or "").splitlines():
+            line = _NUMBERING.sub('', line).strip()
+            key = normalize_question(line)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            variants.append(line)
+            if len(variants) >= count:
+                break
+        return variants
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
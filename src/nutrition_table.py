@@ -0,0 +1,346 @@
+import json
+import math
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# 规范名 -> 别名；匹配时取最长的不重叠别名，"蛋白质"不会被当成"蛋"，"水果"不会被当成"水"
+NUTRIENTS = {
+    "能量": ["能量", "热量"],
+    "蛋白质": ["蛋白质"],
+    "脂肪": ["脂肪"],
+    "碳水化合物": ["碳水化合物", "碳水"],
+    "膳食纤维": ["膳食纤维"],
+    "钙": ["钙"],
+    "磷": ["磷"],
+    "钾": ["钾"],
+    "钠": ["钠"],
+    "镁": ["镁"],
+    "铁": ["铁"],
+    "锌": ["锌"],
+    "碘": ["碘"],
+    "硒": ["硒"],
+    "铜": ["铜"],
+    "维生素A": ["维生素A", "维A"],
+    "维生素D": ["维生素D", "维D"],
+    "维生素E": ["维生素E", "维E"],
+    "维生素K": ["维生素K"],
+    "维生素B1": ["维生素B1", "硫胺素"],
+    "维生素B2": ["维生素B2", "核黄素"],
+    "维生素B6": ["维生素B6"],
+    "维生素B12": ["维生素B12"],
+    "维生素C": ["维生素C", "维C"],
+    "叶酸": ["叶酸"],
+    "烟酸": ["烟酸"],
+    "胆碱": ["胆碱"],
+}
+
+FOODS = {
+    "谷类": ["谷类", "谷物", "粮食"],
+    "全谷物和杂豆": ["全谷物和杂豆", "全谷物", "杂豆"],
+    "薯类": ["薯类"],
+    "蔬菜": ["蔬菜类", "蔬菜"],
+    "水果": ["水果类", "水果"],
+    "畜禽肉": ["畜禽肉", "畜禽肉类", "肉类"],
+    "水产品": ["水产品", "鱼虾"],
+    "蛋类": ["蛋类", "鸡蛋"],
+    "奶及奶制品": ["奶及奶制品", "奶制品", "奶类", "牛奶"],
+    "大豆及坚果": ["大豆及坚果类", "大豆及坚果", "大豆", "坚果"],
+    "盐": ["食盐", "盐"],
+    "烹调油": ["烹调油", "食用油", "油"],
+    "饮水": ["饮水", "饮水量", "喝水"],
+}
+
+# 人群规范名 -> (别名, 年龄范围)；表中只写年龄段（如 18~49岁）的行按年龄范围匹配人群
+POPULATIONS = {
+    "婴儿": (["婴儿", "婴幼儿"], (0, 1)),
+    "儿童": (["儿童", "幼儿", "学龄前儿童", "学龄儿童"], (1, 12)),
+    "青少年": (["青少年"], (12, 18)),
+    "成年人": (["成年人", "成人", "成年"], (18, 65)),
+    "老年人": (["老年人", "老人", "老年"], (65, math.inf)),
+    "孕早期": (["孕早期"], None),
+    "孕中期": (["孕中期"], None),
+    "孕晚期": (["孕晚期"], None),
+    "孕妇": (["孕妇", "孕期"], None),
+    "乳母": (["乳母", "哺乳期"], None),
+}
+
+SEXES = {"男": ["男性", "男"], "女": ["女性", "女"]}
+
+# 参考摄入量指标；只写了"摄入量"/"推荐量"的表格（如各类食物的推荐摄入量）归为"推荐量"
+METRICS = {
+    "RNI": ["RNI"],
+    "AI": ["适宜摄入量", "AI"],
+    "EAR": ["平均需要量", "EAR"],
+    "UL": ["可耐受最高摄入量", "UL"],
+    "推荐量": ["推荐摄入量", "推荐量", "建议摄入量", "摄入量"],
+}
+METRIC_NAMES = {"RNI": "推荐摄入量（RNI）", "AI": "适宜摄入量（AI）", "EAR": "平均需要量（EAR）",
+                "UL": "可耐受最高摄入量（UL）", "推荐量": "推荐摄入量"}
+
+_VALUE = re.compile(r'^[≥≤<>约]?\s*\d+(\.\d+)?(\s*[~～\-－—]\s*\d+(\.\d+)?)?\s*(%|g|mg|μg|ug|kcal|MJ|ml|mL|份|个|杯)?$')
+_UNIT = re.compile(r'[（(]\s*([^()（）]*?(?:g|mg|μg|ug|kcal|MJ|ml|mL|份|个|杯)[^()（）]*?)\s*[)）]')
+_AGE_RANGE = re.compile(r'(\d+(?:\.\d+)?)\s*(?:岁)?\s*[~～\-－—至到]\s*(\d+(?:\.\d+)?)?\s*岁?')
+_QUESTION_AGE = re.compile(r'(\d+(?:\.\d+)?)\s*(?:周岁|岁)')
+_LOOKUP_INTENT = re.compile(r'多少|几(?:克|毫克|微克|份|个|杯|两)|摄入量|推荐量|需要量|需求量|适宜量|标准|上限|最高')
+_NOT_LOOKUP = re.compile(r'为什么|为何|如何|怎么|原因|影响|作用|好处|危害|区别|哪些食物|什么食物|来源')
+_UPPER_LIMIT = re.compile(r'上限|最高|最多|不超过|不宜超过')
+
+
+def _build_matcher(vocabulary: Dict[str, list]) -> List[Tuple[str, str]]:
+    """(别名, 规范名) 按别名长度降序"""
+    pairs = [(alias, name) for name, aliases in vocabulary.items() for alias in aliases]
+    return sorted(pairs, key=lambda pair: len(pair[0]), reverse=True)
+
+
+_MATCHERS = {
+    "nutrient": _build_matcher(NUTRIENTS),
+    "food": _build_matcher(FOODS),
+    "population": _build_matcher({name: aliases for name, (aliases, _) in POPULATIONS.items()}),
+    "sex": _build_matcher(SEXES),
+    "metric": _build_matcher(METRICS),
+}
+
+
+def _find_terms(text: str, kind: str) -> List[str]:
+    """在文本中找出某类词的规范名（最长匹配、不重叠），按出现顺序返回"""
+    taken = [False] * len(text)
+    found = []
+    for alias, name in _MATCHERS[kind]:
+        start = text.find(alias)
+        while start != -1:
+            end = start + len(alias)
+            if not any(taken[start:end]):
+                taken[start:end] = [True] * len(alias)
+                found.append((start, name))
+            start = text.find(alias, end)
+    return [name for _, name in sorted(found)]
+
+
+def _find_subject(text: str) -> Optional[Tuple[str, str]]:
+    """(类型, 规范名)：营养素或食物，两类都没有或有多个不同的则返回 None"""
+    subjects = {("nutrient", name) for name in _find_terms(text, "nutrient")}
+    subjects |= {("food", name) for name in _find_terms(text, "food")}
+    return subjects.pop() if len(subjects) == 1 else None
+
+
+def _age_range(text: str):
+    match = _AGE_RANGE.search(text)
+    if not match:
+        return None
+    upper = float(match.group(2)) if match.group(2) else math.inf
+    return float(match.group(1)), upper
+
+
+class NutritionTableIndex:
+    """
+    膳食指南表格的结构化索引
+
+    extract_tables 得到的每个表格按表头和行标签拆成单元格条目：
+    每个数值单元格的行标签 + 列表头中识别出营养素/食物、人群（或年龄段）、性别、指标（RNI/AI/UL 等）和单位，
+    按营养素/食物建立索引。"成年人每天需要多少钙"这类数值查询直接从索引组织回答，无需检索和生成；
+    识别不出唯一的营养素/食物或匹配不到条目时返回 None，由调用方回退到 RAG。
+    """
+
+    def __init__(self, source_hash: str = None):
+        self.source_hash = source_hash
+        self.entries: List[dict] = []
+        self._by_subject: Dict[Tuple[str, str], List[dict]] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _index(self, entry: dict):
+        self.entries.append(entry)
+        self._by_subject.setdefault((entry["kind"], entry["subject"]), []).append(entry)
+
+    @staticmethod
+    def _normalize(table: List[list]) -> List[List[str]]:
+        rows = [[re.sub(r'\s+', '', cell) if cell else "" for cell in row] for row in table if row]
+        width = max((len(row) for row in rows), default=0)
+        return [row + [""] * (width - len(row)) for row in rows]
+
+    def add_table(self, table: List[list], page_number: int = None) -> int:
+        """把一个表格拆成条目加入索引，返回新增条目数"""
+        rows = self._normalize(table)
+        if len(rows) < 2 or len(rows[0]) < 2:
+            return 0
+        width = len(rows[0])
+
+        # 表头行：除第一列外没有数值的前几行；合并单元格（pdfplumber 返回 None）沿行向右填充
+        header_count = 0
+        while header_count < len(rows) - 1 and not any(_VALUE.match(cell) for cell in rows[header_count][1:]):
+            header_count += 1
+        headers = []
+        for row in rows[:header_count]:
+            filled, last = [], ""
+            for cell in row:
+                last = cell or last
+                filled.append(last)
+            headers.append(filled)
+        data = rows[header_count:]
+
+        # 标签列：数据行中大多不是数值的前几列；合并单元格沿列向下填充
+        label_count = 1
+        while label_count < width - 1:
+            cells = [row[label_count] for row in data if row[label_count]]
+            if not cells or sum(bool(_VALUE.match(cell)) for cell in cells) * 2 >= len(cells):
+                break
+            label_count += 1
+        last_labels = [""] * label_count
+        added = 0
+        for row in data:
+            for c in range(label_count):
+                last_labels[c] = row[c] or last_labels[c]
+            row_label = "".join(last_labels)
+            for c in range(label_count, width):
+                value = row[c]
+                if not value or not re.search(r'\d', value):
+                    continue
+                column_label = "".join(dict.fromkeys(header[c] for header in headers if header[c]))
+                entry = self._make_entry(row_label, column_label, value, page_number)
+                if entry is not None:
+                    self._index(entry)
+                    added += 1
+        return added
+
+    @staticmethod
+    def _make_entry(row_label: str, column_label: str, value: str, page_number: int) -> Optional[dict]:
+        label = f"{column_label} {row_label}".strip()
+        subject = _find_subject(row_label) or _find_subject(column_label)
+        if subject is None:
+            return None
+        populations = _find_terms(label, "population")
+        sexes = _find_terms(label, "sex")
+        metrics = _find_terms(label, "metric")
+        unit = _UNIT.search(label)
+        # 人群标签取不含营养素/食物名的那一侧，如 "18~49岁" 或 "孕中期"
+        population_label = column_label if _find_subject(row_label) else row_label
+        age = _age_range(population_label)
+        if not (age or _find_terms(population_label, "population")):
+            population_label = ""
+        # 表题里的"参考摄入量"之类笼统说法让位于列头的具体指标（RNI、UL 等）
+        specific = [metric for metric in metrics if metric != "推荐量"]
+        return {
+            "kind": subject[0],
+            "subject": subject[1],
+            "population": populations[0] if populations else None,
+            "population_label": _UNIT.sub('', population_label),
+            "age": age,
+            "sex": sexes[0] if sexes else None,
+            "metric": (specific or metrics or [None])[0],
+            "value": value,
+            "unit": unit.group(1) if unit else "",
+            "page": page_number,
+            "label": label,
+        }
+
+    @classmethod
+    def from_tables(cls, tables: List[Tuple[int, list]], source_hash: str = None) -> "NutritionTableIndex":
+        """由 [(页码, 表格)] 建立索引"""
+        index = cls(source_hash)
+        for page_number, table in tables:
+            index.add_table(table, page_number)
+        return index
+
+    @staticmethod
+    def _population_matches(entry: dict, population: Optional[str], age: Optional[float]) -> bool:
+        if age is not None:
+            if entry["age"] is not None:
+                return entry["age"][0] <= age < entry["age"][1]
+            bounds = POPULATIONS[entry["population"]][1] if entry["population"] else None
+            return bounds is not None and bounds[0] <= age < bounds[1]
+        if entry["population"] is not None:
+            # "孕妇"同时匹配孕早、中、晚期
+            return entry["population"] == population or (population == "孕妇" and entry["population"].startswith("孕"))
+        if entry["age"] is not None:
+            bounds = POPULATIONS[population][1]
+            return bounds is not None and bounds[0] <= entry["age"][0] < bounds[1]
+        return False
+
+    def lookup(self, question: str) -> List[dict]:
+        """
+        返回与问题匹配的条目；问题不是数值查询、营养素/食物不唯一或匹配不到时返回空列表
+
+        问题没有指明人群时默认成年人；表格本身不分人群时直接使用全部条目。
+        """
+        if not _LOOKUP_INTENT.search(question) or _NOT_LOOKUP.search(question):
+            return []
+        subject = _find_subject(question)
+        if subject is None or subject not in self._by_subject:
+            return []
+        entries = self._by_subject[subject]
+
+        # 指标：问上限时只看 UL，否则优先推荐摄入量，其次适宜摄入量
+        if _UPPER_LIMIT.search(question):
+            entries = [entry for entry in entries if entry["metric"] == "UL"]
+        else:
+            for metrics in (("RNI", "推荐量"), ("AI",), (None,)):
+                preferred = [entry for entry in entries if entry["metric"] in metrics]
+                if preferred:
+                    entries = preferred
+                    break
+
+        if any(entry["population"] or entry["age"] for entry in entries):
+            populations = _find_terms(question, "population")
+            age = _QUESTION_AGE.search(question)
+            population = populations[0] if populations else "成年人"
+            entries = [entry for entry in entries
+                       if self._population_matches(entry, population, float(age.group(1)) if age else None)]
+
+        sexes = _find_terms(question, "sex")
+        if sexes:
+            entries = [entry for entry in entries if entry["sex"] in (sexes[0], None)]
+        return entries
+
+    def answer(self, question: str, source_name: str = "", max_entries: int = 6):
+        """
+        从表格直接回答数值查询，返回 (回答, 参考来源)；没有把握时返回 None
+
+        匹配的条目过多（说明问题不够具体）时也返回 None，交给 RAG 处理。
+        """
+        entries = self.lookup(question)
+        if not entries or len(entries) > max_entries:
+            return None
+        lines = []
+        for entry in entries:
+            who = entry["population_label"] or entry["population"] or ""
+            if entry["age"] is not None and "岁" not in who:
+                low, high = (format(bound, 'g') for bound in entry["age"])
+                who = who.replace(_AGE_RANGE.search(who).group(0),
+                                  f"{low}岁以上" if high == "inf" else f"{low}~{high}岁")
+            if entry["sex"] and entry["sex"] not in who:
+                who += entry["sex"] + "性"
+            metric = METRIC_NAMES.get(entry["metric"], "推荐摄入量")
+            unit = f" {entry['unit']}" if entry["unit"] and entry["unit"] not in entry["value"] else ""
+            lines.append(f"{who}{'：' if who else ''}{entry['subject']}的{metric}为 {entry['value']}{unit}")
+        pages = sorted({entry["page"] for entry in entries if entry["page"] is not None})
+        where = f"第 {'、'.join(str(page) for page in pages)} 页表格" if pages else "表格"
+        answer = f"根据《{source_name}》{where}：\n" + "\n".join(f"- {line}" for line in lines)
+
+        sources = [{
+            "text": "\n".join(f"{entry['label']}: {entry['value']}" for entry in entries if entry["page"] == page),
+            "metadata": {"source": source_name, "page": page, "pages": [page], "table": True},
+        } for page in pages]
+        return answer, sources
+
+    def save(self, path: str):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"source_hash": self.source_hash, "entries": self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "NutritionTableIndex":
+        """加载索引文件，不存在时返回空索引"""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls(data.get("source_hash"))
+        for entry in data["entries"]:
+            index._index(entry)
+        return index
@@ -0,0 +1,48 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional
+
+
+class OCRCache:
+    """
+    磁盘上的单页OCR结果缓存
+
+    键为 (图片内容哈希, Tesseract 语言, Tesseract 参数)，每条结果存为一个文本文件，
+    重新导入时只有新增或修改过的页面需要再跑OCR。
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        """计算文件内容的 sha256"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _path(self, content_hash: str, lang: str, config: str) -> Path:
+        key = hashlib.sha1(f"{content_hash}\0{lang}\0{config}".encode('utf-8')).hexdigest()
+        return self.cache_dir / key[:2] / f"{key}.txt"
+
+    def get(self, content_hash: str, lang: str, config: str) -> Optional[str]:
+        path = self._path(content_hash, lang, config)
+        if not path.exists():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path.read_text(encoding='utf-8')
+
+    def put(self, content_hash: str, lang: str, config: str, text: str):
+        path = self._path(content_hash, lang, config)
+        path.parent.mkdir(exist_ok=True)
+        # 先写临时文件再替换，中断时不会留下半截结果
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(text, encoding='utf-8')
+        os.replace(tmp_path, path)
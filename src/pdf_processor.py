@@ -1,16 +1,79 @@
 import pdfplumber
 import pdf2image
 import re
-from typing import List, Tuple
-from pdf2image import convert_from_path
+from typing import Iterator, List, Optional, Tuple
+from pdf2image import convert_from_path, pdfinfo_from_path
 import pytesseract
 from PIL import Image
+import numpy as np
 import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from src.config import Config
+from src.ocr_cache import OCRCache
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+
+def page_number_from_filename(filename: str) -> int:
+    """从 xxx_12.png 形式的文件名中解析页码，解析不到时返回 -1"""
+    match = re.search(r'_(\d+)\.\w+$', filename)
+    return int(match.group(1)) if match else -1
+
+
+def _ocr_image(image_path: str, lang: str, config: str) -> Tuple[Optional[str], float]:
+    """在子进程中对单张图片做OCR，返回文本和耗时；识别失败时文本为 None（与空白页区分）"""
+    start = time.perf_counter()
+    try:
+        with Image.open(image_path) as image:
+            text = pytesseract.image_to_string(image, lang=lang, config=config).strip()
+    except Exception as e:
+        print(f"处理图片失败 {image_path}: {e}")
+        text = None
+    return text, time.perf_counter() - start
+
+
+def _ocr_pdf_page(image_path: str, lang: str, config: str, threshold: Optional[int]) -> Tuple[Optional[str], float]:
+    """在子进程中对栅格化的PDF页面做灰度/二值化预处理和OCR，完成后删除临时图片；识别失败时文本为 None"""
+    start = time.perf_counter()
+    try:
+        with Image.open(image_path) as image:
+            gray = np.asarray(image.convert('L'))
+        if threshold is not None:
+            # 整幅数组一次比较完成二值化，代替逐像素调用 Python 函数的 Image.point
+            gray = np.where(gray > threshold, 255, 0).astype(np.uint8)
+        text = pytesseract.image_to_string(Image.fromarray(gray), lang=lang, config=config).strip()
+    except Exception as e:
+        print(f"处理页面失败 {image_path}: {e}")
+        text = None
+    finally:
+        try:
+            os.remove(image_path)
+        except OSError:
+            pass
+    return text, time.perf_counter() - start
+
+
+def _contiguous_runs(numbers: List[int]) -> List[List[int]]:
+    """把升序页码切成连续的若干段"""
+    runs = []
+    for number in numbers:
+        if runs and number == runs[-1][-1] + 1:
+            runs[-1].append(number)
+        else:
+            runs.append([number])
+    return runs
 
 
 class PDFProcessor:
-    def __init__(self):
-        pass
+    def __init__(self, ocr_workers: int = None, ocr_cache_dir: str = None):
+        self.ocr_workers = ocr_workers or Config.OCR_WORKERS or os.cpu_count() or 1
+        self.ocr_lang = Config.OCR_LANG
+        self.ocr_config = Config.OCR_CONFIG
+        cache_dir = ocr_cache_dir or Config.OCR_CACHE_DIR
+        self.ocr_cache = OCRCache(cache_dir) if cache_dir else None
 
     def extract_text_with_page_numbers(self, pdf) -> Tuple[str, List[Tuple[str, int]]]:
         """
@@ -48,35 +111,184 @@ class PDFProcessor:
             print(f"处理图片失败 {image_path}: {e}")
             return {"ocr": ""}
 
-    def images_to_text(self, img_dir):
-        pages_text = []
-        for img_filename in os.listdir(img_dir):
-            if img_filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
+    def list_images(self, img_dir) -> List[Tuple[int, str]]:
+        """列出目录中的图片，按文件名中的页码排序，返回 (页码, 文件名)"""
+        images = [(page_number_from_filename(name), name)
+                  for name in os.listdir(img_dir) if name.lower().endswith(IMAGE_EXTENSIONS)]
+        return sorted(images)
+
+    def iter_images_text(self, img_dir, filenames: List[str] = None):
+        """
+        用进程池并行OCR目录中的图片，按页码顺序逐页返回结果
+
+        已缓存（内容哈希、语言和参数都相同）的页面直接读取缓存，其余页面提交到进程池，
+        结果按页码顺序流式返回，不必等全部页面处理完。识别失败的页面既不写入缓存也不返回，
+        构建清单里就没有它，下次构建时会重新识别。
+
+        参数:
+            img_dir: 图片目录
+            filenames: 只处理这些文件（默认处理目录中全部图片）
+
+        返回:
+            生成器，每项为 (页码, 文件名, 文本)
+        """
+        images = self.list_images(img_dir)
+        if filenames is not None:
+            wanted = set(filenames)
+            images = [item for item in images if item[1] in wanted]
+        total = len(images)
+        cached_count = 0
+        failed_count = 0
+        start = time.perf_counter()
+        executor = None
+
+        try:
+            # 先把所有未缓存的页面提交出去，保证进程池一直有活干
+            jobs = []
+            for page_number, img_filename in images:
                 img_path = os.path.join(img_dir, img_filename)
-                print(f"    - 处理图片: {img_filename}")
+                content_hash = self.ocr_cache.file_hash(img_path) if self.ocr_cache else None
+                cached = None
+                if self.ocr_cache:
+                    cached = self.ocr_cache.get(content_hash, self.ocr_lang, self.ocr_config)
+                future = None
+                if cached is None and self.ocr_workers > 1:
+                    if executor is None:
+                        executor = ProcessPoolExecutor(max_workers=self.ocr_workers)
+                    future = executor.submit(_ocr_image, img_path, self.ocr_lang, self.ocr_config)
+                jobs.append((page_number, img_filename, img_path, content_hash, cached, future))
 
-                img_text_info = self.image_to_text(img_path)
-                pages_text.append(img_text_info["ocr"])
+            for i, (page_number, img_filename, img_path, content_hash, cached, future) in enumerate(jobs, start=1):
+                if cached is not None:
+                    cached_count += 1
+                    print(f"    - [{i}/{total}] {img_filename} (缓存)")
+                    yield page_number, img_filename, cached
+                    continue
 
-        return pages_text
+                if future is not None:
+                    text, seconds = future.result()
+                else:
+                    text, seconds = _ocr_image(img_path, self.ocr_lang, self.ocr_config)
+                if text is None:
+                    failed_count += 1
+                    continue
+                if self.ocr_cache:
+                    self.ocr_cache.put(content_hash, self.ocr_lang, self.ocr_config, text)
+                print(f"    - [{i}/{total}] {img_filename} 用时 {seconds:.2f}s")
+                yield page_number, img_filename, text
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
 
-    def pdf_to_text(self, pdf_path: str, dpi: int = 300):
-        # 1. 将PDF转换为图像列表
-        images = convert_from_path(pdf_path, dpi=dpi, poppler_path=r'D:\aiPackage\poppler-25.07.0\Library\bin')
+        print(f"    - OCR完成: {total} 页，命中缓存 {cached_count} 页，失败 {failed_count} 页，"
+              f"{self.ocr_workers} 个进程，总耗时 {time.perf_counter() - start:.1f}s")
+
+    def images_to_text(self, img_dir):
+        """按页码顺序返回目录中每张图片的OCR文本（跳过识别失败的图片）"""
+        return [text for _, _, text in self.iter_images_text(img_dir)]
+
+    @staticmethod
+    def pdf_page_key(pdf_path: str, page_number: int) -> str:
+        """PDF页面在构建清单中的键"""
+        return f"{os.path.basename(pdf_path)}#{page_number}"
+
+    def pdf_page_count(self, pdf_path: str) -> int:
+        return pdfinfo_from_path(pdf_path, poppler_path=Config.POPPLER_PATH)["Pages"]
+
+    def iter_pdf_text(self, pdf_path: str, pages: List[int] = None, dpi: int = None,
+                      threshold: Optional[int] = -1, lang: str = None) -> Iterator[Tuple[int, str, str]]:
+        """
+        流式OCR整本PDF，按页码顺序逐页返回结果，内存占用与页数无关
+
+        每次只把一个窗口（PDF_RASTER_WINDOW 页）栅格化成临时文件交给OCR进程池，
+        下一个窗口栅格化的同时上一个窗口在做OCR；页面图片由子进程读取、预处理后立即删除，
+        主进程不持有任何位图。缓存命中（PDF内容、页码、DPI、阈值、语言和参数都相同）的页面不栅格化。
+        识别失败的页面既不写入缓存也不返回，下次构建时重新识别。
+
+        参数:
+            pages: 只处理这些页码（默认全部）
+            threshold: 二值化阈值，None 表示只转灰度，-1 表示使用配置 OCR_BINARY_THRESHOLD
 
-        all_text = []
-        for i, image in enumerate(images):
-            # 2. 图像预处理（示例：转灰度+二值化）
-            gray = image.convert('L')  # 转灰度
-            # 使用阈值二值化 (调整阈值以适应你的文档)
-            threshold = 140
-            binary = gray.point(lambda p: p > threshold and 255)
+        返回:
+            生成器，每项为 (页码, 页面键, 文本)
+        """
+        dpi = dpi or Config.PDF_DPI
+        threshold = Config.OCR_BINARY_THRESHOLD if threshold == -1 else threshold
+        lang = lang or self.ocr_lang
+        page_numbers = sorted(pages) if pages is not None else list(range(1, self.pdf_page_count(pdf_path) + 1))
+        window = Config.PDF_RASTER_WINDOW or self.ocr_workers * 2
+        pdf_hash = self.ocr_cache.file_hash(pdf_path) if self.ocr_cache else None
+        total = len(page_numbers)
+        cached_count = 0
+        failed_count = 0
+        done = 0
+        start = time.perf_counter()
+        executor = None
+        pending = deque()  # (页码, 缓存键, 缓存的文本, future 或临时图片路径)
+
+        def finish(job):
+            """返回一页的结果，识别失败时不返回"""
+            page_number, cache_key, cached, work = job
+            nonlocal cached_count, failed_count, done
+            done += 1
+            key = self.pdf_page_key(pdf_path, page_number)
+            if cached is not None:
+                cached_count += 1
+                print(f"    - [{done}/{total}] {key} (缓存)")
+                yield page_number, key, cached
+                return
+            if isinstance(work, str):
+                text, seconds = _ocr_pdf_page(work, lang, self.ocr_config, threshold)
+            else:
+                text, seconds = work.result()
+            if text is None:
+                failed_count += 1
+                return
+            if self.ocr_cache:
+                self.ocr_cache.put(cache_key, lang, self.ocr_config, text)
+            print(f"    - [{done}/{total}] {key} 用时 {seconds:.2f}s")
+            yield page_number, key, text
+
+        try:
+            with tempfile.TemporaryDirectory(prefix="pdf_ocr_") as tmp_dir:
+                for offset in range(0, total, window):
+                    jobs = {}
+                    for page_number in page_numbers[offset:offset + window]:
+                        cache_key = f"{pdf_hash}:{page_number}:{dpi}:{threshold}" if pdf_hash else None
+                        cached = self.ocr_cache.get(cache_key, lang, self.ocr_config) if self.ocr_cache else None
+                        jobs[page_number] = [page_number, cache_key, cached, None]
 
-            # 3. 使用Tesseract进行OCR
-            text = pytesseract.image_to_string(binary, lang='eng+chi_sim')  # 中英文识别
-            all_text.append(text)
+                    # 只栅格化未命中缓存的页面，按连续页码段分别调用 pdftoppm
+                    missing = [page_number for page_number, job in jobs.items() if job[2] is None]
+                    for run in _contiguous_runs(missing):
+                        paths = convert_from_path(
+                            pdf_path, dpi=dpi, first_page=run[0], last_page=run[-1], output_folder=tmp_dir,
+                            grayscale=True, paths_only=True, poppler_path=Config.POPPLER_PATH)
+                        for page_number, path in zip(run, sorted(paths)):
+                            if self.ocr_workers > 1:
+                                if executor is None:
+                                    executor = ProcessPoolExecutor(max_workers=self.ocr_workers)
+                                jobs[page_number][3] = executor.submit(
+                                    _ocr_pdf_page, path, lang, self.ocr_config, threshold)
+                            else:
+                                jobs[page_number][3] = path
+                    pending.extend(tuple(job) for job in jobs.values())
 
-        return "\n\n".join(all_text)  # 用空行分隔不同页
+                    # 最多一个窗口在排队：先交出上一个窗口的结果，再栅格化下一个窗口
+                    while len(pending) > window:
+                        yield from finish(pending.popleft())
+                while pending:
+                    yield from finish(pending.popleft())
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+        print(f"    - OCR完成: {total} 页，命中缓存 {cached_count} 页，失败 {failed_count} 页，"
+              f"{self.ocr_workers} 个进程，总耗时 {time.perf_counter() - start:.1f}s")
+
+    def pdf_to_text(self, pdf_path: str, dpi: int = 300):
+        """栅格化（灰度+二值化）后OCR整本PDF，页与页之间用空行分隔"""
+        return "\n\n".join(text for _, _, text in self.iter_pdf_text(pdf_path, dpi=dpi, lang='eng+chi_sim'))
 
     def extract_text(self, pdf_path: str) -> List[str]:
         """从PDF提取文本"""
@@ -94,11 +306,8 @@ class PDFProcessor:
         """使用OCR从PDF提取文本（适用于扫描版PDF）"""
         pages_text = []
         try:
-            # 将PDF转换为图片
-            pages = convert_from_path(pdf_path)
-            for page_image in pages:
-                # 使用OCR提取文本
-                text = pytesseract.image_to_string(page_image, lang='chi_sim')
+            # 逐窗口栅格化并OCR，不把整本PDF的页面图片同时放在内存里
+            for _, _, text in self.iter_pdf_text(pdf_path, dpi=200, threshold=None, lang='chi_sim'):
                 if text.strip():
                     text = re.sub(r'\s+', ' ', text).strip()
                     pages_text.append(text)
@@ -110,11 +319,15 @@ class PDFProcessor:
 
     def extract_tables(self, pdf_path: str):
         """提取表格数据（膳食指南中的表格很重要）"""
+        return [table for _, table in self.extract_tables_with_page_numbers(pdf_path)]
+
+    def extract_tables_with_page_numbers(self, pdf_path: str) -> List[Tuple[int, list]]:
+        """提取表格数据并记录所在页码，返回 [(页码, 表格)]"""
         tables = []
         with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
+            for page_number, page in enumerate(pdf.pages, start=1):
                 page_tables = page.extract_tables()
                 for table in page_tables:
                     if table and any(any(cell for cell in row) for row in table):
-                        tables.append(table)
+                        tables.append((page_number, table))
         return tables
\ No newline at end of file
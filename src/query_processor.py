@@ -1,65 +1,424 @@
+from .adaptive_retrieval import AdaptiveRetrievalPolicy
+from .answer_cache import AnswerCache
 from .config import Config
-from .dashscope_client import DashScopeClient
+from .context_builder import ContextBuilder
+from .dashscope_client import DashScopeClient, StreamingResponse
+from .multi_query import MultiQueryGenerator
+from .nutrition_table import NutritionTableIndex
 from .vector_store import VectorStore
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
-from langchain.chains.question_answering import load_qa_chain
-from langchain_community.callbacks.manager import get_openai_callback
-import torch
+from .startup_profile import profile
+from .tracing import tracer
+import asyncio
+import difflib
 import logging
-from langchain.retrievers import MultiQueryRetriever
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 
+def reciprocal_rank_fusion(result_lists: list[list[dict]], k: int = 60) -> list[dict]:
+    """倒数排名融合：按分块ID去重，分数为各列表中 1/(k+排名) 之和"""
+    fused = {}
+    for results in result_lists:
+        for rank, chunk in enumerate(results, start=1):
+            entry = fused.get(chunk["id"])
+            if entry is None:
+                entry = fused[chunk["id"]] = dict(chunk, fusion_score=0.0)
+            else:
+                # 合并各路检索的分数（相似度、BM25 分数等）
+                for key, value in chunk.items():
+                    entry.setdefault(key, value)
+            entry["fusion_score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda x: x["fusion_score"], reverse=True)
+
+
+def questions_match(a: str, b: str, threshold: float = 0.9) -> bool:
+    """两个问题去掉空白和标点后是否相同或几乎相同（字符级相似度不低于 threshold）"""
+    a = re.sub(r'[^\u4e00-\u9fa5\w]', '', a).lower()
+    b = re.sub(r'[^\u4e00-\u9fa5\w]', '', b).lower()
+    return a == b or difflib.SequenceMatcher(None, a, b).ratio() >= threshold
+
 
 class QueryEngine:
     def __init__(self, dashscope_client: DashScopeClient, vector_store: VectorStore):
         self.client = dashscope_client
         self.vector_store = vector_store
         self.config = Config
-        # 初始化 BGE Reranker（已经提前下载好模型）
-        self.reranker_tokenizer = AutoTokenizer.from_pretrained(self.config.BGE_RERANKER_PATH)
-        self.reranker_model = AutoModelForSequenceClassification.from_pretrained(self.config.BGE_RERANKER_PATH).eval()
+        # BGE Reranker（已经提前下载好模型）在第一次使用或 warm_up() 时加载
+        self._reranker = None
+        self._reranker_lock = threading.Lock()
+        # 语义答案缓存：相近的问题直接复用之前的回答
+        self.answer_cache = None
+        if self.config.ANSWER_CACHE_ENABLED:
+            self.answer_cache = AnswerCache(
+                threshold=self.config.ANSWER_CACHE_THRESHOLD,
+                max_entries=self.config.ANSWER_CACHE_MAX_ENTRIES,
+                ttl=self.config.ANSWER_CACHE_TTL,
+                cache_dir=self.config.ANSWER_CACHE_DIR,
+            )
+        # 组装上下文：合并相邻分块、去掉重叠和重复内容，控制在 token 预算内
+        self.context_builder = ContextBuilder()
+        # 自适应检索：按向量相似度的分布决定候选数、是否重排序，无关问题不带参考资料
+        self.adaptive = None
+        if self.config.ADAPTIVE_RETRIEVAL_ENABLED:
+            self.adaptive = AdaptiveRetrievalPolicy(
+                relevance_floor=self.config.ADAPTIVE_RELEVANCE_FLOOR,
+                margin=self.config.ADAPTIVE_SKIP_MARGIN,
+                flat_spread=self.config.ADAPTIVE_FLAT_SPREAD,
+                expand_factor=self.config.ADAPTIVE_EXPAND_FACTOR,
+            )
+        # 表格索引：营养素/食物的数值查询直接回答，第一次使用时加载
+        self._table_index = None
+        self.table_hits = 0
+        # 异步入口把阻塞的向量化、检索、重排序和生成放到线程池中执行
+        self._executor = None
+        # 服务模式下由 enable_rerank_batching() 设置，把并发请求的重排序合并成一批推理
+        self.rerank_batcher = None
+        self.speculation_hits = 0
+        self.speculation_misses = 0
+        # 多查询检索：问题改写按问题缓存，各查询的检索在单独的线程池中并发执行
+        self._multi_query = None
+        self._search_executor = None
+        # LangChain MultiQueryRetriever 路径复用的检索器（按 k）和问答链
+        self._multi_query_retrievers = {}
+        self._qa_chain = None
 
-    def query(self, question: str, top_k: int = 3, rerank_top_n: int = 10) -> tuple[str, list[dict]]:
-        """处理用户查询"""
-        # 获取问题的向量表示
+    @property
+    def reranker(self):
+        """延迟加载重排序模型；后台预热和查询同时触发时只加载一次"""
+        if self._reranker is None:
+            with self._reranker_lock:
+                if self._reranker is None:
+                    with profile.measure("reranker", "import"):
+                        from .reranker import Reranker
+                    with profile.measure("reranker", "init"):
+                        self._reranker = Reranker.from_config(self.config)
+        return self._reranker
+
+    @property
+    def multi_query(self) -> MultiQueryGenerator:
+        if self._multi_query is None:
+            self._multi_query = MultiQueryGenerator(
+                self.client.get_completion,
+                count=self.config.MULTI_QUERY_COUNT,
+                cache_size=self.config.MULTI_QUERY_CACHE_SIZE,
+            )
+        return self._multi_query
+
+    @property
+    def search_executor(self) -> ThreadPoolExecutor:
+        # 与 executor 分开：retrieve 本身可能就运行在 executor 的线程里，再提交进去可能互相等待
+        if self._search_executor is None:
+            self._search_executor = ThreadPoolExecutor(max_workers=self.config.MULTI_QUERY_WORKERS,
+                                                       thread_name_prefix="search")
+        return self._search_executor
+
+    @property
+    def table_index(self) -> NutritionTableIndex:
+        if self._table_index is None:
+            with profile.measure("table_index", "load"):
+                self._table_index = NutritionTableIndex.load(self.config.TABLE_INDEX_PATH)
+        return self._table_index
+
+    def reload_table_index(self):
+        """知识库重建后重新加载表格索引"""
+        self._table_index = None
+
+    def _table_answer(self, question: str):
+        """
+        表格速查：问题能从表格索引中找到有把握的数值时返回 {"answer", "sources"}，否则返回 None
+
+        命中时不计算向量、不检索、不重排序也不调用大模型。
+        """
+        if not self.config.TABLE_LOOKUP_ENABLED:
+            return None
+        with tracer.span("table_lookup") as span:
+            result = self.table_index.answer(question, self.config.KB_SOURCE_NAME,
+                                             max_entries=self.config.TABLE_LOOKUP_MAX_ENTRIES)
+            span.add(cache_hits=int(result is not None), cache_misses=int(result is None))
+        if result is None:
+            return None
+        self.table_hits += 1
+        return {"answer": result[0], "sources": result[1]}
+
+    def warm_up(self):
+        """提前加载重排序模型"""
+        return self.reranker
+
+    def retrieve(self, question: str, top_n: int = 10, mode: str = None, question_embedding=None) -> list[dict]:
+        """
+        检索候选分块
+
+        参数:
+            mode: dense（向量）/ lexical（BM25，不调用向量化接口）/ hybrid（两路结果倒数排名融合）/
+                  multi（原问题加大模型改写的多个问题，各自混合检索后融合）
+            question_embedding: 已经算好的问题向量，为 None 时按需计算
+        """
+        mode = mode or self.config.RETRIEVAL_MODE
+        # 耗时包含计算问题向量
+        with tracer.span("retrieve"):
+            if mode == "lexical":
+                return self.vector_store.lexical_search(question, top_k=top_n)
+            if mode == "multi":
+                return self._multi_retrieve(question, top_n, question_embedding)
+
+            # 获取问题的向量表示
+            if question_embedding is None:
+                question_embedding = self.client.get_embeddings([question])[0]
+            if mode == "dense":
+                return self.vector_store.search(question_embedding, top_k=top_n)
+
+            depth = max(top_n, self.config.HYBRID_CANDIDATES)
+            dense = self.vector_store.search(question_embedding, top_k=depth)
+            lexical = self.vector_store.lexical_search(question, top_k=depth)
+            return reciprocal_rank_fusion([dense, lexical], k=self.config.RRF_K)[:top_n]
+
+    def _multi_retrieve(self, question: str, top_n: int, question_embedding=None) -> list[dict]:
+        """
+        多查询检索：原问题加上改写的几个问题一次批量向量化，各查询的向量检索和 BM25 检索并发执行，
+        全部结果按分块ID去重、倒数排名融合后取前 top_n 个交给重排序
+        """
+        queries = [question] + self.multi_query.variants(question)
+        if question_embedding is None:
+            embeddings = list(self.client.get_embeddings(queries))
+        else:
+            embeddings = [question_embedding]
+            if len(queries) > 1:
+                embeddings += list(self.client.get_embeddings(queries[1:]))
+
+        depth = max(top_n, self.config.MULTI_QUERY_CANDIDATES)
+        searches = ([(self.vector_store.search, embedding) for embedding in embeddings]
+                    + [(self.vector_store.lexical_search, query) for query in queries])
+        with tracer.span("multi_query_search") as span:
+            span.batch(len(queries))
+            result_lists = list(self.search_executor.map(lambda search: search[0](search[1], depth), searches))
+        return reciprocal_rank_fusion(result_lists, k=self.config.RRF_K)[:top_n]
+
+    def _lookup_answer(self, question: str, mode: str = None):
+        """查语义答案缓存，返回 (命中的条目或 None, 问题向量)；未启用缓存或纯关键词检索时不计算向量"""
+        # 缓存以问题向量为键，lexical 模式承诺不调用向量化接口，所以不使用语义缓存
+        if self.answer_cache is None or (mode or self.config.RETRIEVAL_MODE) == "lexical":
+            return None, None
         question_embedding = self.client.get_embeddings([question])[0]
+        with tracer.span("answer_cache") as span:
+            cached = self.answer_cache.lookup(question_embedding, self.vector_store.build_id)
+            span.add(cache_hits=int(cached is not None), cache_misses=int(cached is None))
+        return cached, question_embedding
+
+    def _remember_answer(self, question: str, question_embedding, response: str, sources: list[dict]):
+        if (self.answer_cache is not None and question_embedding is not None
+                and not response.startswith(self.client.GENERATION_ERROR_PREFIX)):
+            self.answer_cache.put(question, question_embedding, response, sources, self.vector_store.build_id)
+
+    def build_context(self, chunks: list[dict]) -> str:
+        """把相关分块组装成带来源页码标签的上下文"""
+        return self.context_builder.build(chunks)[0]
+
+    def _retrieval_depth(self, rerank_top_n: int) -> int:
+        return self.adaptive.depth(rerank_top_n) if self.adaptive is not None else rerank_top_n
 
-        # 初步检索更多候选上下文 (例如前10个)
-        candidate_chunks = self.vector_store.search(question_embedding, top_k=rerank_top_n)
+    def _adapt(self, candidate_chunks: list[dict], top_k: int, rerank_top_n: int):
+        """
+        按自适应策略处理检索结果，返回 (不必重排序时的最终分块, 要重排序的候选)，两者恰有一个为 None
+        """
+        if self.adaptive is None:
+            return None, candidate_chunks[:rerank_top_n]
+        action = self.adaptive.decide(candidate_chunks, rerank_top_n)
+        tracer.record("adaptive_retrieval", **{action: 1})
+        if action == AdaptiveRetrievalPolicy.OFF_TOPIC:
+            return [], None
+        if action == AdaptiveRetrievalPolicy.DECISIVE:
+            return AdaptiveRetrievalPolicy.by_similarity(candidate_chunks, top_k), None
+        if action == AdaptiveRetrievalPolicy.FLAT:
+            return None, candidate_chunks
+        return None, candidate_chunks[:rerank_top_n]
+
+    def _relevant_chunks(self, question: str, top_k: int, rerank_top_n: int, mode: str,
+                         question_embedding=None) -> list[dict]:
+        # 初步检索更多候选上下文 (例如前10个；自适应检索时多取一些，按相似度分布决定用多少)
+        candidate_chunks = self.retrieve(question, top_n=self._retrieval_depth(rerank_top_n), mode=mode,
+                                         question_embedding=question_embedding)
+        selected, candidate_chunks = self._adapt(candidate_chunks, top_k, rerank_top_n)
+        if selected is not None:
+            return selected
 
         # 使用 BGE Reranker 重新排序
         reranked_chunks = self._rerank(question, candidate_chunks)
 
         # 取重排序后分数最高的 top_k 个
-        relevant_chunks = reranked_chunks[:top_k]
+        return reranked_chunks[:top_k]
 
-        # 组合上下文
-        context = "\n\n".join([chunk["text"] for chunk in relevant_chunks])
+    def query(self, question: str, top_k: int = 3, rerank_top_n: int = 10, mode: str = None) -> tuple[str, list[dict]]:
+        """处理用户查询"""
+        # 数值查询先查表格索引
+        table = self._table_answer(question)
+        if table is not None:
+            return table["answer"], table["sources"]
+
+        # 再查语义答案缓存，命中时不再检索、重排序和生成
+        cached, question_embedding = self._lookup_answer(question, mode)
+        if cached is not None:
+            return cached["answer"], cached["sources"]
+
+        relevant_chunks = self._relevant_chunks(question, top_k, rerank_top_n, mode, question_embedding)
+
+        # 组合上下文：合并相邻分块、去重并控制在 token 预算内
+        context = self.build_context(relevant_chunks)
 
         # 生成回答
         response = self.client.generate_response(question, context)
+        self._remember_answer(question, question_embedding, response, relevant_chunks)
 
         return response, relevant_chunks
 
+    def query_stream(self, question: str, top_k: int = 3, rerank_top_n: int = 10,
+                     mode: str = None) -> tuple[StreamingResponse, list[dict]]:
+        """
+        流式处理用户查询：检索和重排序完成后立即返回，回答在迭代返回的流时逐段生成
+
+        首字延迟从调用本方法时起算，包含检索和重排序的耗时；流读完后完整回答写入答案缓存。
+        """
+        started = time.perf_counter()
+        cached = self._table_answer(question)
+        if cached is None:
+            cached, question_embedding = self._lookup_answer(question, mode)
+        if cached is not None:
+            return StreamingResponse.from_text(cached["answer"], started=started), cached["sources"]
+
+        relevant_chunks = self._relevant_chunks(question, top_k, rerank_top_n, mode, question_embedding)
+        context = self.build_context(relevant_chunks)
+
+        def remember(done: StreamingResponse):
+            if not done.failed:
+                self._remember_answer(question, question_embedding, done.text, relevant_chunks)
+
+        stream = self.client.stream_response(question, context, started=started)
+        stream.on_complete = remember
+        return stream, relevant_chunks
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.config.QUERY_EXECUTOR_WORKERS,
+                                                thread_name_prefix="query")
+        return self._executor
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def enable_rerank_batching(self, max_batch_pairs: int = None, max_wait: float = None):
+        """异步入口的重排序改为跨请求动态批处理"""
+        from .rerank_batcher import RerankBatcher
+        self.rerank_batcher = RerankBatcher(
+            lambda requests: self.reranker.score_many(requests),
+            max_batch_pairs=max_batch_pairs or self.config.RERANK_BATCH_MAX_PAIRS,
+            max_wait=self.config.RERANK_BATCH_MAX_WAIT if max_wait is None else max_wait,
+            executor=self.executor,
+        )
+        return self.rerank_batcher
+
+    async def _arerank(self, query: str, chunks: list[dict]) -> list[dict]:
+        if self.rerank_batcher is None:
+            return await self._run(self._rerank, query, chunks)
+        # 耗时包含在批处理队列中等待的时间
+        with tracer.span("rerank") as span:
+            span.batch(len(chunks))
+            scores = await self.rerank_batcher.score(query, chunks)
+        return self._apply_scores(chunks, scores)
+
+    async def _aprepare(self, question: str, history, rewriter, top_k: int, rerank_top_n: int, mode: str):
+        """
+        改写问题并检索上下文，返回 (最终问题, 缓存条目, 问题向量, 相关分块)
+
+        有对话历史且问题不是明显独立时，改写（一次 LLM 调用）和用原问题的预检索同时进行；
+        改写结果与原问题相同或几乎相同时直接使用预检索的候选，否则用改写后的问题重新检索。
+        """
+        speculative = None
+        if history and rewriter is not None and rewriter.should_rewrite(question, history):
+            rewrite = self._run(rewriter.rewrite_context_dependent_query, question, history)
+            speculative = asyncio.ensure_future(
+                self._run(self.retrieve, question, self._retrieval_depth(rerank_top_n), mode))
+            rewritten = (await rewrite).strip() or question
+            if questions_match(rewritten, question, self.config.SPECULATIVE_MATCH_THRESHOLD):
+                self.speculation_hits += 1
+            else:
+                self.speculation_misses += 1
+                # 预检索作废；已在线程池中运行的任务无法中断，只是不再等待它的结果
+                speculative.cancel()
+                speculative = None
+                question = rewritten
+
+        # 表格速查在事件循环中直接完成（亚毫秒级），命中时预检索作废
+        cached, question_embedding = self._table_answer(question), None
+        if cached is None:
+            cached, question_embedding = await self._run(self._lookup_answer, question, mode)
+        if cached is not None:
+            if speculative is not None:
+                speculative.cancel()
+            return question, cached, question_embedding, cached["sources"]
+
+        if speculative is not None:
+            candidate_chunks = await speculative
+        else:
+            candidate_chunks = await self._run(self.retrieve, question, self._retrieval_depth(rerank_top_n),
+                                               mode, question_embedding)
+        selected, candidate_chunks = self._adapt(candidate_chunks, top_k, rerank_top_n)
+        if selected is not None:
+            return question, None, question_embedding, selected
+        reranked_chunks = await self._arerank(question, candidate_chunks)
+        return question, None, question_embedding, reranked_chunks[:top_k]
+
+    async def aquery(self, question: str, history=None, rewriter=None, top_k: int = 3,
+                     rerank_top_n: int = 10, mode: str = None) -> tuple[str, str, list[dict]]:
+        """
+        异步处理一轮对话，返回 (改写后的问题, 回答, 参考来源)
+
+        参数:
+            history: 对话历史（ConversationMemory 或消息列表），为空时不改写
+            rewriter: QueryRewriter，用于上下文依赖型问题改写
+        """
+        question, cached, question_embedding, relevant_chunks = await self._aprepare(
+            question, history, rewriter, top_k, rerank_top_n, mode)
+        if cached is not None:
+            return question, cached["answer"], relevant_chunks
+
+        context = self.build_context(relevant_chunks)
+        response = await self._run(self.client.generate_response, question, context)
+        self._remember_answer(question, question_embedding, response, relevant_chunks)
+        return question, response, relevant_chunks
+
+    async def aquery_stream(self, question: str, history=None, rewriter=None, top_k: int = 3,
+                            rerank_top_n: int = 10, mode: str = None) -> tuple[str, StreamingResponse, list[dict]]:
+        """同 aquery，但检索完成后立即返回回答流，返回 (改写后的问题, 回答流, 参考来源)"""
+        started = time.perf_counter()
+        question, cached, question_embedding, relevant_chunks = await self._aprepare(
+            question, history, rewriter, top_k, rerank_top_n, mode)
+        if cached is not None:
+            return question, StreamingResponse.from_text(cached["answer"], started=started), relevant_chunks
+
+        def remember(done: StreamingResponse):
+            if not done.failed:
+                self._remember_answer(question, question_embedding, done.text, relevant_chunks)
+
+        context = self.build_context(relevant_chunks)
+        stream = self.client.stream_response(question, context, started=started)
+        stream.on_complete = remember
+        return question, stream, relevant_chunks
+
     def _rerank(self, query: str, chunks: list[dict], threshold: float = None) -> list[dict]:
         """使用 BGE Reranker 对检索结果进行重排序"""
-        # 构造输入对
-        sentence_pairs = [[query, chunk['text']] for chunk in chunks]
-
-        # 编码并推理
-        with torch.no_grad():
-            inputs = self.reranker_tokenizer(
-                sentence_pairs,
-                padding=True,
-                truncation=True,
-                return_tensors='pt',
-                max_length=512
-            )
-            scores = self.reranker_model(**inputs).logits.view(-1).float()
+        # 按长度分桶批量推理，已打过分的 (问题, 分块) 直接取缓存
+        with tracer.span("rerank") as span:
+            span.batch(len(chunks))
+            scores = self.reranker.score(query, chunks)
+        return self._apply_scores(chunks, scores, threshold)
 
+    @staticmethod
+    def _apply_scores(chunks: list[dict], scores: list[float], threshold: float = None) -> list[dict]:
         # 添加分数到 chunks 并排序
-        for i, chunk in enumerate(chunks):
-            chunk['score'] = float(scores[i])
+        for chunk, score in zip(chunks, scores):
+            chunk['score'] = score
 
         # 过滤低分结果（可选）
         if threshold is not None:
@@ -79,19 +438,27 @@ class QueryEngine:
         返回:
             retriever: MultiQueryRetriever对象
         """
+        # 同样的 k 复用已创建的检索器
+        if k in self._multi_query_retrievers:
+            return self._multi_query_retrievers[k]
+
+        from langchain.retrievers import MultiQueryRetriever
+
         # 创建基础检索器
-        base_retriever = self.vector_store.faiss_store.as_retriever(search_kwargs={"k": k})
+        base_retriever = self.vector_store.as_retriever(k)
 
         # 创建MultiQueryRetriever
         retriever = MultiQueryRetriever.from_llm(
             retriever=base_retriever,
             llm=self.vector_store.llm
         )
+        self._multi_query_retrievers[k] = retriever
         return retriever
 
     def process_query_with_multi_retriever(self, query: str, retriever):
         """
-        使用MultiQueryRetriever处理查询
+        使用MultiQueryRetriever处理查询（LangChain 路径；改写结果不缓存、各查询串行检索且不重排序，
+        一般应使用 query(question, mode="multi")）
 
         参数:
             query: 用户查询
@@ -102,21 +469,28 @@ class QueryEngine:
             response: 回答
             unique_pages: 相关文档的页码集合
         """
+        # 通义的 token 用量由回调从每次大模型调用的返回中读取（包括生成多个查询的那次调用）
+        usage = tracer.langchain_callback("multi_query_llm")
+
         # 执行查询，获取相关文档
-        docs = retriever.invoke(query)
+        with tracer.span("multi_query_retrieve"):
+            docs = retriever.invoke(query, config={"callbacks": [usage]})
         print(f"找到 {len(docs)} 个相关文档")
 
-        # 加载问答链
-        chain = load_qa_chain(self.vector_store.llm, chain_type="stuff")
+        # 加载问答链（只创建一次）
+        if self._qa_chain is None:
+            from langchain.chains.question_answering import load_qa_chain
+            self._qa_chain = load_qa_chain(self.vector_store.llm, chain_type="stuff")
+        chain = self._qa_chain
 
         # 准备输入数据
         input_data = {"input_documents": docs, "question": query}
 
-        # 使用回调函数跟踪API调用成本
-        with get_openai_callback() as cost:
-            # 执行问答链
-            response = chain.invoke(input=input_data)
-            print(f"查询已处理。成本: {cost}")
+        # 执行问答链
+        with tracer.span("multi_query_answer"):
+            response = chain.invoke(input=input_data, config={"callbacks": [usage]})
+        print(f"查询已处理。大模型调用 {usage.calls} 次，输入 {usage.input_tokens} tokens，"
+              f"输出 {usage.output_tokens} tokens")
 
         # 记录源数据
         sources = []
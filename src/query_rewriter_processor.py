@@ -1,11 +1,36 @@
+from src.conversation_memory import ConversationMemory, is_self_contained
 from src.dashscope_client import DashScopeClient
+from src.tracing import tracer
 
 class QueryRewriter:
     def __init__(self, dashscope_client: DashScopeClient):
         self.client = dashscope_client
+        # 本地判断为独立问题、跳过大模型改写的次数
+        self.skipped = 0
+
+    def needs_rewrite(self, current_query, conversation_history) -> bool:
+        """有对话历史且问题不是明显独立时才需要调用大模型改写"""
+        return bool(conversation_history) and not is_self_contained(current_query)
+
+    def should_rewrite(self, current_query, conversation_history) -> bool:
+        """同 needs_rewrite，不需要改写时计入跳过次数（异步查询据此决定是否同时预检索）"""
+        if self.needs_rewrite(current_query, conversation_history):
+            return True
+        self.skipped += 1
+        tracer.record("rewrite", skipped=1)
+        return False
 
     def rewrite_context_dependent_query(self, current_query, conversation_history) -> str:
-        """上下文依赖型Query改写"""
+        """
+        上下文依赖型Query改写
+
+        conversation_history 可以是 ConversationMemory（按 token 预算输出摘要和最近几轮）或消息列表
+        """
+        if not self.should_rewrite(current_query, conversation_history):
+            return current_query
+        if isinstance(conversation_history, ConversationMemory):
+            conversation_history = conversation_history.render()
+
         instruction = """
             你是一个智能的查询优化助手。请分析用户的当前问题以及前序对话历史，判断当前问题是否依赖于上下文。
             如果依赖，请将当前问题改写成一个独立的、包含所有必要上下文信息的完整问题。
@@ -24,4 +49,5 @@ class QueryRewriter:
         
             ### 改写后的问题 ###
             """
-        return self.client.get_completion(prompt)
\ No newline at end of file
+        with tracer.span("rewrite"):
+            return self.client.get_completion(prompt)
\ No newline at end of file
@@ -0,0 +1,93 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import Callable, List, Tuple
+
+
+class RerankBatcher:
+    """
+    跨请求的重排序动态批处理
+
+    并发请求的 (查询, 候选分块) 先进入队列；后台任务取到第一个请求后最多再等 max_wait 秒，
+    期间到达的请求合并成一批（输入对总数达到 max_batch_pairs 时立即出发），
+    调用一次 score_many 完成整批推理，再把分数分发回各个请求。
+    """
+
+    def __init__(self, score_many: Callable[[List[Tuple[str, List[dict]]]], List[List[float]]],
+                 max_batch_pairs: int = 64, max_wait: float = 0.01, executor: Executor = None):
+        self.score_many = score_many
+        self.max_batch_pairs = max_batch_pairs
+        self.max_wait = max_wait
+        self.executor = executor
+        self.batches = 0
+        self.requests = 0
+        self.pairs = 0
+        self._queue = None
+        self._worker = None
+
+    async def score(self, query: str, chunks: List[dict]) -> List[float]:
+        """为一个请求打分，返回与 chunks 顺序一致的分数"""
+        if not chunks:
+            return []
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, chunks, future))
+        return await future
+
+    async def _collect(self) -> list:
+        """取一批请求：等第一个请求到达，再在截止时间内尽量多收"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        pairs = len(batch[0][1])
+        deadline = loop.time() + self.max_wait
+        while pairs < self.max_batch_pairs:
+            if self._queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = self._queue.get_nowait()
+            batch.append(item)
+            pairs += len(item[1])
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            requests = [(query, chunks) for query, chunks, _ in batch]
+            self.batches += 1
+            self.requests += len(batch)
+            self.pairs += sum(len(chunks) for _, chunks in requests)
+            try:
+                results = await loop.run_in_executor(self.executor, self.score_many, requests)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, _, future), scores in zip(batch, results):
+                if not future.done():
+                    future.set_result(scores)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "pairs": self.pairs,
+            "requests_per_batch": self.requests / self.batches if self.batches else 0.0,
+        }
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
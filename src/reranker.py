@@ -0,0 +1,191 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from src.tracing import tracer
+
+
+class Reranker:
+    """
+    面向 CPU 优化的 BGE 交叉编码器重排序
+
+    backend:
+        fp32: 原始 PyTorch 模型
+        int8: 对 Linear 层做动态 int8 量化的 PyTorch 模型
+        onnx: ONNX Runtime 推理（首次使用时从 PyTorch 模型导出 .onnx 文件）
+
+    输入对先按分词长度排序再分批，每批只补齐到批内最长的长度，避免短文本陪着最长的一条补齐到 512；
+    (查询, 分块) 的分数存入 LRU 缓存，重复的问题不必再次推理。
+    """
+
+    BACKENDS = ("fp32", "int8", "onnx")
+
+    def __init__(self, model_path: str, backend: str = "fp32", num_threads: int = None, batch_size: int = 4,
+                 max_length: int = 512, cache_size: int = 4096, onnx_path: str = None):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"不支持的重排序后端: {backend}")
+        self.model_path = model_path
+        self.backend = backend
+        self.num_threads = num_threads
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self.onnx_path = onnx_path or str(Path(model_path) / "model.onnx")
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # 模型推理本身不是线程安全的计算密集任务，串行执行并由线程数参数控制并行度
+        self._model_lock = threading.Lock()
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = None
+        self.session = None
+        if backend == "onnx":
+            self.session = self._load_onnx()
+        else:
+            model = AutoModelForSequenceClassification.from_pretrained(model_path).eval()
+            if backend == "int8":
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            self.model = model
+
+    @classmethod
+    def from_config(cls, config) -> "Reranker":
+        return cls(
+            config.BGE_RERANKER_PATH,
+            backend=config.RERANKER_BACKEND,
+            num_threads=config.RERANKER_THREADS,
+            batch_size=config.RERANKER_BATCH_SIZE,
+            max_length=config.RERANKER_MAX_LENGTH,
+            cache_size=config.RERANKER_CACHE_SIZE,
+        )
+
+    def _load_onnx(self):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("onnx 后端需要安装 onnxruntime: pip install onnxruntime") from e
+
+        if not Path(self.onnx_path).exists():
+            self._export_onnx()
+        options = ort.SessionOptions()
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        return ort.InferenceSession(self.onnx_path, options, providers=["CPUExecutionProvider"])
+
+    def _export_onnx(self):
+        """把 PyTorch 模型导出为 ONNX（批大小和序列长度均为动态维度）"""
+        print(f"正在导出 ONNX 重排序模型: {self.onnx_path}")
+        model = AutoModelForSequenceClassification.from_pretrained(self.model_path).eval()
+        inputs = self.tokenizer([["query", "passage"]], return_tensors='pt')
+        torch.onnx.export(
+            model,
+            (inputs["input_ids"], inputs["attention_mask"]),
+            self.onnx_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"},
+            },
+            opset_version=14,
+        )
+
+    def _forward(self, features: dict) -> np.ndarray:
+        if self.session is not None:
+            outputs = self.session.run(["logits"], {
+                "input_ids": features["input_ids"].astype(np.int64),
+                "attention_mask": features["attention_mask"].astype(np.int64),
+            })
+            return outputs[0].reshape(-1).astype(np.float32)
+        with torch.no_grad():
+            inputs = {key: torch.from_numpy(value) for key, value in features.items()}
+            return self.model(**inputs).logits.view(-1).float().numpy()
+
+    def score_pairs(self, query: str, texts: List[str]) -> np.ndarray:
+        """对 (query, text) 输入对打分（不使用缓存），按输入顺序返回"""
+        return self.score_pair_list([(query, text) for text in texts])
+
+    def score_pair_list(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        """对任意 (查询, 文本) 输入对打分（不使用缓存），不同查询的输入对可以合并在同一批推理"""
+        if not pairs:
+            return np.empty(0, dtype=np.float32)
+        encoded = self.tokenizer(
+            [[query, text] for query, text in pairs],
+            truncation=True,
+            max_length=self.max_length,
+        )
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+        order = np.argsort(lengths, kind='stable')
+
+        scores = np.empty(len(pairs), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            rows = order[start:start + self.batch_size]
+            batch = self.tokenizer.pad(
+                {key: [encoded[key][i] for i in rows] for key in ("input_ids", "attention_mask")},
+                padding=True,
+                return_tensors='np',
+            )
+            with self._model_lock, tracer.span("rerank_forward") as span:
+                span.batch(len(rows))
+                span.add(padded_tokens=int(batch["input_ids"].size))
+                scores[rows] = self._forward(dict(batch))
+        return scores
+
+    @staticmethod
+    def _chunk_key(chunk: dict):
+        if "id" in chunk:
+            return chunk["id"]
+        return hashlib.sha1(chunk["text"].encode('utf-8')).hexdigest()
+
+    def score(self, query: str, chunks: List[dict]) -> List[float]:
+        """对检索到的分块打分，(query, 分块ID) 的分数走 LRU 缓存"""
+        return self.score_many([(query, chunks)])[0]
+
+    def score_many(self, requests: List[Tuple[str, List[dict]]]) -> List[List[float]]:
+        """
+        一次处理多个 (查询, 分块列表) 请求：先查缓存，所有请求中未命中的输入对合并后统一分桶推理
+        """
+        keys = [[(query, self._chunk_key(chunk)) for chunk in chunks] for query, chunks in requests]
+        results = [[None] * len(chunks) for _, chunks in requests]
+        missing = {}  # 缓存键 -> [(请求下标, 分块下标)]，多个请求中相同的输入对只推理一次
+        with self._cache_lock:
+            for r, request_keys in enumerate(keys):
+                for i, key in enumerate(request_keys):
+                    if key in self._cache:
+                        self._cache.move_to_end(key)
+                        results[r][i] = self._cache[key]
+                    else:
+                        missing.setdefault(key, []).append((r, i))
+        total = sum(len(request_keys) for request_keys in keys)
+        misses = sum(len(positions) for positions in missing.values())
+        self.cache_hits += total - misses
+        self.cache_misses += misses
+        tracer.record("rerank_cache", batch=len(requests), cache_hits=total - misses, cache_misses=misses,
+                      scored_pairs=len(missing))
+
+        if missing:
+            pairs = []
+            for positions in missing.values():
+                r, i = positions[0]
+                pairs.append((requests[r][0], requests[r][1][i]["text"]))
+            new_scores = self.score_pair_list(pairs)
+            with self._cache_lock:
+                for (key, positions), score in zip(missing.items(), new_scores.tolist()):
+                    for r, i in positions:
+                        results[r][i] = score
+                    self._cache[key] = score
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return results
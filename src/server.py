@@ -0,0 +1,260 @@
+"""
+HTTP 服务模式
+
+    POST   /query               {"question": ..., "session_id": 可选, "stream": 可选}
+    DELETE /sessions/{id}       清除会话
+    GET    /health              健康检查
+    GET    /stats               缓存、预检索和重排序批处理统计，开启追踪时包含各阶段汇总
+    GET    /metrics             各阶段耗时、token、批大小和缓存命中（Prometheus 文本格式，需开启追踪）
+
+每个会话单独保存对话历史；同时处理的请求数有上限，排队过多时返回 503。
+stream 为 true 时以 NDJSON 逐行返回 {"delta": ...}，最后一行为 {"done": true, ...}。
+--workers N 时以多进程方式运行（见 src/worker_pool.py）。
+用法: python -m src.server --port 8000 --trace
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from aiohttp import web
+
+from src.config import Config
+from src.conversation_memory import ConversationMemory
+from src.query_processor import QueryEngine
+from src.tracing import tracer
+from src.worker_pool import RerankServiceUnavailable
+
+
+class Session:
+    def __init__(self, session_id: str, memory: ConversationMemory):
+        self.session_id = session_id
+        self.memory = memory
+        self.last_active = time.monotonic()
+        # 同一会话的请求按顺序处理，保证历史一致
+        self.lock = asyncio.Lock()
+
+
+class HealthAssistantServer:
+    RETRIEVAL_MODES = ("dense", "lexical", "hybrid", "multi")
+    MAX_TOP_K = 100
+
+    def __init__(self, query_engine: QueryEngine, query_rewriter=None, max_concurrency: int = None,
+                 max_pending: int = None, session_ttl: float = None, rerank_batching: bool = True):
+        self.config = Config
+        self.query_engine = query_engine
+        self.query_rewriter = query_rewriter
+        self.max_pending = max_pending or self.config.SERVER_MAX_PENDING
+        self.session_ttl = session_ttl or self.config.SERVER_SESSION_TTL
+        self.sessions = {}
+        self.pending = 0
+        self.requests = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency or self.config.SERVER_MAX_CONCURRENCY)
+        if rerank_batching:
+            query_engine.enable_rerank_batching()
+
+    def _get_session(self, session_id: str = None) -> Session:
+        now = time.monotonic()
+        for key in [key for key, session in self.sessions.items() if now - session.last_active > self.session_ttl]:
+            del self.sessions[key]
+        if not session_id:
+            session_id = uuid.uuid4().hex
+        session = self.sessions.get(session_id)
+        if session is None:
+            summarizer = self.query_engine.client.get_completion if self.config.MEMORY_LLM_SUMMARY else None
+            session = self.sessions[session_id] = Session(session_id, ConversationMemory(summarizer=summarizer))
+        session.last_active = now
+        return session
+
+    async def handle_query(self, request: web.Request) -> web.StreamResponse:
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest(text="请求体必须是 JSON")
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text="请求体必须是 JSON 对象")
+        question = body.get("question")
+        user_input = question.strip() if isinstance(question, str) else ""
+        if not user_input:
+            raise web.HTTPBadRequest(text="缺少 question")
+        session_id = body.get("session_id")
+        if session_id is not None and not isinstance(session_id, str):
+            raise web.HTTPBadRequest(text="session_id 必须是字符串")
+        mode = body.get("mode")
+        if mode is not None and mode not in self.RETRIEVAL_MODES:
+            raise web.HTTPBadRequest(text=f"mode 必须是 {' / '.join(self.RETRIEVAL_MODES)} 之一")
+        top_k = self._int_param(body, "top_k", 3)
+        rerank_top_n = self._int_param(body, "rerank_top_n", 10)
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise web.HTTPServiceUnavailable(text="服务繁忙，请稍后再试")
+
+        session = self._get_session(session_id)
+        self.pending += 1
+        self.requests += 1
+        try:
+            async with session.lock, self._semaphore:
+                try:
+                    question, stream, sources = await self.query_engine.aquery_stream(
+                        user_input, session.memory, self.query_rewriter,
+                        top_k=top_k, rerank_top_n=rerank_top_n, mode=mode)
+                except RerankServiceUnavailable as e:
+                    raise web.HTTPServiceUnavailable(text=str(e))
+                if body.get("stream"):
+                    response = await self._stream(request, session, question, stream, sources)
+                else:
+                    await self._drain(stream)
+                    response = web.json_response(
+                        self._result(session, question, stream, sources), dumps=self._dumps)
+                # 较早的轮次并入摘要时要提取关键词（可能还要调用大模型），放到线程池执行
+                await asyncio.get_running_loop().run_in_executor(
+                    self.query_engine.executor, session.memory.add_turn, question, stream.text)
+                return response
+        finally:
+            self.pending -= 1
+
+    def _int_param(self, body: dict, name: str, default: int) -> int:
+        """取 1 到 MAX_TOP_K 之间的整数参数，不合法时返回 400"""
+        value = body.get(name, default)
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            value = None
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise web.HTTPBadRequest(text=f"{name} 必须是整数")
+        if not 1 <= value <= self.MAX_TOP_K:
+            raise web.HTTPBadRequest(text=f"{name} 必须在 1 到 {self.MAX_TOP_K} 之间")
+        return value
+
+    @staticmethod
+    def _dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False, default=float)
+
+    @staticmethod
+    def _result(session: Session, question: str, stream, sources) -> dict:
+        return {
+            "session_id": session.session_id,
+            "question": question,
+            "answer": stream.text,
+            "sources": sources,
+            "stats": stream.stats(),
+        }
+
+    async def _drain(self, stream):
+        """在线程池中读完回答流（生成接口是阻塞的）"""
+        await asyncio.get_running_loop().run_in_executor(self.query_engine.executor, stream.read)
+
+    async def _stream(self, request: web.Request, session: Session, question: str, stream, sources):
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson; charset=utf-8"})
+        executor = self.query_engine.executor
+        deltas = iter(stream)
+        pending = None
+        finished = False
+        try:
+            await response.prepare(request)
+            while True:
+                pending = executor.submit(next, deltas, None)
+                delta = await asyncio.wrap_future(pending)
+                if delta is None:
+                    break
+                await response.write((self._dumps({"delta": delta}) + "\n").encode('utf-8'))
+            finished = True
+            result = dict(self._result(session, question, stream, sources), done=True)
+            await response.write((self._dumps(result) + "\n").encode('utf-8'))
+            await response.write_eof()
+        finally:
+            if not finished:
+                # 客户端断开或请求被取消：关闭上游的生成流，不留下读了一半的连接。
+                # 正在线程池中读取的那一步结束后才能关闭，生成器不能被两个线程同时操作
+                if pending is None:
+                    executor.submit(stream.close)
+                else:
+                    pending.add_done_callback(lambda _: executor.submit(stream.close))
+        return response
+
+    async def handle_delete_session(self, request: web.Request) -> web.Response:
+        self.sessions.pop(request.match_info["session_id"], None)
+        return web.json_response({"ok": True})
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        store = self.query_engine.vector_store
+        return web.json_response({"ok": True, "kb_version": store.version, "kb_build_id": store.build_id})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        engine = self.query_engine
+        stats = {
+            "pid": os.getpid(),
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "pending": self.pending,
+            "sessions": len(self.sessions),
+            "speculation": {"hits": engine.speculation_hits, "misses": engine.speculation_misses},
+            "table_hits": engine.table_hits,
+            "adaptive_retrieval": engine.adaptive.stats() if engine.adaptive is not None else {},
+            "multi_query_cache": engine.multi_query.stats() if engine._multi_query is not None else {},
+            "embedding_cache": engine.client.embedding_cache_stats(),
+        }
+        if engine.answer_cache is not None:
+            stats["answer_cache"] = engine.answer_cache.stats()
+        if engine.rerank_batcher is not None:
+            stats["rerank_batcher"] = engine.rerank_batcher.stats()
+        if hasattr(engine._reranker, "stats"):
+            # 多进程模式下的重排序服务代理
+            stats["rerank_service"] = engine._reranker.stats()
+        if tracer.enabled:
+            stats["tracing"] = tracer.snapshot()
+        return web.json_response(stats, dumps=self._dumps)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=tracer.prometheus(), content_type="text/plain", charset="utf-8")
+
+    async def _on_cleanup(self, app: web.Application):
+        if self.query_engine.rerank_batcher is not None:
+            await self.query_engine.rerank_batcher.close()
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post("/query", self.handle_query),
+            web.delete("/sessions/{session_id}", self.handle_delete_session),
+            web.get("/health", self.handle_health),
+            web.get("/stats", self.handle_stats),
+            web.get("/metrics", self.handle_metrics),
+        ])
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=Config.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=Config.SERVER_PORT)
+    parser.add_argument("--no-rerank-batching", action="store_true", help="关闭跨请求的重排序批处理")
+    parser.add_argument("--trace", action="store_true", help="开启按阶段的耗时和用量追踪")
+    parser.add_argument("--workers", type=int, default=Config.SERVER_WORKERS,
+                        help="工作进程数，大于 1 时共用内存映射的索引和一个重排序服务进程")
+    args = parser.parse_args()
+    if args.workers > 1:
+        from src.worker_pool import WorkerPool
+        WorkerPool(args.workers, args.host, args.port, rerank_batching=not args.no_rerank_batching,
+                   trace=args.trace).run()
+        return
+    if args.trace:
+        tracer.enabled = True
+
+    from src.app import HealthAssistantApp
+    assistant = HealthAssistantApp()
+
+    async def create_app():
+        server = HealthAssistantServer(assistant.query_engine, assistant.query_rewriter,
+                                       rerank_batching=not args.no_rerank_batching)
+        return server.make_app()
+
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+
+class StartupProfile:
+    """
+    启动耗时分析：按组件记录导入耗时和初始化耗时
+
+    模块只在第一次导入时计时，被多个组件共用的依赖（如 numpy）算在最先导入它的组件上。
+    后台预热线程和首次使用时的延迟加载同样记录在内，标明所在线程。
+    """
+
+    def __init__(self):
+        self.records: List[Tuple[str, str, float, str]] = []  # (组件, 阶段, 秒, 线程)
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, component: str, stage: str = "init"):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.records.append((component, stage, elapsed, threading.current_thread().name))
+
+    def report(self) -> str:
+        with self._lock:
+            records = list(self.records)
+        lines = [f"{'组件':<24}{'阶段':<10}{'耗时':>10}  线程"]
+        for component, stage, elapsed, thread in records:
+            lines.append(f"{component:<24}{stage:<10}{elapsed * 1000:>8.1f}ms  {thread}")
+        lines.append(f"自进程启动以来 {time.perf_counter() - self.started:.2f}s")
+        return "\n".join(lines)
+
+
+# 进程内共用的启动耗时记录
+profile = StartupProfile()
@@ -1,8 +1,103 @@
 import re
 import jieba
 import os
-from typing import List
+from bisect import bisect_left
+from collections import deque
+from typing import Iterable, Iterator, List, Tuple
 from src.config import Config
+from src.tracing import tracer
+
+_CJK_CHAR = re.compile(r'[\u4e00-\u9fa5\u3000-\u303f\uff00-\uffef]')
+_LATIN_WORD = re.compile(r'[A-Za-z0-9]+')
+# 清洗时要去掉的字符（空白和中文、常用中文标点、字母数字以外的字符）的连续片段，整段替换成一个空格
+_NOISE = re.compile(r'[^\u4e00-\u9fa5，。；：？！、（）【】《》“”‘’\w]+')
+# 其中长度 >= 2 的片段，以及空格以外的单个噪声字符（见 clean_with_offsets）
+_NOISE_RUN = re.compile(r'[^\u4e00-\u9fa5，。；：？！、（）【】《》“”‘’\w]{2,}')
+_NOISE_CHAR = re.compile(r'[^\u4e00-\u9fa5，。；：？！、（）【】《》“”‘’\w ]')
+# 从匹配起点贪婪匹配到范围内最后一个句末标点
+_LAST_SENTENCE_END = re.compile(r'.*[。！？；]', re.DOTALL)
+_SEARCH_TOKEN = re.compile(r'[\u4e00-\u9fa5\w]')
+
+# (分块文本, 原始页面文本中的起始偏移, 结束偏移)
+Chunk = Tuple[str, int, int]
+
+
+def estimate_tokens(text: str) -> int:
+    """本地粗略估计 token 数：中文字符和全角标点各算一个，连续的英文/数字算一个"""
+    return len(_CJK_CHAR.findall(text)) + len(_LATIN_WORD.findall(text))
+
+
+class OffsetMap:
+    """清洗后文本中的位置 -> 原文位置"""
+
+    __slots__ = ("lead", "clean_starts", "shifts")
+
+    def __init__(self, lead: int, clean_starts: List[int], shifts: List[int]):
+        self.lead = lead  # 开头被去掉的噪声长度
+        self.clean_starts = clean_starts  # 各长噪声片段替换成的空格在清洗后文本中的位置
+        self.shifts = shifts  # 到该片段为止原文比清洗后文本多出的长度
+
+    def raw(self, position: int) -> int:
+        """落在噪声片段替换成的空格上时取该片段在原文中的起点"""
+        k = bisect_left(self.clean_starts, position)
+        return position + (self.shifts[k - 1] if k else self.lead)
+
+
+def clean_with_offsets(text: str) -> Tuple[str, OffsetMap]:
+    """
+    清洗（结果与 _NOISE.sub(' ', text).strip() 相同）并返回清洗后位置到原文位置的映射
+
+    单个噪声字符替换成一个空格后长度不变，只有开头的噪声和长度 >= 2 的噪声片段会让位置错开。
+    页面文本里绝大多数噪声是词间的单个空格，所以只逐个处理长片段，其余噪声字符（空格除外）
+    再用一次替换换成空格，比对每个单空格都做一次替换快得多。
+    """
+    match = _NOISE.match(text)
+    lead = shift = last = match.end() if match else 0
+    kept, clean_starts, shifts = [], [], []
+    for run in _NOISE_RUN.finditer(text, lead):
+        kept.append(text[last:run.start()])
+        clean_starts.append(run.start() - shift)
+        shift += run.end() - run.start() - 1
+        shifts.append(shift)
+        last = run.end()
+    kept.append(text[last:])
+    cleaned = _NOISE_CHAR.sub(' ', ' '.join(kept)).rstrip()
+    return cleaned, OffsetMap(lead, clean_starts, shifts)
+
+
+def split_spans(text: str, chunk_size: int, overlap: int) -> List[Tuple[int, int]]:
+    """
+    按长度分块，返回各块的 (起点, 终点)
+
+    每块在不超过 chunk_size 的前提下截断在块后半段最后一个句末标点（。！？；）之后（每块一次正则匹配），
+    找不到时按长度硬切；下一块从上一块结尾往前 overlap 个字符开始，最后一块到文本末尾为止。
+    """
+    spans = []
+    start, length, half = 0, len(text), chunk_size // 2
+    while start < length:
+        end = start + chunk_size
+        if end >= length:
+            spans.append((start, length))
+            break
+        # 只在后半段找，确保不会截取太短的块
+        match = _LAST_SENTENCE_END.match(text, start + half + 1, end)
+        if match:
+            end = match.end()
+        spans.append((start, end))
+        start = max(end - overlap, start + 1)
+    return spans
+
+
+def chunk_page(text: str, chunk_size: int, overlap: int) -> List[Chunk]:
+    """清洗并分块一页原始文本，返回 (分块文本, 原文起始偏移, 原文结束偏移)；可在子进程中执行"""
+    cleaned, offsets = clean_with_offsets(text)
+    return [(cleaned[start:end], offsets.raw(start), offsets.raw(end))
+            for start, end in split_spans(cleaned, chunk_size, overlap)]
+
+
+def _chunk_pages(pages: List[Tuple[int, str, str]], chunk_size: int, overlap: int):
+    """子进程中处理一组页面"""
+    return [(page_number, page_key, chunk_page(text, chunk_size, overlap)) for page_number, page_key, text in pages]
 
 
 class TextProcessor:
@@ -25,29 +120,62 @@ class TextProcessor:
             print(f"使用内置默认营养学术语词典")
 
     def clean_text(self, text: str) -> str:
-        """清洗中文文本"""
-        # 移除特殊字符但保留中文标点
-        text = re.sub(r'[^\u4e00-\u9fa5，。；：？！、（）【】《》“”‘’\s\w]', ' ', text)
-        # 合并多余空白
-        text = re.sub(r'\s+', ' ', text)
-        return text.strip()
+        """清洗中文文本：特殊字符和连续空白替换成一个空格（保留中文标点）"""
+        return clean_with_offsets(text)[0]
 
     def segment_text(self, text: str) -> List[str]:
         """中文分词"""
         return list(jieba.cut(text))
 
+    def tokenize_for_search(self, text: str) -> List[str]:
+        """检索用分词：搜索引擎模式切分长词，去掉空白和标点，英文转小写"""
+        tokens = []
+        for token in jieba.cut_for_search(text):
+            token = token.strip().lower()
+            if token and _SEARCH_TOKEN.search(token):
+                tokens.append(token)
+        return tokens
+
     def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        """将长文本分块"""
-        chunks = []
-        start = 0
-        while start < len(text):
-            end = start + chunk_size
-            # 确保不在句子中间截断
-            if end < len(text):
-                # 尝试在句号处截断
-                sentence_end = text.rfind('。', start, end)
-                if sentence_end > start + chunk_size // 2:  # 确保不会截取太短的块
-                    end = sentence_end + 1
-            chunks.append(text[start:end])
-            start = end - overlap  # 设置重叠部分
-        return chunks
\ No newline at end of file
+        """将长文本分块（尽量在句末标点处截断）"""
+        return [text[start:end] for start, end in split_spans(text, chunk_size, overlap)]
+
+    def iter_page_chunks(self, pages: Iterable[Tuple[int, str, str]], chunk_size: int = 1000, overlap: int = 200,
+                         workers: int = 0, pages_per_task: int = 16) -> Iterator[Tuple[int, str, List[Chunk]]]:
+        """
+        流式清洗和分块：输入 (页码, 页面键, 原始文本) 的可迭代对象，按输入顺序逐页返回 (页码, 页面键, 分块列表)，
+        分块为 (文本, 原文起始偏移, 原文结束偏移)
+
+        workers > 1 时每 pages_per_task 页打包提交到进程池，同时在途的任务数有上限，
+        输入是逐页OCR的生成器时不会一次读完全部页面。
+        """
+        if workers <= 1:
+            for page_number, page_key, text in pages:
+                with tracer.span("chunking") as span:
+                    chunks = chunk_page(text, chunk_size, overlap)
+                    span.add(chunks=len(chunks))
+                yield page_number, page_key, chunks
+            return
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        def results(future):
+            with tracer.span("chunking") as span:
+                done = future.result()
+                span.batch(len(done))
+                span.add(chunks=sum(len(chunks) for _, _, chunks in done))
+            return done
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            in_flight, group = deque(), []
+            for page in pages:
+                group.append(page)
+                if len(group) >= pages_per_task:
+                    in_flight.append(executor.submit(_chunk_pages, group, chunk_size, overlap))
+                    group = []
+                    if len(in_flight) >= workers * 2:
+                        yield from results(in_flight.popleft())
+            if group:
+                in_flight.append(executor.submit(_chunk_pages, group, chunk_size, overlap))
+            while in_flight:
+                yield from results(in_flight.popleft())
\ No newline at end of file
@@ -0,0 +1,276 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict
+
+from src.config import Config
+
+# 耗时直方图的桶上界（秒）和批大小直方图的桶上界
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+class Histogram:
+    """固定桶直方图，各桶内单独计数，导出时再换算成 Prometheus 的累计桶"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 最后一个桶为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """按桶上界估计分位数"""
+        if not self.count:
+            return 0.0
+        target, seen = q * self.count, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def cumulative(self):
+        total, result = 0, []
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": {("+Inf" if bound == float("inf") else format(bound, 'g')): total
+                        for bound, total in self.cumulative()},
+        }
+
+
+class StageStats:
+    """一个阶段的聚合：调用耗时直方图、批大小直方图和计数器（token、缓存命中、错误等）"""
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.batch = Histogram(BATCH_BUCKETS)
+        self.counters: Dict[str, float] = {}
+
+    def to_dict(self) -> dict:
+        return {
+            "latency": self.latency.to_dict(),
+            "batch": self.batch.to_dict(),
+            "counters": dict(self.counters),
+        }
+
+
+class Span:
+    """一次阶段调用的计时；with 块内可以用 add() 累加计数器、用 batch() 记录批大小"""
+
+    __slots__ = ("tracer", "stage", "counters", "batch_size", "start")
+
+    def __init__(self, tracer: "Tracer", stage: str):
+        self.tracer = tracer
+        self.stage = stage
+        self.counters = {}
+        self.batch_size = None
+        self.start = None
+
+    def add(self, **counters):
+        for name, value in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def batch(self, size: int):
+        self.batch_size = size
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # 生成器被提前关闭（GeneratorExit）等不算错误
+        if exc_type is not None and issubclass(exc_type, Exception):
+            self.add(errors=1)
+        self.tracer.record(self.stage, time.perf_counter() - self.start, self.batch_size, **self.counters)
+        return False
+
+
+class _NullSpan:
+    """追踪关闭时使用的空 Span，不计时也不加锁"""
+
+    __slots__ = ()
+
+    def add(self, **counters):
+        pass
+
+    def batch(self, size: int):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    按阶段聚合的轻量追踪
+
+    每个阶段记录调用耗时直方图、批大小直方图和计数器（输入/输出 token、缓存命中/未命中、错误等），
+    只保留聚合值不保留单次调用，内存占用与请求量无关。可以导出为 JSON（snapshot）
+    或 Prometheus 文本格式（prometheus）。关闭时 span() 直接返回共用的空 Span，开销只有一次属性判断。
+    """
+
+    PREFIX = "health_assistant"
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.started = time.time()
+        self._stages: Dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+
+    def span(self, stage: str):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, stage)
+
+    def iterate(self, stage: str, iterable):
+        """逐项返回 iterable 的元素，把每次取下一项的等待时间记为一次调用（用于生成器形式的阶段，如逐页OCR）"""
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(stage, time.perf_counter() - start)
+            yield item
+
+    def record(self, stage: str, seconds: float = None, batch: int = None, **counters):
+        """直接记录一次调用（seconds 为 None 时只累加计数器），用于无法包在 with 块里的阶段，如流式生成"""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = StageStats()
+            if seconds is not None:
+                stats.latency.observe(seconds)
+            if batch is not None:
+                stats.batch.observe(batch)
+            for name, value in counters.items():
+                stats.counters[name] = stats.counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self.started = time.time()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stages = {stage: stats.to_dict() for stage, stats in sorted(self._stages.items())}
+        return {"enabled": self.enabled, "since": self.started, "stages": stages}
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def save(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_json())
+
+    def prometheus(self) -> str:
+        """Prometheus 文本格式"""
+        with self._lock:
+            stages = sorted(self._stages.items())
+            lines = []
+            for metric, attribute, help_text in (
+                    ("stage_seconds", "latency", "各阶段单次调用耗时（秒）"),
+                    ("stage_batch_size", "batch", "各阶段单次调用的批大小")):
+                name = f"{self.PREFIX}_{metric}"
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for stage, stats in stages:
+                    histogram = getattr(stats, attribute)
+                    if not histogram.count:
+                        continue
+                    for bound, total in histogram.cumulative():
+                        le = "+Inf" if bound == float("inf") else format(bound, 'g')
+                        lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {total}')
+                    lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum}')
+                    lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+
+            name = f"{self.PREFIX}_stage_events_total"
+            lines += [f"# HELP {name} 各阶段的计数器（token、缓存命中、错误等）", f"# TYPE {name} counter"]
+            for stage, stats in stages:
+                for counter, value in sorted(stats.counters.items()):
+                    lines.append(f'{name}{{stage="{stage}",counter="{counter}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def report(self) -> str:
+        """终端可读的汇总"""
+        lines = [f"{'阶段':<22}{'次数':>6}{'平均':>10}{'P95':>10}{'平均批':>8}  计数器"]
+        for stage, stats in self.snapshot()["stages"].items():
+            latency, batch = stats["latency"], stats["batch"]
+            counters = ", ".join(f"{name}={value:g}" for name, value in sorted(stats["counters"].items()))
+            lines.append(f"{stage:<22}{latency['count']:>6}{latency['mean'] * 1000:>8.1f}ms"
+                         f"{latency['p95'] * 1000:>8.0f}ms{batch['mean']:>8.1f}  {counters}")
+        return "\n".join(lines)
+
+    def langchain_callback(self, stage: str):
+        """
+        LangChain 回调：记录每次大模型调用的耗时和通义返回的 token 用量
+
+        返回的回调对象上累计了 calls、input_tokens、output_tokens，追踪关闭时也可以用来打印用量。
+        """
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        tracer = self
+
+        class UsageCallback(BaseCallbackHandler):
+            def __init__(self):
+                self.calls = 0
+                self.input_tokens = 0
+                self.output_tokens = 0
+                self._starts = {}
+
+            def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+                self._starts[run_id] = time.perf_counter()
+
+            def on_llm_end(self, response, *, run_id, **kwargs):
+                input_tokens = output_tokens = 0
+                for generations in response.generations:
+                    for generation in generations:
+                        usage = (generation.generation_info or {}).get("token_usage") or {}
+                        input_tokens += usage.get("input_tokens", 0)
+                        output_tokens += usage.get("output_tokens", 0)
+                self.calls += 1
+                self.input_tokens += input_tokens
+                self.output_tokens += output_tokens
+                start = self._starts.pop(run_id, None)
+                tracer.record(stage, None if start is None else time.perf_counter() - start,
+                              input_tokens=input_tokens, output_tokens=output_tokens)
+
+            def on_llm_error(self, error, *, run_id, **kwargs):
+                start = self._starts.pop(run_id, None)
+                tracer.record(stage, None if start is None else time.perf_counter() - start, errors=1)
+
+        return UsageCallback()
+
+
+# 进程内共用的追踪器
+tracer = Tracer(enabled=Config.TRACING_ENABLED)
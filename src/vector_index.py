@@ -0,0 +1,470 @@
+import heapq
+import json
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+from src.vector_quantizer import PCAProjection, create_codec
+
+
+class VectorIndex:
+    """
+    内存映射的向量索引
+
+    向量归一化后按行存放，内积即余弦相似度。支持三种检索方式：
+        flat: 精确检索，分块计算全部内积
+        ivf:  球面 k-means 倒排，只扫描与查询最近的 nprobe 个簇
+        hnsw: 近邻图检索（HNSW 的第 0 层，入口点为均匀采样的若干节点）
+
+    向量的存放精度（dtype）:
+        float32 / float16: 原样存放
+        int8: 逐维仿射标量量化，每个向量 dim 字节
+        pq:   乘积量化，每个向量 pq_m 字节
+    index_dimensions 小于原维度时先用 PCA 投影降维再存放。压缩存放（int8、pq 或降维）时另存一份
+    float32 原始向量，只以内存映射方式打开：rescore > 0 时先按压缩向量取 top_k * rescore 个候选，
+    再读出这些候选的原始向量精确重打分，常驻内存的只有压缩向量。
+
+    保存目录结构:
+        meta.json            维度、条数、精度、索引类型及参数
+        vectors.bin          (n, 码长) 向量矩阵（压缩时为编码）
+        vectors_full.bin     (n, dim) float32 原始向量，仅压缩存放时存在
+        codec_*.bin          量化参数（标量量化的偏移和步长、乘积量化的码本）
+        projection.bin       降维投影矩阵
+        ids.bin              (n,) int64 分块ID
+        ivf_*.bin            IVF 的簇中心、归属及倒排表
+        hnsw_neighbors.bin   (n, 2M) int32 邻接表，-1 表示空位
+    加载时所有数组都以只读方式内存映射，不随语料规模增加启动耗时。
+    """
+
+    KINDS = ("flat", "ivf", "hnsw")
+    DTYPES = ("float32", "float16", "int8", "pq")
+    # 精确检索时每次解码/计算的行数：避免整体转换占用大量内存，块足够小时转换结果留在 CPU 缓存中
+    SEARCH_BLOCK = 4096
+    # HNSW 检索的入口点数量
+    ENTRY_POINTS = 32
+
+    def __init__(self, dimensions: int, kind: str = "flat", dtype: str = "float32", nlist: int = 0,
+                 nprobe: int = 8, hnsw_m: int = 16, ef_construction: int = 64, ef_search: int = 64,
+                 index_dimensions: int = 0, pq_m: int = 64, rescore: int = 0):
+        if kind not in self.KINDS:
+            raise ValueError(f"不支持的索引类型: {kind}")
+        if dtype not in self.DTYPES:
+            raise ValueError(f"不支持的向量精度: {dtype}")
+        self.dimensions = dimensions
+        self.kind = kind
+        self.dtype = dtype
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.index_dimensions = index_dimensions if 0 < index_dimensions < dimensions else 0
+        self.pq_m = pq_m
+        self.rescore = rescore
+
+        self.codec = create_codec(dtype, pq_m)
+        self.projection = PCAProjection(self.index_dimensions) if self.index_dimensions else None
+        code_width = self.codec.code_width(self.index_dimensions or dimensions)
+        self._vectors = np.empty((0, code_width), dtype=self.codec.code_dtype)
+        self._ids = np.empty(0, dtype=np.int64)
+        # 压缩存放时保留的 float32 原始向量，用于重新训练量化参数和精确重打分
+        self._full = None
+        self._codec_trained_size = 0
+        # IVF
+        self._centroids = None
+        self._assign = None
+        self._lists = None
+        self._trained_size = 0
+        # HNSW
+        self._neighbors = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids
+
+    @property
+    def compressed(self) -> bool:
+        return self.dtype in ("int8", "pq") or self.projection is not None
+
+    @property
+    def bytes_per_vector(self) -> int:
+        """每个向量常驻内存的字节数"""
+        return self._vectors.shape[1] * self._vectors.dtype.itemsize
+
+    @property
+    def nbytes(self) -> int:
+        """向量及索引结构常驻内存的字节数（不含只在重打分时按需读取的原始向量）"""
+        total = self._vectors.nbytes + self._ids.nbytes
+        for array in (self._centroids, self._assign, self._neighbors):
+            if array is not None:
+                total += array.nbytes
+        total += sum(array.nbytes for array in self.codec.arrays().values() if array is not None)
+        if self.projection is not None and self.projection.components is not None:
+            total += self.projection.components.nbytes
+        return total
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _rows(self, rows) -> np.ndarray:
+        """解码后的向量（降维时为投影空间中的向量）"""
+        return self.codec.decode(self._vectors[rows])
+
+    def _scores(self, rows, prepared) -> np.ndarray:
+        return self.codec.scores(self._vectors[rows], prepared)
+
+    def _to_space(self, vectors: np.ndarray) -> np.ndarray:
+        """原始向量转换到索引存放的空间"""
+        return vectors if self.projection is None else self.projection.project(vectors)
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.concatenate([
+            self.codec.encode(self._to_space(vectors[start:start + self.SEARCH_BLOCK]))
+            for start in range(0, len(vectors), self.SEARCH_BLOCK)
+        ]) if len(vectors) else self._vectors[:0]
+
+    def _train_codec(self):
+        """用全部原始向量重新训练降维和量化参数，并重新编码"""
+        if self.projection is not None:
+            self.projection.train(self._full)
+        self.codec.train(self._to_space(self._full))
+        self._vectors = self._encode(self._full)
+        self._codec_trained_size = len(self)
+        # 向量空间变了，IVF 需要重新训练
+        self._centroids = None
+        self._assign = None
+        self._lists = None
+
+    def add(self, ids: List[int], vectors: np.ndarray):
+        """添加向量"""
+        vectors = self._normalize(vectors).reshape(-1, self.dimensions)
+        start = len(self)
+        self._ids = np.concatenate([self._ids, np.asarray(ids, dtype=np.int64)])
+        if self.compressed:
+            self._full = vectors if self._full is None else np.concatenate([self._full, vectors])
+            # 与 IVF 相同：数据量比上次训练时翻倍后重新训练，否则直接用已有参数编码
+            if len(self) > 2 * self._codec_trained_size:
+                self._train_codec()
+            else:
+                self._vectors = np.concatenate([self._vectors, self._encode(vectors)])
+        else:
+            self._vectors = np.concatenate([self._vectors, self.codec.encode(vectors)])
+
+        if self.kind == "ivf":
+            self._ivf_add(self._rows(slice(start, None)))
+        elif self.kind == "hnsw":
+            self._grow_neighbors(len(self))
+            for row in range(start, len(self)):
+                self._hnsw_insert(row)
+
+    def remove(self, ids: List[int]) -> np.ndarray:
+        """删除向量，返回保留行的布尔掩码（调用方据此同步删除自己的行数据）"""
+        keep = ~np.isin(self._ids, np.asarray(ids, dtype=np.int64))
+        if keep.all():
+            return keep
+        self._vectors = self._vectors[keep]
+        self._ids = self._ids[keep]
+        if self._full is not None:
+            self._full = self._full[keep]
+        if self._assign is not None:
+            self._assign = self._assign[keep]
+            self._lists = None
+        if self._neighbors is not None:
+            # 旧行号映射到新行号，指向已删除节点的边置为空位
+            mapping = np.full(len(keep), -1, dtype=np.int32)
+            mapping[keep] = np.arange(int(keep.sum()), dtype=np.int32)
+            neighbors = self._neighbors[keep]
+            self._neighbors = np.where(neighbors >= 0, mapping[np.maximum(neighbors, 0)], -1).astype(np.int32)
+        return keep
+
+    def search(self, query: np.ndarray, top_k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        检索与查询最相似的向量
+
+        返回:
+            rows: 命中向量的行号（按相似度降序），分块ID 为 self.ids[rows]
+            scores: 对应的余弦相似度
+        """
+        if len(self) == 0 or top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = self._normalize(query).reshape(-1)
+        rescore = self.rescore and self._full is not None
+        rows, scores = self._candidates(query, top_k * self.rescore if rescore else top_k)
+        if rescore and len(rows) > top_k:
+            # 精确重打分：只读取候选行的原始向量
+            order = np.argsort(rows)
+            exact = np.empty(len(rows), dtype=np.float32)
+            exact[order] = np.asarray(self._full[rows[order]], dtype=np.float32) @ query
+            top = np.argsort(-exact, kind='stable')[:top_k]
+            return rows[top], exact[top]
+        return rows[:top_k], scores[:top_k]
+
+    def _candidates(self, query: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """按存放的（可能压缩的）向量检索，返回按近似相似度降序的 (行号, 分数)"""
+        space_query = self._to_space(query)
+        prepared = self.codec.prepare(space_query)
+
+        if self.kind == "hnsw" and self._neighbors is not None:
+            results = self._hnsw_search_layer(prepared, max(self.ef_search, top_k), len(self))[:top_k]
+            rows = np.array([row for _, row in results], dtype=np.int64)
+            return rows, np.array([score for score, _ in results], dtype=np.float32)
+
+        rows = None
+        if self.kind == "ivf" and self._centroids is not None:
+            rows = self._ivf_candidates(space_query)
+            if len(rows) < top_k:
+                rows = None
+
+        if rows is None:
+            scores = np.empty(len(self), dtype=np.float32)
+            for start in range(0, len(self), self.SEARCH_BLOCK):
+                end = start + self.SEARCH_BLOCK
+                scores[start:end] = self._scores(slice(start, end), prepared)
+            rows = np.arange(len(self))
+        else:
+            scores = self._scores(rows, prepared)
+
+        top_k = min(top_k, len(rows))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return rows[top].astype(np.int64), scores[top].astype(np.float32)
+
+    # ---------- IVF ----------
+
+    def _train_ivf(self, iterations: int = 10):
+        """球面 k-means 训练簇中心，并为全部向量分配簇"""
+        n = len(self)
+        nlist = min(self.nlist or max(1, int(np.sqrt(n))), n)
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(n, size=min(n, nlist * 64), replace=False))
+        sample = self._rows(sample_rows)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                # 空簇重新随机选一个样本作为中心
+                centroids[c] = members.sum(axis=0) if len(members) else sample[rng.integers(len(sample))]
+            centroids = self._normalize(centroids)
+
+        self._centroids = centroids
+        self._assign = np.concatenate([
+            np.argmax(self._rows(slice(start, start + self.SEARCH_BLOCK)) @ centroids.T, axis=1)
+            for start in range(0, n, self.SEARCH_BLOCK)
+        ]).astype(np.int32)
+        self._lists = None
+        self._trained_size = n
+
+    def _ivf_add(self, vectors: np.ndarray):
+        # 数据量比上次训练时翻倍后重新训练，否则直接分配到最近的簇
+        if self._centroids is None or len(self) > 2 * self._trained_size:
+            self._train_ivf()
+            return
+        assign = np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+        self._assign = np.concatenate([self._assign, assign])
+        self._lists = None
+
+    def _ivf_lists(self) -> Tuple[np.ndarray, np.ndarray]:
+        """倒排表：按簇排序的行号及每个簇的起止偏移"""
+        if self._lists is None:
+            order = np.argsort(self._assign, kind='stable').astype(np.int64)
+            offsets = np.searchsorted(self._assign[order], np.arange(len(self._centroids) + 1)).astype(np.int64)
+            self._lists = (order, offsets)
+        return self._lists
+
+    def _ivf_candidates(self, query: np.ndarray) -> np.ndarray:
+        order, offsets = self._ivf_lists()
+        probe = np.argsort(-(self._centroids @ query))[:self.nprobe]
+        return np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probe])
+
+    # ---------- HNSW ----------
+
+    @property
+    def _max_degree(self) -> int:
+        return 2 * self.hnsw_m
+
+    def _grow_neighbors(self, n: int):
+        current = 0 if self._neighbors is None else len(self._neighbors)
+        extra = np.full((n - current, self._max_degree), -1, dtype=np.int32)
+        self._neighbors = extra if self._neighbors is None else np.concatenate([self._neighbors, extra])
+
+    def _entry_points(self, count: int) -> np.ndarray:
+        return np.unique(np.linspace(0, count - 1, min(self.ENTRY_POINTS, count)).astype(np.int64))
+
+    def _hnsw_search_layer(self, prepared, ef: int, count: int) -> List[Tuple[float, int]]:
+        """
+        在前 count 个节点构成的图上做束搜索，返回按相似度降序的 (相似度, 行号)
+
+        prepared 为 codec.prepare() 转换后的查询
+        """
+        entries = self._entry_points(count)
+        visited = set(entries.tolist())
+        results = []  # 小顶堆，保留最好的 ef 个
+        candidates = []  # 大顶堆（取负），待扩展的节点
+        for score, row in zip(self._scores(entries, prepared).tolist(), entries.tolist()):
+            heapq.heappush(candidates, (-score, row))
+            heapq.heappush(results, (score, row))
+            if len(results) > ef:
+                heapq.heappop(results)
+
+        while candidates:
+            neg_score, row = heapq.heappop(candidates)
+            if len(results) >= ef and -neg_score < results[0][0]:
+                break
+            neighbors = self._neighbors[row]
+            new = [n for n in neighbors[neighbors >= 0].tolist() if n not in visited]
+            if not new:
+                continue
+            visited.update(new)
+            for score, n in zip(self._scores(new, prepared).tolist(), new):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, n))
+                    heapq.heappush(results, (score, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def _select_neighbors(self, candidates: np.ndarray, scores: np.ndarray, limit: int) -> np.ndarray:
+        """
+        HNSW 的启发式邻居选择：按相似度从高到低，只接受与目标的相似度高于与已选邻居相似度的候选，
+        使边分散到不同方向（跨簇的长边得以保留）；名额不满时再用被淘汰的候选补齐。
+        """
+        order = np.argsort(-scores)
+        candidates, scores = candidates[order], scores[order]
+        vectors = self._rows(candidates)
+        pairwise = vectors @ vectors.T
+        selected, pruned = [], []
+        for i in range(len(candidates)):
+            if len(selected) >= limit:
+                break
+            if not selected or scores[i] > pairwise[i, selected].max():
+                selected.append(i)
+            else:
+                pruned.append(i)
+        selected += pruned[:limit - len(selected)]
+        return candidates[selected]
+
+    def _hnsw_insert(self, row: int):
+        if row == 0:
+            return
+        results = self._hnsw_search_layer(self.codec.prepare(self._rows(row)), self.ef_construction, row)
+        candidates = np.array([n for _, n in results], dtype=np.int64)
+        scores = np.array([score for score, _ in results], dtype=np.float32)
+        selected = self._select_neighbors(candidates, scores, self.hnsw_m)
+        self._neighbors[row, :len(selected)] = selected
+        for n in selected.tolist():
+            self._hnsw_link(n, row)
+
+    def _hnsw_link(self, row: int, new: int):
+        """
+        为 row 添加一条指向 new 的边
+
+        邻接表已满时重新做启发式选择，只保留 M 条边，空出的位置留给之后的新边，
+        把选择的开销分摊到多次插入上。
+        """
+        neighbors = self._neighbors[row]
+        free = np.flatnonzero(neighbors < 0)
+        if free.size:
+            neighbors[free[0]] = new
+            return
+        candidates = np.append(neighbors, new).astype(np.int64)
+        scores = self._rows(candidates) @ self._rows(row)
+        selected = self._select_neighbors(candidates, scores, self.hnsw_m)
+        neighbors[:] = -1
+        neighbors[:len(selected)] = selected
+
+    # ---------- 持久化 ----------
+
+    def save(self, directory: str):
+        """保存到目录（目录应为新建的空目录）"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.ascontiguousarray(self._vectors).tofile(directory / "vectors.bin")
+        self._ids.tofile(directory / "ids.bin")
+        codec_arrays = {name: array for name, array in self.codec.arrays().items() if array is not None}
+        for name, array in codec_arrays.items():
+            array.astype(np.float32).tofile(directory / f"codec_{name}.bin")
+        if self._full is not None:
+            np.ascontiguousarray(self._full, dtype=np.float32).tofile(directory / "vectors_full.bin")
+        if self.projection is not None and self.projection.components is not None:
+            self.projection.components.tofile(directory / "projection.bin")
+        if self._centroids is not None:
+            order, offsets = self._ivf_lists()
+            self._centroids.astype(np.float32).tofile(directory / "ivf_centroids.bin")
+            self._assign.tofile(directory / "ivf_assign.bin")
+            order.tofile(directory / "ivf_order.bin")
+            offsets.tofile(directory / "ivf_offsets.bin")
+        if self._neighbors is not None:
+            self._neighbors.tofile(directory / "hnsw_neighbors.bin")
+
+        meta = {
+            "dimensions": self.dimensions,
+            "count": len(self),
+            "kind": self.kind,
+            "dtype": self.dtype,
+            "nlist": self.nlist,
+            "nprobe": self.nprobe,
+            "hnsw_m": self.hnsw_m,
+            "ef_construction": self.ef_construction,
+            "ef_search": self.ef_search,
+            "index_dimensions": self.index_dimensions,
+            "pq_m": self.pq_m,
+            "rescore": self.rescore,
+            "codec_arrays": {name: list(array.shape) for name, array in codec_arrays.items()},
+            "codec_trained_size": self._codec_trained_size,
+            "full_vectors": self._full is not None,
+            "ivf_clusters": 0 if self._centroids is None else len(self._centroids),
+            "ivf_trained_size": self._trained_size,
+            "hnsw": self._neighbors is not None,
+        }
+        with open(directory / "meta.json", 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "VectorIndex":
+        """从目录加载，mmap=True 时以只读内存映射方式零拷贝加载"""
+        directory = Path(directory)
+        with open(directory / "meta.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = cls(meta["dimensions"], kind=meta["kind"], dtype=meta["dtype"], nlist=meta["nlist"],
+                    nprobe=meta["nprobe"], hnsw_m=meta["hnsw_m"], ef_construction=meta["ef_construction"],
+                    ef_search=meta["ef_search"], index_dimensions=meta.get("index_dimensions", 0),
+                    pq_m=meta.get("pq_m", 64), rescore=meta.get("rescore", 0))
+        n = meta["count"]
+
+        def read(name, dtype, shape):
+            if n == 0:
+                return np.empty(shape, dtype=dtype)
+            if mmap:
+                return np.memmap(directory / name, dtype=dtype, mode='r', shape=shape)
+            return np.fromfile(directory / name, dtype=dtype).reshape(shape)
+
+        index._vectors = read("vectors.bin", index.codec.code_dtype, (n, index._vectors.shape[1]))
+        index._ids = read("ids.bin", np.int64, (n,))
+        index.codec.load_arrays({
+            name: np.fromfile(directory / f"codec_{name}.bin", dtype=np.float32).reshape(shape)
+            for name, shape in meta.get("codec_arrays", {}).items()
+        })
+        if meta.get("full_vectors"):
+            index._full = read("vectors_full.bin", np.float32, (n, meta["dimensions"]))
+        if index.projection is not None and n:
+            index.projection.components = np.fromfile(directory / "projection.bin", dtype=np.float32).reshape(
+                index.index_dimensions, meta["dimensions"])
+        index._codec_trained_size = meta.get("codec_trained_size", 0)
+        if meta["ivf_clusters"]:
+            nlist = meta["ivf_clusters"]
+            index._centroids = np.fromfile(directory / "ivf_centroids.bin", dtype=np.float32).reshape(nlist, -1)
+            index._assign = read("ivf_assign.bin", np.int32, (n,))
+            index._lists = (read("ivf_order.bin", np.int64, (n,)),
+                            np.fromfile(directory / "ivf_offsets.bin", dtype=np.int64))
+            index._trained_size = meta["ivf_trained_size"]
+        if meta["hnsw"]:
+            index._neighbors = read("hnsw_neighbors.bin", np.int32, (n, 2 * meta["hnsw_m"]))
+        return index
@@ -0,0 +1,198 @@
+from typing import Dict
+
+import numpy as np
+
+
+def _sample(vectors: np.ndarray, size: int, seed: int = 0) -> np.ndarray:
+    """训练用的随机样本（行数不超过 size）"""
+    if len(vectors) <= size:
+        return np.asarray(vectors, dtype=np.float32)
+    rows = np.sort(np.random.default_rng(seed).choice(len(vectors), size=size, replace=False))
+    return np.asarray(vectors[rows], dtype=np.float32)
+
+
+class FloatCodec:
+    """不压缩：按 float32 / float16 原样存放"""
+
+    name = "float"
+
+    def __init__(self, dtype: str = "float32"):
+        self.code_dtype = np.dtype(dtype)
+
+    def code_width(self, dimensions: int) -> int:
+        return dimensions
+
+    def train(self, vectors: np.ndarray):
+        pass
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.asarray(vectors).astype(self.code_dtype)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.asarray(codes, dtype=np.float32)
+
+    def prepare(self, query: np.ndarray):
+        """把查询转换成打分需要的形式，同一查询多次打分时只转换一次"""
+        return query
+
+    def scores(self, codes: np.ndarray, prepared) -> np.ndarray:
+        return self.decode(codes) @ prepared
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """需要持久化的参数数组"""
+        return {}
+
+    def load_arrays(self, arrays: Dict[str, np.ndarray]):
+        pass
+
+
+class ScalarQuantizer(FloatCodec):
+    """
+    逐维仿射 int8 标量量化：x ≈ offset + scale * code，code 为 uint8
+
+    内积不需要解码：q·x ≈ q·offset + (q*scale)·code，每个向量只占 dim 字节（float32 的 1/4）。
+    """
+
+    name = "int8"
+
+    def __init__(self):
+        super().__init__("uint8")
+        self.offset = None
+        self.scale = None
+
+    def train(self, vectors: np.ndarray):
+        sample = _sample(vectors, 65536)
+        low, high = sample.min(axis=0), sample.max(axis=0)
+        self.offset = low
+        self.scale = np.maximum(high - low, 1e-8) / 255.0
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((np.asarray(vectors, dtype=np.float32) - self.offset) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.offset + np.asarray(codes, dtype=np.float32) * self.scale
+
+    def prepare(self, query: np.ndarray):
+        return query * self.scale, float(query @ self.offset)
+
+    def scores(self, codes: np.ndarray, prepared) -> np.ndarray:
+        weights, bias = prepared
+        return np.asarray(codes, dtype=np.float32) @ weights + bias
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"offset": self.offset, "scale": self.scale}
+
+    def load_arrays(self, arrays: Dict[str, np.ndarray]):
+        self.offset, self.scale = arrays["offset"], arrays["scale"]
+
+
+class ProductQuantizer(FloatCodec):
+    """
+    乘积量化：向量切成 m 段，每段用 256 个中心的 k-means 码本编码成 1 字节
+
+    检索时先算查询每段与各中心的内积表 (m, 256)，向量的分数为查表求和（非对称距离计算），
+    每个向量只占 m 字节。
+    """
+
+    name = "pq"
+
+    def __init__(self, m: int = 64, bits: int = 8):
+        super().__init__("uint8")
+        self.m = m
+        self.k = 1 << bits
+        self.centroids = None  # (m, k, dim / m)
+
+    def code_width(self, dimensions: int) -> int:
+        if dimensions % self.m:
+            raise ValueError(f"向量维度 {dimensions} 不能被乘积量化段数 {self.m} 整除")
+        return self.m
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        """(n, dim) -> (m, n, dim / m)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors.reshape(len(vectors), self.m, -1).transpose(1, 0, 2)
+
+    @staticmethod
+    def _nearest(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (centroids * centroids).sum(axis=1) - 2 * points @ centroids.T
+        return np.argmin(distances, axis=1)
+
+    def train(self, vectors: np.ndarray, iterations: int = 10):
+        sample = self._split(_sample(vectors, self.k * 64))
+        n = sample.shape[1]
+        rng = np.random.default_rng(0)
+        centroids = np.zeros((self.m, self.k, sample.shape[2]), dtype=np.float32)
+        for j in range(self.m):
+            points = sample[j]
+            # 样本不足 k 个时只用前 n 个码字
+            current = points[rng.choice(n, size=min(self.k, n), replace=False)].copy()
+            for _ in range(iterations):
+                assign = self._nearest(points, current)
+                counts = np.bincount(assign, minlength=len(current))
+                sums = np.zeros_like(current)
+                np.add.at(sums, assign, points)
+                empty = counts == 0
+                current = np.where(empty[:, None], points[rng.integers(n, size=len(current))],
+                                   sums / np.maximum(counts, 1)[:, None])
+            centroids[j, :len(current)] = current
+            centroids[j, len(current):] = current[0]
+        self.centroids = centroids
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        parts = self._split(vectors)
+        codes = np.empty((parts.shape[1], self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = self._nearest(parts[j], self.centroids[j])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        codes = np.asarray(codes)
+        parts = self.centroids[np.arange(self.m), codes]  # (..., m, dim / m)
+        return parts.reshape(codes.shape[:-1] + (-1,))
+
+    def prepare(self, query: np.ndarray):
+        return np.einsum('mkd,md->mk', self.centroids, query.reshape(self.m, -1))
+
+    def scores(self, codes: np.ndarray, prepared) -> np.ndarray:
+        return prepared[np.arange(self.m), np.asarray(codes)].sum(axis=-1)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids}
+
+    def load_arrays(self, arrays: Dict[str, np.ndarray]):
+        self.centroids = arrays["centroids"]
+
+
+class PCAProjection:
+    """
+    降维：投影到样本的前 k 个主方向（不减均值，保持内积）
+
+    归一化向量投影后的内积近似原来的余弦相似度，配合精确重打分可以弥补损失。
+    """
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+        self.components = None  # (k, 原维度)
+
+    def train(self, vectors: np.ndarray):
+        sample = _sample(vectors, max(4 * self.dimensions, 4096))
+        _, _, vt = np.linalg.svd(sample, full_matrices=False)
+        components = np.zeros((self.dimensions, sample.shape[1]), dtype=np.float32)
+        # 样本数少于目标维度时，多出的方向为零
+        rank = min(self.dimensions, len(vt))
+        components[:rank] = vt[:rank]
+        self.components = components
+
+    def project(self, vectors: np.ndarray) -> np.ndarray:
+        return np.asarray(vectors, dtype=np.float32) @ self.components.T
+
+
+def create_codec(dtype: str, pq_m: int = 64) -> FloatCodec:
+    if dtype in ("float32", "float16"):
+        return FloatCodec(dtype)
+    if dtype == "int8":
+        return ScalarQuantizer()
+    if dtype == "pq":
+        return ProductQuantizer(pq_m)
+    raise ValueError(f"不支持的向量精度: {dtype}")
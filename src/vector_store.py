@@ -1,96 +1,219 @@
-from typing import List, Any
+from typing import Callable, List
 
 import numpy as np
 import json
 import os
+import shutil
+import uuid
 from pathlib import Path
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import DashScopeEmbeddings
-from langchain_core.documents import Document
-from langchain_community.llms import Tongyi
+from src.bm25_index import BM25Index
+from src.chunk_store import ChunkStore
 from src.config import Config
+from src.tracing import tracer
+from src.vector_index import VectorIndex
 
 
 class VectorStore:
-    def __init__(self, storage_path: str):
+    """
+    向量存储：原生内存映射向量索引 + BM25 倒排索引 + 列式分块存储
+
+    每次保存写入 index/ 下一个新的版本目录，再原子地更新 index/CURRENT 指向它，
+    正在被内存映射的旧版本不会被覆盖，读进程总能看到完整的一致版本。
+    版本目录中的 BUILD_ID 是每次保存随机生成的标识；删除 index/ 重建后版本号会从 1 重新计数，
+    标识则不会重复，答案缓存等依赖知识库内容的缓存应以它为准。
+    """
+
+    def __init__(self, storage_path: str, embedding_client=None, tokenizer: Callable[[str], List[str]] = None):
         self.storage_path = Path(storage_path)
         self.config = Config
-        self.faiss_store = None
-        self.texts = []
-        self.metadata = []
-        self.embeddings_model = DashScopeEmbeddings(
-            model=self.config.TEXT_EMBEDDING,
-            dashscope_api_key=self.config.DASHSCOPE_API_KEY,
-        )
-        self.llm = Tongyi(model_name=self.config.DEEPSEEK_MODEL, dashscope_api_key=self.config.DASHSCOPE_API_KEY)
+        # 由 DashScopeClient 批量并发计算向量（并共用向量缓存）
+        self.embedding_client = embedding_client
+        # BM25 使用的分词函数，通常为 TextProcessor.tokenize_for_search
+        self.tokenizer = tokenizer
+        self.index = self._new_index()
+        self.bm25 = BM25Index()
+        self.chunks = ChunkStore()
+        self.generation = 0
+        self.build_id = ""
+        self._llm = None
 
         # 确保目录存在
         self.storage_path.mkdir(parents=True, exist_ok=True)
 
+    def _new_index(self) -> VectorIndex:
+        return VectorIndex(
+            self.config.EMBEDDING_DIMENSIONS,
+            kind=self.config.VECTOR_INDEX_TYPE,
+            dtype=self.config.VECTOR_INDEX_DTYPE,
+            nlist=self.config.IVF_NLIST,
+            nprobe=self.config.IVF_NPROBE,
+            hnsw_m=self.config.HNSW_M,
+            ef_construction=self.config.HNSW_EF_CONSTRUCTION,
+            ef_search=self.config.HNSW_EF_SEARCH,
+            index_dimensions=self.config.VECTOR_INDEX_DIMENSIONS,
+            pq_m=self.config.VECTOR_PQ_M,
+            rescore=self.config.VECTOR_RESCORE,
+        )
+
+    @property
+    def index_dir(self) -> Path:
+        return self.storage_path / "index"
+
+    @property
+    def version(self) -> str:
+        """知识库版本，每次保存递增"""
+        return f"{self.generation:06d}"
+
+    @property
+    def llm(self):
+        """LangChain 通义大模型，只有多查询检索用到，第一次访问时才导入和创建"""
+        if self._llm is None:
+            from langchain_community.llms import Tongyi
+            self._llm = Tongyi(model_name=self.config.DEEPSEEK_MODEL, dashscope_api_key=self.config.DASHSCOPE_API_KEY)
+        return self._llm
+
+    def _get_embedding_client(self):
+        if self.embedding_client is None:
+            from src.dashscope_client import DashScopeClient
+            self.embedding_client = DashScopeClient(self.config.DASHSCOPE_API_KEY)
+        return self.embedding_client
+
+    def _tokenize(self, text: str) -> List[str]:
+        if self.tokenizer is None:
+            from src.text_processor import TextProcessor
+            self.tokenizer = TextProcessor().tokenize_for_search
+        return self.tokenizer(text)
+
     def load(self):
-        """加载已有的向量存储"""
-        index_path = self.storage_path / "faiss/index.faiss"
+        """加载已有的向量存储（向量以只读内存映射方式加载）"""
+        current_path = self.index_dir / "CURRENT"
+        if not current_path.exists():
+            return
+        name = current_path.read_text(encoding='utf-8').strip()
+        generation_dir = self.index_dir / name
+
+        self.index = VectorIndex.load(generation_dir)
+        # 重打分只影响检索，按当前配置而不是保存时的配置
+        self.index.rescore = self.config.VECTOR_RESCORE
+        self.chunks = ChunkStore.load(generation_dir)
+        self.bm25 = BM25Index.load(generation_dir)
+        self.generation = int(name)
+        build_id_path = generation_dir / "BUILD_ID"
+        # 早于 BUILD_ID 的版本目录没有该文件，按版本号区分（只会让旧的缓存条目失效一次）
+        self.build_id = (build_id_path.read_text(encoding='utf-8').strip() if build_id_path.exists()
+                         else f"legacy-{name}")
+
+    def save(self):
+        """保存为新的版本目录并切换 CURRENT"""
+        self.generation += 1
+        generation_dir = self.index_dir / self.version
+        if generation_dir.exists():
+            shutil.rmtree(generation_dir)
+        with tracer.span("index_save"):
+            self.index.save(generation_dir)
+            self.chunks.save(generation_dir)
+            self.bm25.save(generation_dir)
+        build_id = uuid.uuid4().hex
+        (generation_dir / "BUILD_ID").write_text(build_id, encoding='utf-8')
+
+        tmp_path = self.index_dir / "CURRENT.tmp"
+        tmp_path.write_text(self.version, encoding='utf-8')
+        os.replace(tmp_path, self.index_dir / "CURRENT")
+        self.build_id = build_id
+
+        # 清理旧版本；仍被其他进程映射的文件（Windows 上）删不掉，留到下次再清理
+        for path in self.index_dir.iterdir():
+            if path.is_dir() and path.name != self.version:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def is_empty(self) -> bool:
+        return len(self.index) == 0
+
+    def load_legacy(self):
+        """
+        读取旧版本（LangChain FAISS 存储）保存的 texts.json 和 metadata.json，返回 (文本列表, 元数据列表)，
+        没有时返回 None。旧的 faiss/ 目录不再读取：其中的向量可能来自不同的向量模型，导入时按当前模型重新计算
+        """
         texts_path = self.storage_path / "texts.json"
+        if not texts_path.exists():
+            return None
+        with open(texts_path, 'r', encoding='utf-8') as f:
+            texts = json.load(f)
+        metadata = []
         metadata_path = self.storage_path / "metadata.json"
-
-        if index_path.exists():
-            self.faiss_store = FAISS.load_local(
-                str(self.storage_path / "faiss"),
-                self.embeddings_model,
-                allow_dangerous_deserialization=True
-            )
-        if texts_path.exists():
-            with open(texts_path, 'r', encoding='utf-8') as f:
-                self.texts = json.load(f)
         if metadata_path.exists():
             with open(metadata_path, 'r', encoding='utf-8') as f:
-                self.metadata = json.load(f)
+                metadata = json.load(f)
+        if len(metadata) != len(texts):
+            metadata = [{"source": self.config.KB_SOURCE_NAME} for _ in texts]
+        return texts, metadata
 
-    def save(self):
-        """保存向量存储到FAISS"""
-        if self.faiss_store is not None:
-            self.faiss_store.save_local(str(self.storage_path / "faiss"))
-        with open(self.storage_path / "texts.json", 'w', encoding='utf-8') as f:
-            json.dump(self.texts, f, ensure_ascii=False, indent=2)
-        with open(self.storage_path / "metadata.json", 'w', encoding='utf-8') as f:
-            json.dump(self.metadata, f, ensure_ascii=False, indent=2)
-
-    def add_embeddings(self, new_texts: List[str], new_metadata: List[dict] = None):
-        """添加新的嵌入向量到FAISS"""
+    def add_embeddings(self, new_texts: List[str], new_metadata: List[dict] = None, ids: List[int] = None):
+        """计算文本向量并加入向量索引和 BM25 索引（ids 为分块ID，用于之后按页面增量删除）"""
         if new_metadata is None:
-            new_metadata = [{}] * len(new_texts)
-
-        # 创建Document对象
-        documents = [
-            Document(
-                page_content=text,
-                metadata=meta
-            )
-            for text, meta in zip(new_texts, new_metadata)
-        ]
-
-        if self.faiss_store is None:
-            # 创建新的FAISS存储
-            self.faiss_store = FAISS.from_documents(documents, self.embeddings_model)
-        else:
-            # 添加到现有存储
-            self.faiss_store.add_documents(documents)
+            new_metadata = [{} for _ in new_texts]
+        if ids is None:
+            start = int(self.index.ids.max()) + 1 if len(self.index) else 0
+            ids = list(range(start, start + len(new_texts)))
 
-    def search(self, query_embedding: np.ndarray, top_k: int = 5) -> List[dict]:
-        """使用FAISS搜索最相关的文本块"""
-        if self.faiss_store is None:
-            return []
+        vectors = self._get_embedding_client().get_embeddings(new_texts)
+        with tracer.span("indexing") as span:
+            span.batch(len(new_texts))
+            self.index.add(ids, vectors)
+            self.bm25.add(ids, [self._tokenize(text) for text in new_texts])
+            self.chunks.add(ids, new_texts, new_metadata)
+
+    def get_chunk(self, chunk_id: int):
+        """按分块ID取 (文本, 元数据)"""
+        return self.chunks.get(chunk_id)
 
-        # FAISS搜索
-        results = self.faiss_store.similarity_search_by_vector(query_embedding, k=top_k)
+    def update_metadata(self, chunk_id: int, metadata: dict):
+        """替换分块的元数据（不影响向量和 BM25 索引）"""
+        self.chunks.update_metadata(chunk_id, metadata)
+
+    def delete(self, ids: List[int]):
+        """按分块ID删除向量，不存在的ID直接忽略"""
+        self.index.remove(ids)
+        self.bm25.remove(ids)
+        self.chunks.remove(ids)
+
+    def search(self, query_embedding: np.ndarray, top_k: int = 5) -> List[dict]:
+        """搜索最相关的文本块，similarity 为余弦相似度"""
+        with tracer.span("vector_search") as span:
+            rows, scores = self.index.search(query_embedding, top_k)
+            span.add(results=len(rows))
 
         # 格式化结果
         formatted_results = []
-        for doc in results:
+        for chunk_id, score in zip(self.index.ids[rows].tolist(), scores.tolist()):
+            text, metadata = self.chunks.get(chunk_id)
             formatted_results.append({
-                "text": doc.page_content,
-                "metadata": doc.metadata,
-                "similarity": 0.0  # FAISS不直接返回相似度分数
+                "id": chunk_id,
+                "text": text,
+                "metadata": metadata,
+                "similarity": score
             })
 
-        return formatted_results
\ No newline at end of file
+        return formatted_results
+
+    def lexical_search(self, query: str, top_k: int = 5) -> List[dict]:
+        """BM25 关键词检索，不需要计算向量"""
+        results = []
+        with tracer.span("lexical_search") as span:
+            hits = self.bm25.search(self._tokenize(query), top_k)
+            span.add(results=len(hits))
+        for chunk_id, score in hits:
+            text, metadata = self.chunks.get(chunk_id)
+            results.append({
+                "id": chunk_id,
+                "text": text,
+                "metadata": metadata,
+                "bm25": score
+            })
+        return results
+
+    def as_retriever(self, k: int = 4):
+        """包装成 LangChain 检索器"""
+        from src.index_retriever import IndexRetriever
+        return IndexRetriever(vector_store=self, k=k)
+
@@ -0,0 +1,288 @@
+"""
+多进程服务模式
+
+    python -m src.server --workers 4
+
+主进程建好监听套接字后启动一个重排序服务进程和 N 个工作进程：
+    - 工作进程各自运行一份 HTTP 服务（HealthAssistantServer），共用同一个监听套接字，由操作系统分配连接；
+      向量索引、分块存储和 BM25 倒排表都以只读内存映射方式加载，N 个进程共享同一份页缓存，
+      内存不随工作进程数成倍增长。向量缓存在工作进程中只读打开，槽位分配和 index.json 只由主进程维护；
+      答案缓存按进程保存在 ANSWER_CACHE_DIR 下各自的 worker_<编号> 子目录中。
+    - 重排序模型只在重排序服务进程中加载一份。工作进程的重排序请求经本地队列发给它，
+      它把同时到达的多个进程的请求合并成一批推理，(问题, 分块ID) 分数缓存也由所有工作进程共用。
+会话和对话历史保存在各工作进程内，客户端应复用同一个 HTTP 连接（keep-alive）以留在同一个进程上；
+追踪统计（/stats、/metrics）也是按进程的。
+"""
+import asyncio
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import socket
+import threading
+from concurrent.futures import Future, TimeoutError
+from typing import Callable, List, Tuple
+
+from src.config import Config
+
+
+def _apply_overrides(overrides: dict):
+    """子进程重新导入 Config，主进程中修改过的配置项要在子进程中再设置一次"""
+    for name, value in (overrides or {}).items():
+        setattr(Config, name, value)
+
+
+def run_rerank_service(request_queue, response_queues, ready_queue, max_batch_pairs: int,
+                       overrides: dict = None, reranker_factory: Callable = None):
+    """
+    重排序服务进程：取到一个请求后，把队列里已经到达的其他请求（输入对总数不超过 max_batch_pairs）
+    一起交给 score_many 推理，再按工作进程分发结果；收到 None 时退出
+    """
+    _apply_overrides(overrides)
+    if reranker_factory is None:
+        from src.reranker import Reranker
+        reranker = Reranker.from_config(Config)
+    else:
+        reranker = reranker_factory()
+    ready_queue.put("reranker")
+
+    running = True
+    while running:
+        item = request_queue.get()
+        if item is None:
+            break
+        batch = [item]
+        pairs = sum(len(chunks) for _, chunks in item[2])
+        while pairs < max_batch_pairs:
+            try:
+                item = request_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                running = False
+                break
+            batch.append(item)
+            pairs += sum(len(chunks) for _, chunks in item[2])
+
+        requests = [request for _, _, worker_requests in batch for request in worker_requests]
+        try:
+            scores, error = reranker.score_many(requests), None
+        except Exception as e:
+            scores, error = None, f"{type(e).__name__}: {e}"
+        offset = 0
+        for worker_id, request_id, worker_requests in batch:
+            result = None if error else scores[offset:offset + len(worker_requests)]
+            response_queues[worker_id].put((request_id, result, error))
+            offset += len(worker_requests)
+
+
+class RerankServiceUnavailable(RuntimeError):
+    """重排序服务在超时时间内没有返回（进程退出或卡住），HTTP 服务据此返回 503"""
+
+
+class RemoteReranker:
+    """
+    工作进程中的重排序代理，接口与 Reranker 的 score / score_many 相同
+
+    请求带上进程编号和请求编号发到重排序服务的队列，后台线程从本进程的结果队列取回分数。
+    分块只发送 id 和 text 两个字段。超过 timeout 秒没有结果时抛出 RerankServiceUnavailable，
+    不让请求一直占着服务的并发名额。
+    """
+
+    def __init__(self, worker_id: int, request_queue, response_queue, timeout: float = None):
+        self.worker_id = worker_id
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+        self.timeout = Config.RERANK_SERVICE_TIMEOUT if timeout is None else timeout
+        self.requests = 0
+        self.pairs = 0
+        self.timeouts = 0
+        self._ids = itertools.count()
+        self._pending = {}  # 请求编号 -> Future
+        self._lock = threading.Lock()
+        self._receiver = threading.Thread(target=self._receive, name="rerank-receiver", daemon=True)
+        self._receiver.start()
+
+    def _receive(self):
+        while True:
+            request_id, scores, error = self.response_queue.get()
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if error:
+                future.set_exception(RuntimeError(f"重排序服务出错: {error}"))
+            else:
+                future.set_result(scores)
+
+    def score_many(self, requests: List[Tuple[str, List[dict]]]) -> List[List[float]]:
+        payload = [(query, [{"id": chunk["id"], "text": chunk["text"]} if "id" in chunk else {"text": chunk["text"]}
+                            for chunk in chunks]) for query, chunks in requests]
+        future = Future()
+        request_id = next(self._ids)
+        with self._lock:
+            self._pending[request_id] = future
+            self.requests += 1
+            self.pairs += sum(len(chunks) for _, chunks in requests)
+        self.request_queue.put((self.worker_id, request_id, payload))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self._pending.pop(request_id, None)
+                self.timeouts += 1
+            raise RerankServiceUnavailable(f"重排序服务 {self.timeout}s 内没有响应") from None
+
+    def score(self, query: str, chunks: List[dict]) -> List[float]:
+        return self.score_many([(query, chunks)])[0]
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "pairs": self.pairs, "timeouts": self.timeouts}
+
+
+def run_worker(worker_id: int, sock: socket.socket, request_queue, response_queue, ready_queue,
+               overrides: dict = None, rerank_batching: bool = True, trace: bool = False):
+    """工作进程：加载（内存映射）知识库，重排序改用 RemoteReranker，在共用的套接字上提供 HTTP 服务"""
+    _apply_overrides(overrides)
+    # 工作进程不加载重排序模型，OCR 相关模块也不需要提前导入
+    Config.STARTUP_LAZY = True
+    Config.STARTUP_WARMUP = False
+    # 多个进程各自分配槽位、重写 index.json 会让不同的文本占用同一个槽位
+    Config.EMBEDDING_CACHE_READ_ONLY = True
+    # 知识库由主进程在启动工作进程前构建和同步，工作进程只加载
+    Config.KB_SYNC_ON_STARTUP = False
+    if Config.ANSWER_CACHE_DIR:
+        # 答案缓存整体重写文件，各进程写各自的子目录，不会互相覆盖
+        Config.ANSWER_CACHE_DIR = os.path.join(Config.ANSWER_CACHE_DIR, f"worker_{worker_id}")
+    from aiohttp import web
+
+    from src.app import HealthAssistantApp
+    from src.server import HealthAssistantServer
+    from src.tracing import tracer
+    if trace:
+        tracer.enabled = True
+
+    assistant = HealthAssistantApp()
+    assistant.query_engine._reranker = RemoteReranker(worker_id, request_queue, response_queue)
+    # 加载分词词典，避免第一个请求承担这部分耗时
+    assistant.text_processor.tokenize_for_search("膳食指南")
+
+    async def serve():
+        server = HealthAssistantServer(assistant.query_engine, assistant.query_rewriter,
+                                       rerank_batching=rerank_batching)
+        runner = web.AppRunner(server.make_app())
+        await runner.setup()
+        await web.SockSite(runner, sock).start()
+        ready_queue.put(worker_id)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(serve())
+
+
+class WorkerPool:
+    """
+    启动和停止重排序服务进程与 N 个工作进程
+
+    参数:
+        overrides: 需要在子进程中生效的 Config 修改（子进程以 spawn 方式启动，不继承主进程中的修改）
+        reranker_factory: 在重排序服务进程中创建重排序器的可序列化函数，默认按 Config 加载 BGE 模型
+    """
+
+    def __init__(self, workers: int, host: str = None, port: int = None, rerank_batching: bool = True,
+                 trace: bool = False, overrides: dict = None, reranker_factory: Callable = None):
+        self.workers = workers
+        self.host = host or Config.SERVER_HOST
+        self.port = Config.SERVER_PORT if port is None else port
+        self.rerank_batching = rerank_batching
+        self.trace = trace
+        self.overrides = overrides or {}
+        self.reranker_factory = reranker_factory
+        self.sock = None
+        self.service = None
+        self.processes = []
+
+    @property
+    def pids(self) -> List[int]:
+        return [process.pid for process in [self.service] + self.processes if process is not None]
+
+    def _prepare_knowledge_base(self):
+        """
+        知识库为空、上次构建中断或开启了 KB_SYNC_ON_STARTUP 时先在主进程中构建（同步），
+        避免多个工作进程同时写同一个索引版本、构建清单和检查点
+        """
+        from src.kb_builder import KnowledgeBaseBuilder
+        from src.vector_store import VectorStore
+
+        store = VectorStore(Config.KNOWLEDGE_BASE_DIR)
+        store.load()
+        if KnowledgeBaseBuilder(None, None, store).needs_build() or Config.KB_SYNC_ON_STARTUP:
+            from src.app import HealthAssistantApp
+            warmup = Config.STARTUP_WARMUP
+            Config.STARTUP_WARMUP = False
+            try:
+                HealthAssistantApp()
+            finally:
+                Config.STARTUP_WARMUP = warmup
+
+    def start(self, timeout: float = 300):
+        """构建（如有必要）知识库，启动全部子进程并等待它们就绪，返回实际监听的端口"""
+        self._prepare_knowledge_base()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(1024)
+        self.port = self.sock.getsockname()[1]
+
+        context = multiprocessing.get_context("spawn")
+        request_queue = context.Queue()
+        response_queues = [context.Queue() for _ in range(self.workers)]
+        ready_queue = context.Queue()
+        self.service = context.Process(
+            target=run_rerank_service, name="rerank-service", daemon=True,
+            args=(request_queue, response_queues, ready_queue, Config.RERANK_BATCH_MAX_PAIRS,
+                  self.overrides, self.reranker_factory))
+        self.service.start()
+        for worker_id in range(self.workers):
+            process = context.Process(
+                target=run_worker, name=f"worker-{worker_id}", daemon=True,
+                args=(worker_id, self.sock, request_queue, response_queues[worker_id], ready_queue,
+                      self.overrides, self.rerank_batching, self.trace))
+            process.start()
+            self.processes.append(process)
+
+        for _ in range(self.workers + 1):
+            try:
+                ready_queue.get(timeout=timeout)
+            except queue.Empty:
+                self.stop()
+                raise RuntimeError("工作进程启动超时")
+        print(f"已启动 {self.workers} 个工作进程和 1 个重排序服务进程，监听 {self.host}:{self.port}")
+        return self.port
+
+    def stop(self):
+        for process in self.processes + [self.service]:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes + [self.service]:
+            if process is not None:
+                process.join(timeout=10)
+        self.processes = []
+        self.service = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def run(self):
+        """启动并阻塞，直到任一子进程退出或按 Ctrl+C"""
+        self.start()
+        try:
+            multiprocessing.connection.wait([process.sentinel for process in [self.service] + self.processes])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
@@ -0,0 +1,116 @@
+import shutil
+
+import numpy as np
+
+from src.answer_cache import AnswerCache
+from src.config import Config
+from src.query_processor import QueryEngine
+from src.vector_store import VectorStore
+
+
+def unit(*values):
+    return np.array(values, dtype=np.float32)
+
+
+def test_lookup_hits_only_above_the_threshold():
+    cache = AnswerCache(threshold=0.95)
+    cache.put("成年人每天吃多少盐", unit(1, 0, 0), "不超过5克", [], "build-a")
+
+    hit = cache.lookup(unit(0.99, 0.05, 0), "build-a")
+    assert hit["answer"] == "不超过5克" and hit["similarity"] >= 0.95
+    assert cache.lookup(unit(0, 1, 0), "build-a") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_new_kb_version_invalidates_entries():
+    cache = AnswerCache()
+    cache.put("问题", unit(1, 0), "回答", [], "build-a")
+    assert cache.lookup(unit(1, 0), "build-b") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_persisted_entries_survive_reopen_for_the_same_build_only(tmp_path):
+    cache = AnswerCache(cache_dir=tmp_path)
+    cache.put("问题", unit(1, 0), "回答", [{"text": "来源"}], "build-a")
+    cache.flush()
+
+    assert AnswerCache(cache_dir=tmp_path).lookup(unit(1, 0), "build-a")["sources"] == [{"text": "来源"}]
+    assert AnswerCache(cache_dir=tmp_path).lookup(unit(1, 0), "build-b") is None
+
+
+def test_clear_and_discard_remove_persisted_answers(tmp_path):
+    cache = AnswerCache(cache_dir=tmp_path)
+    cache.put("问题", unit(1, 0), "回答", [], "build-a")
+    cache.clear()
+    assert AnswerCache(cache_dir=tmp_path).lookup(unit(1, 0), "build-a") is None
+
+    for directory in (tmp_path, tmp_path / "worker_0", tmp_path / "worker_1"):
+        worker_cache = AnswerCache(cache_dir=directory)
+        worker_cache.put("问题", unit(1, 0), "回答", [], "build-a")
+        worker_cache.flush()
+    AnswerCache.discard(tmp_path)
+    assert not list(tmp_path.rglob("answers.json"))
+    assert not list(tmp_path.rglob("embeddings.npy"))
+
+
+def test_rebuilt_store_gets_a_new_build_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "EMBEDDING_DIMENSIONS", 4)
+    store = VectorStore(tmp_path, tokenizer=str.split)
+    store.save()
+    first = store.build_id
+
+    reopened = VectorStore(tmp_path, tokenizer=str.split)
+    reopened.load()
+    assert reopened.build_id == first
+
+    # 删除 index/ 重建后版本号从头计数，但 BUILD_ID 不会重复
+    shutil.rmtree(tmp_path / "index")
+    rebuilt = VectorStore(tmp_path, tokenizer=str.split)
+    rebuilt.save()
+    assert rebuilt.version == reopened.version
+    assert rebuilt.build_id != first
+
+
+class CountingClient:
+    """DashScopeClient 的替身：记录向量化调用次数，回答固定"""
+
+    GENERATION_ERROR_PREFIX = "抱歉，生成回答时出错"
+
+    def __init__(self):
+        self.embedded = []
+        self.generated = 0
+
+    def get_embeddings(self, texts):
+        self.embedded.extend(texts)
+        return np.ones((len(texts), Config.EMBEDDING_DIMENSIONS), dtype=np.float32)
+
+    def generate_response(self, question, context):
+        self.generated += 1
+        return "每天不超过5克"
+
+
+class LengthReranker:
+    def score(self, query, chunks):
+        return [float(len(chunk["text"])) for chunk in chunks]
+
+
+def test_lexical_queries_never_compute_embeddings(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "EMBEDDING_DIMENSIONS", 4)
+    monkeypatch.setattr(Config, "ANSWER_CACHE_DIR", "")
+    monkeypatch.setattr(Config, "TABLE_INDEX_PATH", str(tmp_path / "tables.json"))
+    store = VectorStore(tmp_path, CountingClient(), tokenizer=str.split)
+    store.add_embeddings(["盐 每天 5克", "油 每天 25克"], [{"page": 1}, {"page": 2}])
+
+    client = CountingClient()
+    engine = QueryEngine(client, store)
+    engine._reranker = LengthReranker()
+    for _ in range(2):
+        assert engine.query("盐 每天", mode="lexical")[0] == "每天不超过5克"
+    monkeypatch.setattr(Config, "RETRIEVAL_MODE", "lexical")
+    engine.query("盐 每天")
+    assert client.embedded == [] and client.generated == 3
+
+    # 其他模式照常使用语义缓存
+    engine.query("盐 每天", mode="dense")
+    engine.query("盐 每天", mode="dense")
+    assert client.generated == 4 and engine.answer_cache.stats()["hits"] == 1
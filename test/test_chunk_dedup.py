@@ -0,0 +1,36 @@
+import pytest
+
+from src.chunk_dedup import MinHashDeduplicator
+
+FOOTER = "中国居民膳食指南（2022）人民卫生出版社 第三部分 平衡膳食模式和膳食指南编写说明 膳食宝塔"
+PARAGRAPH = ("食物多样是平衡膳食模式的基本原则。每天的膳食应包括谷薯类、蔬菜水果、畜禽鱼蛋奶和豆类食物，"
+             "平均每天摄入12种以上食物，每周25种以上，合理搭配。")
+
+
+def test_identical_and_near_identical_chunks_are_found():
+    dedup = MinHashDeduplicator()
+    dedup.add(7, FOOTER)
+    assert dedup.find(FOOTER) == 7
+    # 只有空白和页码不同的页脚
+    assert dedup.find(FOOTER.replace(" ", "\n") + " 12") == 7
+
+
+def test_unrelated_chunks_are_not_merged():
+    dedup = MinHashDeduplicator()
+    dedup.add(1, FOOTER)
+    assert dedup.find(PARAGRAPH) is None
+    # 只共享一半内容，低于阈值
+    assert dedup.find(PARAGRAPH + FOOTER[:len(FOOTER) // 2]) is None
+
+
+def test_best_match_wins_among_candidates():
+    dedup = MinHashDeduplicator(threshold=0.5)
+    dedup.add(1, PARAGRAPH[:40])
+    dedup.add(2, PARAGRAPH)
+    assert dedup.find(PARAGRAPH + "。") == 2
+    assert len(dedup) == 2
+
+
+def test_bands_must_divide_permutations():
+    with pytest.raises(ValueError):
+        MinHashDeduplicator(num_perm=64, bands=10)
@@ -0,0 +1,56 @@
+import numpy as np
+
+from src.embedding_cache import EmbeddingCache
+
+
+def vectors_for(texts, dimensions=4):
+    return np.array([[float(i)] * dimensions for i, _ in enumerate(texts, start=1)], dtype=np.float32)
+
+
+def test_reopen_returns_the_stored_vectors(tmp_path):
+    texts = ["apple", "banana", "cherry"]
+    cache = EmbeddingCache(tmp_path, 4)
+    cache.put_many("m", texts, vectors_for(texts))
+    cache.flush()
+
+    reopened = EmbeddingCache(tmp_path, 4)
+    vectors, missing = reopened.get_many("m", ["banana", "apple", "durian"])
+    assert missing == [2]
+    np.testing.assert_array_equal(vectors[:2], vectors_for(texts)[[1, 0]])
+
+
+def test_key_normalizes_width_and_whitespace(tmp_path):
+    cache = EmbeddingCache(tmp_path, 4)
+    cache.put_many("m", ["ＡＢＣ  膳食"], vectors_for(["x"]))
+    _, missing = cache.get_many("m", ["ABC 膳食"])
+    assert missing == []
+    # 模型不同的键互不命中
+    _, missing = cache.get_many("other", ["ABC 膳食"])
+    assert missing == [0]
+
+
+def test_eviction_keeps_the_on_disk_index_consistent(tmp_path):
+    texts = [f"text-{i}" for i in range(EmbeddingCache.INITIAL_CAPACITY)]
+    expected = vectors_for(texts)
+    cache = EmbeddingCache(tmp_path, 4, max_entries=len(texts))
+    cache.put_many("m", texts, expected)
+    cache.flush()
+
+    # 写满后再写入会淘汰最久未使用的条目并复用它们的槽位；不再 flush，模拟随后崩溃
+    cache.put_many("m", ["new"], np.full((1, 4), -1, dtype=np.float32))
+    assert cache.evictions > 0
+
+    reopened = EmbeddingCache(tmp_path, 4, max_entries=len(texts))
+    vectors, missing = reopened.get_many("m", texts)
+    assert missing
+    hits = [i for i in range(len(texts)) if i not in set(missing)]
+    np.testing.assert_array_equal(vectors[hits], expected[hits])
+
+
+def test_dimension_change_discards_old_vectors(tmp_path):
+    cache = EmbeddingCache(tmp_path, 4)
+    cache.put_many("m", ["apple"], vectors_for(["apple"]))
+    cache.flush()
+
+    _, missing = EmbeddingCache(tmp_path, 8).get_many("m", ["apple"])
+    assert missing == [0]
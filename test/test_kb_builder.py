@@ -0,0 +1,162 @@
+import json
+import zlib
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.config import Config
+from src.kb_builder import KnowledgeBaseBuilder
+from src.text_processor import TextProcessor
+from src.vector_store import VectorStore
+
+
+class HashedEmbeddings:
+    """按字符二元组哈希出的确定性向量，代替 DashScope 向量化接口"""
+
+    def __init__(self):
+        self.texts = 0
+
+    def get_embeddings(self, texts):
+        self.texts += len(texts)
+        vectors = np.zeros((len(texts), Config.EMBEDDING_DIMENSIONS), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for i in range(len(text) - 1):
+                vectors[row, zlib.crc32(text[i:i + 2].encode('utf-8')) % Config.EMBEDDING_DIMENSIONS] += 1
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-6)
+
+
+class TextPages:
+    """PDFProcessor 的替身：page_N.txt 的内容就是第 N 页的 OCR 结果，并记下识别过哪些页面"""
+
+    def __init__(self):
+        self.processed = []
+
+    def list_images(self, img_dir):
+        return sorted((int(path.stem.split("_")[1]), path.name) for path in Path(img_dir).glob("page_*.txt"))
+
+    def iter_images_text(self, img_dir, filenames=None):
+        for page_number, name in self.list_images(img_dir):
+            if filenames is None or name in filenames:
+                self.processed.append(name)
+                yield page_number, name, (Path(img_dir) / name).read_text(encoding='utf-8')
+
+
+def page_text(topic: str) -> str:
+    return "".join(f"{topic}第{i}条建议：每天摄入适量的{topic}，保持膳食平衡。" for i in range(12))
+
+
+@pytest.fixture
+def kb(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "KNOWLEDGE_BASE_DIR", str(tmp_path / "kb"))
+    monkeypatch.setattr(Config, "DEDUP_ENABLED", False)
+    monkeypatch.setattr(Config, "TEXT_PROCESS_WORKERS", 0)
+    pages = tmp_path / "images"
+    pages.mkdir()
+    text_processor = TextProcessor()
+
+    def builder():
+        store = VectorStore(Config.KNOWLEDGE_BASE_DIR, HashedEmbeddings(), tokenizer=str.split)
+        store.load()
+        return KnowledgeBaseBuilder(TextPages(), text_processor, store)
+
+    return pages, builder
+
+
+def write_pages(pages, topics):
+    for page_number, topic in topics.items():
+        (pages / f"page_{page_number}.txt").write_text(page_text(topic), encoding='utf-8')
+
+
+def test_incremental_build_only_processes_changed_pages(kb):
+    pages, builder = kb
+    write_pages(pages, {1: "蔬菜", 2: "水果", 3: "奶类"})
+    first = builder()
+    stats = first.build(str(pages))
+    assert stats["mode"] == "full" and stats["pages_processed"] == 3
+    old_ids = {key: record["chunk_ids"] for key, record in first.manifest.pages.items()}
+
+    # 修改第 2 页、删除第 3 页、新增第 4 页
+    write_pages(pages, {2: "全谷物", 4: "大豆"})
+    (pages / "page_3.txt").unlink()
+    second = builder()
+    stats = second.build(str(pages))
+
+    assert stats["mode"] == "incremental"
+    assert sorted(second.pdf_processor.processed) == ["page_2.txt", "page_4.txt"]
+    assert stats["pages_processed"] == 2 and stats["pages_removed"] == 1
+    assert sorted(second.manifest.pages) == ["page_1.txt", "page_2.txt", "page_4.txt"]
+    assert second.manifest.pages["page_1.txt"]["chunk_ids"] == old_ids["page_1.txt"]
+    store = second.vector_store
+    for chunk_id in old_ids["page_2.txt"] + old_ids["page_3.txt"]:
+        assert chunk_id not in store.chunks
+    assert "全谷物" in store.get_chunk(second.manifest.pages["page_2.txt"]["chunk_ids"][0])[0]
+
+
+def test_unchanged_source_needs_no_work(kb):
+    pages, builder = kb
+    write_pages(pages, {1: "蔬菜", 2: "水果"})
+    builder().build(str(pages))
+
+    again = builder()
+    assert not again.needs_build()
+    stats = again.build(str(pages))
+    assert stats["pages_processed"] == 0 and stats["chunks_added"] == 0
+    assert again.pdf_processor.processed == []
+
+
+def test_removing_pages_without_new_work_is_persisted(kb):
+    pages, builder = kb
+    write_pages(pages, {1: "蔬菜", 2: "水果"})
+    first = builder()
+    first.build(str(pages))
+    removed_ids = first.manifest.pages["page_2.txt"]["chunk_ids"]
+
+    (pages / "page_2.txt").unlink()
+    stats = builder().build(str(pages))
+    assert stats["pages_processed"] == 0 and stats["pages_removed"] == 1
+
+    reopened = builder()
+    assert list(reopened.manifest.pages) == ["page_1.txt"]
+    for chunk_id in removed_ids:
+        assert chunk_id not in reopened.vector_store.chunks
+    assert len(reopened.vector_store.index) == len(reopened.manifest.pages["page_1.txt"]["chunk_ids"])
+
+
+def test_legacy_files_are_imported_once_and_replaced_by_a_build(kb):
+    pages, builder = kb
+    kb_dir = Path(Config.KNOWLEDGE_BASE_DIR)
+    kb_dir.mkdir(parents=True)
+    legacy_texts = [page_text("蔬菜"), page_text("水果")]
+    (kb_dir / "texts.json").write_text(json.dumps(legacy_texts, ensure_ascii=False), encoding='utf-8')
+    (kb_dir / "metadata.json").write_text(json.dumps([{"source": "旧版", "page": 1}] * 2), encoding='utf-8')
+
+    first = builder()
+    assert first.import_legacy() == 2
+    assert not first.needs_build()
+    assert first.import_legacy() == 0
+
+    reopened = builder()
+    assert reopened.import_legacy() == 0
+    legacy_ids = reopened.manifest.pages[KnowledgeBaseBuilder.LEGACY_PAGE_KEY]["chunk_ids"]
+    assert [reopened.vector_store.get_chunk(chunk_id)[0] for chunk_id in legacy_ids] == legacy_texts
+
+    # 之后的同步构建把导入的分块当作已删除的页面整体替换掉
+    write_pages(pages, {1: "奶类"})
+    reopened.build(str(pages))
+    assert list(reopened.manifest.pages) == ["page_1.txt"]
+    for chunk_id in legacy_ids:
+        assert chunk_id not in reopened.vector_store.chunks
+
+
+def test_chunk_metadata_carries_page_and_offsets(kb):
+    pages, builder = kb
+    write_pages(pages, {7: "蔬菜"})
+    built = builder()
+    built.build(str(pages))
+
+    raw = (pages / "page_7.txt").read_text(encoding='utf-8')
+    for chunk_id in built.manifest.pages["page_7.txt"]["chunk_ids"]:
+        text, metadata = built.vector_store.get_chunk(chunk_id)
+        assert metadata["page"] == 7
+        assert raw[metadata["char_start"]:metadata["char_end"]] == text
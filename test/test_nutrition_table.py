@@ -0,0 +1,65 @@
+import pytest
+
+from src.nutrition_table import NutritionTableIndex
+
+CALCIUM = [
+    ["人群", "钙（mg/d）", None, None],
+    [None, "EAR", "RNI", "UL"],
+    ["18~49岁", "650", "800", "2000"],
+    ["50~64岁", "650", "800", "2000"],
+    ["65岁~", "650", "800", "2000"],
+    ["孕中期", "810", "1000", "2000"],
+    ["11~13岁", "1000", "1200", "2000"],
+]
+FOODS = [
+    ["食物类别", "推荐摄入量（g/d）"],
+    ["蔬菜", "300~500"],
+    ["水果", "200~350"],
+    ["盐", "<5"],
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return NutritionTableIndex.from_tables([(12, CALCIUM), (30, FOODS)], source_hash="abc")
+
+
+def summary(entries):
+    return [(entry["population_label"], entry["metric"], entry["value"], entry["unit"]) for entry in entries]
+
+
+def test_adult_question_defaults_to_the_recommended_intake(index):
+    assert summary(index.lookup("成年人每天需要多少钙")) == [
+        ("18~49岁", "RNI", "800", "mg/d"), ("50~64岁", "RNI", "800", "mg/d")]
+
+
+def test_upper_limit_question_uses_ul(index):
+    assert {entry["metric"] for entry in index.lookup("钙的摄入上限是多少")} == {"UL"}
+
+
+def test_population_and_age_select_rows(index):
+    assert summary(index.lookup("孕妇每天钙的推荐量是多少")) == [("孕中期", "RNI", "1000", "mg/d")]
+    assert summary(index.lookup("12岁孩子每天需要多少钙")) == [("11~13岁", "RNI", "1200", "mg/d")]
+
+
+def test_food_tables_without_populations(index):
+    entries = index.lookup("每天吃多少蔬菜")
+    assert summary(entries) == [("", "推荐量", "300~500", "g/d")]
+    assert entries[0]["page"] == 30
+
+
+@pytest.mark.parametrize("question", ["为什么要补钙", "成年人每天摄入多少铁", "钙和铁哪个更重要"])
+def test_non_lookup_or_unknown_questions_fall_back(index, question):
+    assert index.lookup(question) == []
+
+
+def test_answer_cites_the_page_and_survives_save_and_load(index, tmp_path):
+    answer, sources = index.answer("成年人每天需要多少钙", "中国居民膳食指南（2022）")
+    assert "第 12 页" in answer and "800 mg/d" in answer
+    assert sources[0]["metadata"]["page"] == 12
+
+    path = tmp_path / "tables.json"
+    index.save(str(path))
+    loaded = NutritionTableIndex.load(str(path))
+    assert loaded.source_hash == "abc"
+    assert summary(loaded.lookup("成年人每天需要多少钙")) == summary(index.lookup("成年人每天需要多少钙"))
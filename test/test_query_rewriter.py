@@ -0,0 +1,65 @@
+import asyncio
+
+import numpy as np
+
+from src.config import Config
+from src.query_processor import QueryEngine
+from src.query_rewriter_processor import QueryRewriter
+from src.vector_store import VectorStore
+
+HISTORY = [{"role": "user", "content": "成年人每天应该吃多少盐？"}, {"role": "assistant", "content": "不超过5克。"}]
+
+
+class StubClient:
+    GENERATION_ERROR_PREFIX = "抱歉，生成回答时出错"
+
+    def __init__(self):
+        self.prompts = []
+
+    def get_completion(self, prompt):
+        self.prompts.append(prompt)
+        return "儿童每天应该吃多少盐？"
+
+    def get_embeddings(self, texts):
+        return np.ones((len(texts), Config.EMBEDDING_DIMENSIONS), dtype=np.float32)
+
+    def generate_response(self, question, context):
+        return "回答"
+
+
+class FlatReranker:
+    def score(self, query, chunks):
+        return [1.0] * len(chunks)
+
+
+def test_self_contained_questions_are_counted_as_skipped():
+    client = StubClient()
+    rewriter = QueryRewriter(client)
+    question = "成年人每天应该喝多少毫升水？"
+    assert not rewriter.should_rewrite(question, HISTORY)
+    assert rewriter.rewrite_context_dependent_query(question, HISTORY) == question
+    assert rewriter.skipped == 2 and client.prompts == []
+
+    assert rewriter.rewrite_context_dependent_query("那儿童呢？", HISTORY) == "儿童每天应该吃多少盐？"
+    assert rewriter.skipped == 2 and len(client.prompts) == 1
+
+
+def test_async_query_leaves_skip_counting_to_the_rewriter(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "EMBEDDING_DIMENSIONS", 4)
+    monkeypatch.setattr(Config, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(Config, "TABLE_INDEX_PATH", str(tmp_path / "tables.json"))
+    monkeypatch.setattr(Config, "ADAPTIVE_RETRIEVAL_ENABLED", False)
+    client = StubClient()
+    store = VectorStore(tmp_path, client, tokenizer=list)
+    store.add_embeddings(["每天吃盐不超过5克", "每天喝水1500毫升"])
+    engine = QueryEngine(client, store)
+    engine._reranker = FlatReranker()
+    rewriter = QueryRewriter(client)
+
+    async def ask(question):
+        return await engine.aquery(question, HISTORY, rewriter, mode="lexical")
+
+    assert asyncio.run(ask("成年人每天应该喝多少毫升水？"))[0] == "成年人每天应该喝多少毫升水？"
+    assert rewriter.skipped == 1 and client.prompts == []
+    assert asyncio.run(ask("那儿童呢？"))[0] == "儿童每天应该吃多少盐？"
+    assert rewriter.skipped == 1 and len(client.prompts) == 1
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+
+from src.rerank_batcher import RerankBatcher
+
+
+class RecordingScorer:
+    """按 (查询, 分块文本) 算出可区分的分数，并记下每次调用合并了哪些请求"""
+
+    def __init__(self, fail: bool = False):
+        self.calls = []
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def __call__(self, requests):
+        with self.lock:
+            self.calls.append([query for query, _ in requests])
+        if self.fail:
+            raise RuntimeError("模型推理失败")
+        return [[float(len(query) * 100 + len(chunk["text"])) for chunk in chunks] for query, chunks in requests]
+
+
+def chunks(*texts):
+    return [{"id": i, "text": text} for i, text in enumerate(texts)]
+
+
+def test_concurrent_requests_share_a_batch_and_get_their_own_scores():
+    scorer = RecordingScorer()
+
+    async def run():
+        batcher = RerankBatcher(scorer, max_batch_pairs=64, max_wait=0.05)
+        results = await asyncio.gather(
+            batcher.score("a", chunks("x", "xx")),
+            batcher.score("bb", chunks("xxx")),
+            batcher.score("ccc", chunks("x", "x", "xxxx")),
+        )
+        await batcher.close()
+        return results, batcher.stats()
+
+    results, stats = asyncio.run(run())
+    assert results == [[101.0, 102.0], [203.0], [301.0, 301.0, 304.0]]
+    assert scorer.calls == [["a", "bb", "ccc"]]
+    assert stats["batches"] == 1 and stats["requests"] == 3 and stats["pairs"] == 6
+
+
+def test_batches_are_split_at_max_pairs():
+    scorer = RecordingScorer()
+
+    async def run():
+        batcher = RerankBatcher(scorer, max_batch_pairs=3, max_wait=0.05)
+        await asyncio.gather(*(batcher.score(f"q{i}", chunks("x", "y")) for i in range(4)))
+        await batcher.close()
+
+    asyncio.run(run())
+    assert [len(call) for call in scorer.calls] == [2, 2]
+
+
+def test_scoring_errors_reach_every_request_and_the_batcher_recovers():
+    scorer = RecordingScorer(fail=True)
+
+    async def run():
+        batcher = RerankBatcher(scorer, max_wait=0.01)
+        results = await asyncio.gather(batcher.score("a", chunks("x")), batcher.score("b", chunks("y")),
+                                       return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        scorer.fail = False
+        recovered = await batcher.score("c", chunks("z"))
+        await batcher.close()
+        return recovered
+
+    assert asyncio.run(run()) == [101.0]
+
+
+def test_empty_candidate_list_skips_the_model():
+    scorer = RecordingScorer()
+    assert asyncio.run(RerankBatcher(scorer).score("a", [])) == []
+    assert scorer.calls == []
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from src.conversation_memory import ConversationMemory
+from src.dashscope_client import StreamingResponse
+from src.server import HealthAssistantServer
+
+
+class StubEngine:
+    """只实现服务用到的接口：回答是一段慢慢生成的流，记录上游生成器是否被关闭"""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(4)
+        self.answer_cache = None
+        self.rerank_batcher = None
+        self.client = None
+        self.upstream_closed = threading.Event()
+        self.calls = []
+
+    def enable_rerank_batching(self):
+        pass
+
+    def _deltas(self):
+        try:
+            for i in range(1000):
+                time.sleep(0.01)
+                yield f"片段{i}"
+        finally:
+            self.upstream_closed.set()
+
+    async def aquery_stream(self, question, memory, rewriter, top_k, rerank_top_n, mode):
+        self.calls.append((question, top_k, rerank_top_n, mode))
+        return question, StreamingResponse(self._deltas()), []
+
+
+def run_with_client(engine, scenario):
+    async def run():
+        server = HealthAssistantServer(engine, rerank_batching=False)
+        server.config.MEMORY_LLM_SUMMARY = False
+        async with TestClient(TestServer(server.make_app())) as client:
+            return await scenario(client)
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("body", [
+    [1, 2],
+    {"question": 5},
+    {"question": "  "},
+    {"question": "吃多少盐", "top_k": "abc"},
+    {"question": "吃多少盐", "top_k": 0},
+    {"question": "吃多少盐", "rerank_top_n": 10000},
+    {"question": "吃多少盐", "top_k": True},
+    {"question": "吃多少盐", "mode": "fuzzy"},
+    {"question": "吃多少盐", "session_id": 3},
+])
+def test_invalid_requests_get_400(body):
+    engine = StubEngine()
+
+    async def scenario(client):
+        response = await client.post("/query", json=body)
+        return response.status
+
+    assert run_with_client(engine, scenario) == 400
+    assert engine.calls == []
+
+
+def test_numeric_strings_are_accepted():
+    engine = StubEngine()
+    engine._deltas = lambda: iter(["少于5克"])
+
+    async def scenario(client):
+        response = await client.post("/query", json={"question": "吃多少盐", "top_k": "4", "mode": "lexical"})
+        return response.status, await response.json()
+
+    status, body = run_with_client(engine, scenario)
+    assert status == 200 and body["answer"] == "少于5克"
+    assert engine.calls == [("吃多少盐", 4, 10, "lexical")]
+
+
+def test_client_disconnect_closes_the_upstream_stream():
+    engine = StubEngine()
+
+    async def scenario(client):
+        response = await client.post("/query", json={"question": "吃多少盐", "stream": True})
+        first = await response.content.readline()
+        response.close()
+        # 等服务端发现连接已断开
+        for _ in range(100):
+            if engine.upstream_closed.is_set():
+                break
+            await asyncio.sleep(0.05)
+        return first
+
+    assert b"delta" in run_with_client(engine, scenario)
+    assert engine.upstream_closed.is_set()
@@ -0,0 +1,73 @@
+import random
+import re
+
+import pytest
+
+from src.text_processor import _NOISE, TextProcessor, chunk_page, clean_with_offsets, split_spans
+
+PAGE = ("  ★中国居民膳食指南（2022）★\n\n第一章   食物多样，合理搭配。每天的膳食应包括谷薯类、蔬菜水果、"
+        "畜禽鱼蛋奶和豆类食物!!  平均每天摄入12种以上食物，每周25种以上；\t谷类为主是平衡膳食模式的重要特征。"
+        "-- 成年人每天摄入谷类200～300g，其中全谷物和杂豆类50～150g？  薯类50～100g。 ") * 6
+
+
+def legacy_clean(text):
+    """优化前的两次正则清洗"""
+    text = re.sub(r'[^一-龥，。；：？！、（）【】《》“”‘’\s\w]', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def random_text(rng, length):
+    alphabet = "营养膳食蛋白质ab12 ，。；！？、\n\t  -*#★～（）"
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def test_clean_matches_reference_and_legacy_regexes():
+    rng = random.Random(0)
+    samples = [PAGE, "", "   ", "★★维生素", "钙。  ", " a  b "] + [random_text(rng, rng.randint(1, 80)) for _ in range(300)]
+    for text in samples:
+        cleaned, _ = clean_with_offsets(text)
+        assert cleaned == _NOISE.sub(' ', text).strip() == legacy_clean(text)
+
+
+def test_offsets_map_chunks_back_to_raw_text():
+    rng = random.Random(1)
+    for text in [PAGE] + [random_text(rng, 300) for _ in range(50)]:
+        cleaned, _ = clean_with_offsets(text)
+        chunks = chunk_page(text, 80, 20)
+        assert [chunk for chunk, _, _ in chunks] == [cleaned[s:e] for s, e in split_spans(cleaned, 80, 20)]
+        for chunk, start, end in chunks:
+            # 原文片段重新清洗后应得到分块文本（分块首尾的空格对应原文中的噪声片段）
+            assert clean_with_offsets(text[start:end])[0] == chunk.strip()
+
+
+def test_split_spans_cuts_after_sentence_end_in_second_half():
+    text = "甲" * 30 + "。" + "乙" * 10 + "！" + "丙" * 100
+    spans = split_spans(text, 50, 10)
+    assert spans[0] == (0, 42)
+    assert all(end - start <= 50 for start, end in spans)
+    assert spans[1][0] == 32
+    assert spans[-1][1] == len(text)
+    # 句号只出现在前半段时按长度硬切
+    assert split_spans("甲" * 10 + "。" + "乙" * 100, 50, 0)[0] == (0, 50)
+
+
+def test_split_spans_overlap_and_short_text():
+    assert split_spans("", 50, 10) == []
+    assert split_spans("短文本", 50, 10) == [(0, 3)]
+    spans = split_spans("字" * 250, 100, 30)
+    assert spans == [(0, 100), (70, 170), (140, 240), (210, 250)]
+
+
+def test_chunk_text_uses_split_spans():
+    processor = TextProcessor()
+    assert processor.chunk_text(PAGE, 120, 30) == [PAGE[s:e] for s, e in split_spans(PAGE, 120, 30)]
+
+
+@pytest.mark.parametrize("pages_per_task", [1, 3])
+def test_iter_page_chunks_with_workers_matches_inline(pages_per_task):
+    processor = TextProcessor()
+    pages = [(i, f"page_{i}.png", PAGE[i * 7:]) for i in range(1, 8)]
+    inline = list(processor.iter_page_chunks(iter(pages), 120, 30))
+    pooled = list(processor.iter_page_chunks(iter(pages), 120, 30, workers=2, pages_per_task=pages_per_task))
+    assert pooled == inline
+    assert [page_number for page_number, _, _ in inline] == list(range(1, 8))
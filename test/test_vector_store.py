@@ -0,0 +1,37 @@
+import numpy as np
+
+from src.config import Config
+from src.vector_store import VectorStore
+
+
+class OneHotEmbeddings:
+    def get_embeddings(self, texts):
+        vectors = np.zeros((len(texts), Config.EMBEDDING_DIMENSIONS), dtype=np.float32)
+        for row, text in enumerate(texts):
+            vectors[row, len(text) % Config.EMBEDDING_DIMENSIONS] = 1
+        return vectors
+
+
+def test_checkpoints_keep_only_unsaved_changes_in_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "EMBEDDING_DIMENSIONS", 8)
+    store = VectorStore(tmp_path, OneHotEmbeddings(), tokenizer=str.split)
+    store.add_embeddings(["盐 5克", "油 25克", "糖 50克"], [{"page": 1}, {"page": 2}, {"page": 3}], ids=[0, 1, 2])
+    store.save()
+    assert not store.chunks._pending and not store.bm25._pending
+
+    # 下一个检查点：删除、修改已保存的分块并新增分块
+    store.delete([1])
+    store.update_metadata(0, {"page": 1, "pages": [1, 4]})
+    store.add_embeddings(["奶 300克"], [{"page": 4}], ids=[3])
+    store.save()
+    assert not store.chunks._pending and not store.chunks._removed and not store.chunks._overrides
+    assert not store.bm25._pending and not store.bm25._removed
+
+    reopened = VectorStore(tmp_path, OneHotEmbeddings(), tokenizer=str.split)
+    reopened.load()
+    for reader in (store, reopened):
+        assert reader.chunks.ids() == [0, 2, 3]
+        assert reader.get_chunk(0) == ("盐 5克", {"page": 1, "pages": [1, 4]})
+        assert reader.get_chunk(3)[0] == "奶 300克"
+        assert [doc_id for doc_id, _ in reader.bm25.search(["油"])] == []
+        assert [doc_id for doc_id, _ in reader.bm25.search(["奶"])] == [3]
@@ -0,0 +1,93 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from src.embedding_cache import EmbeddingCache
+from src.worker_pool import RemoteReranker, RerankServiceUnavailable, run_rerank_service
+
+
+class LengthReranker:
+    """分数为 查询长度*100 + 分块长度，记下每次推理合并了多少个请求"""
+
+    def __init__(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def score_many(self, requests):
+        self.release.wait()
+        self.batches.append(len(requests))
+        if any(query == "boom" for query, _ in requests):
+            raise ValueError("bad input")
+        return [[float(len(query) * 100 + len(chunk["text"])) for chunk in chunks] for query, chunks in requests]
+
+
+@pytest.fixture
+def service():
+    """在线程中运行重排序服务（与子进程中的逻辑相同，只是换成线程安全的普通队列）"""
+    reranker = LengthReranker()
+    request_queue, ready_queue = queue.Queue(), queue.Queue()
+    response_queues = [queue.Queue(), queue.Queue()]
+    thread = threading.Thread(target=run_rerank_service, daemon=True, args=(
+        request_queue, response_queues, ready_queue, 64, None, lambda: reranker))
+    thread.start()
+    assert ready_queue.get(timeout=5) == "reranker"
+    workers = [RemoteReranker(i, request_queue, response_queues[i], timeout=5) for i in range(2)]
+    yield reranker, workers
+    request_queue.put(None)
+    thread.join(timeout=5)
+
+
+def chunks(*texts):
+    return [{"id": i, "text": text, "metadata": {"page": 1}} for i, text in enumerate(texts)]
+
+
+def test_scores_are_routed_back_to_the_requesting_worker(service):
+    reranker, workers = service
+    # 先让服务卡住，使两个进程的请求在队列里排在一起，再一次放行
+    reranker.release.clear()
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(workers[i % 2].score, "q" * (i + 1), chunks("x" * (i + 1), "y")) for i in range(4)]
+        threading.Timer(0.2, reranker.release.set).start()
+        results = [future.result(timeout=5) for future in futures]
+    assert results == [[101.0, 101.0], [202.0, 201.0], [303.0, 301.0], [404.0, 401.0]]
+    assert sum(reranker.batches) == 4 and len(reranker.batches) < 4
+    assert workers[0].stats()["requests"] + workers[1].stats()["requests"] == 4
+
+
+def test_service_errors_are_raised_in_the_worker(service):
+    _, workers = service
+    with pytest.raises(RuntimeError, match="bad input"):
+        workers[0].score("boom", chunks("x"))
+    # 出错之后服务继续工作
+    assert workers[0].score("q", chunks("x")) == [101.0]
+
+
+def test_stalled_service_times_out():
+    reranker = RemoteReranker(0, queue.Queue(), queue.Queue(), timeout=0.1)
+    with pytest.raises(RerankServiceUnavailable):
+        reranker.score("q", chunks("x"))
+    assert reranker.stats()["timeouts"] == 1
+    assert not reranker._pending
+
+
+def test_read_only_embedding_cache_never_writes(tmp_path):
+    owner = EmbeddingCache(tmp_path, 4)
+    owner.put_many("m", ["apple"], np.ones((1, 4), dtype=np.float32))
+    owner.flush()
+    index_before = (tmp_path / "index.json").read_bytes()
+
+    worker = EmbeddingCache(tmp_path, 4, read_only=True)
+    worker.put_many("m", ["banana"], np.zeros((1, 4), dtype=np.float32))
+    worker.flush()
+    vectors, missing = worker.get_many("m", ["apple", "banana"])
+    assert missing == [1]
+    np.testing.assert_array_equal(vectors[0], np.ones(4))
+    assert (tmp_path / "index.json").read_bytes() == index_before
+
+    _, missing = EmbeddingCache(tmp_path / "absent", 4, read_only=True).get_many("m", ["apple"])
+    assert missing == [0]
+    assert not (tmp_path / "absent").exists()